@@ -1,44 +1,77 @@
-from biobb_mem.fatslim.fatslim_apl import fatslim_apl
+from model_workflow.tools.get_reduced_trajectory import calculate_frame_step
+from model_workflow.utils.pyt_spells import get_pytraj_trajectory
+from model_workflow.utils.selections import Selection
 from model_workflow.utils.auxiliar import save_json
 from model_workflow.utils.type_hints import *
 from scipy.interpolate import griddata
-from contextlib import redirect_stdout
-import pandas as pd
+from scipy.spatial import Voronoi
 import numpy as np
-import os
 
+# Leaflets in the membrane map and their labels in the output
+LEAFLETS = { 'bot': 'lower leaflet', 'top': 'upper leaflet' }
 
 def area_per_lipid (
     input_structure_filepath : str,
     input_trajectory_filepath : str,
     output_analysis_filepath : str,
-    membrane_map: dict,):
+    membrane_map: dict,
+    snapshots : int,
+    frames_limit: int = 100,
+    interpolation : str = 'linear'):
 
     if membrane_map is None or membrane_map['n_mems'] == 0:
         print('-> Skipping area per lipid analysis')
         return
     print('-> Running area per lipid analysis')
 
+    if interpolation not in ['linear', 'nearest']:
+        raise ValueError(f'Not supported interpolation method "{interpolation}". Use "linear" or "nearest"')
+
+    # Set the head group atoms of every leaflet of every membrane
+    # Head groups are tessellated separately for every leaflet of every membrane
+    leaflet_heads = []
     head_sel = []
     for n in range(membrane_map['n_mems']):
-        head_sel.extend(membrane_map['mems'][str(n)]['polar_atoms']['top'])
-        head_sel.extend(membrane_map['mems'][str(n)]['polar_atoms']['bot'])
-    head_sel_mda = 'index ' + " ".join(map(str,(head_sel)))
-    # Run the analysis on the whole membrane
-    prop = {
-    'lipid_selection': head_sel_mda,
-    'ignore_no_box': True,
-    'disable_logs': True,
-    }
-    apl_tmp = '.apl.csv'
-    print(' Running BioBB FATSLiM APL')
-    with redirect_stdout(None):
-        fatslim_apl(input_top_path=input_structure_filepath,
-                    input_traj_path=input_trajectory_filepath,
-                    output_csv_path=apl_tmp,
-                    properties=prop)
-    grids, grid_x, grid_y, m, s = process_apl(apl_tmp)
-    os.remove(apl_tmp)
+        for leaflet in LEAFLETS:
+            heads = membrane_map['mems'][str(n)]['polar_atoms'][leaflet]
+            leaflet_heads.append((leaflet, heads))
+            head_sel.extend(heads)
+    # Load only the head group atoms, so every frame is read with the minimum coordinates
+    # Note that pytraj keeps atoms sorted after stripping so we must find where every head atom is
+    head_sel = sorted(set(head_sel))
+    head_positions = { atom_index: position for position, atom_index in enumerate(head_sel) }
+    leaflet_heads = [ (leaflet, np.array([ head_positions[h] for h in heads ], dtype=int))
+        for leaflet, heads in leaflet_heads ]
+    tj = get_pytraj_trajectory(input_structure_filepath, input_trajectory_filepath, Selection(head_sel))
+    frame_step, _ = calculate_frame_step(snapshots, frames_limit)
+
+    # Sum the area of every lipid along the trajectory
+    # Keep also the coordinates of lipids in the first frame to build the grid
+    area_sums = np.zeros(len(head_sel))
+    area_counts = np.zeros(len(head_sel))
+    first_frame_coordinates = None
+    for frame in tj.iterframe(start=0, stop=snapshots, step=frame_step):
+        xy_coordinates = np.array(frame.xyz[:, 0:2], dtype=float)
+        box = frame.box.values[0:2]
+        if first_frame_coordinates is None:
+            first_frame_coordinates = xy_coordinates
+        for _, heads in leaflet_heads:
+            if len(heads) == 0:
+                continue
+            areas = get_voronoi_areas(xy_coordinates[heads], box)
+            valid = np.isfinite(areas)
+            area_sums[heads[valid]] += areas[valid]
+            area_counts[heads[valid]] += 1
+    # Get the per-lipid averages
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_areas = area_sums / area_counts
+
+    # Define common grid for both leaflets and interpolate the average areas in every leaflet
+    grids, grid_x, grid_y = get_apl_grids(first_frame_coordinates, average_areas, leaflet_heads, interpolation)
+    # Get the median and standard deviation of the per-lipid areas
+    valid_areas = average_areas[np.isfinite(average_areas)]
+    m = float(np.median(valid_areas)) if len(valid_areas) > 0 else float('nan')
+    s = float(valid_areas.std(ddof=1)) if len(valid_areas) > 1 else float('nan')
     # Replace NaNs with -1 in the grids so the loader don't break
     grids = [np.nan_to_num(grid, nan=-1) for grid in grids]
     # Save the data
@@ -54,23 +87,75 @@ def area_per_lipid (
     save_json(data, output_analysis_filepath)
 
 
-def process_apl(output_csv_path, res=100j):
-    df = pd.read_csv(output_csv_path)
-    grids = []
-    # Create separate plots for each leaflet
-    df['Area per lipid'] *= 100  # Convert to A^2
-    m = df['Area per lipid'].median()
-    s = df['Area per lipid'].std()
-    
+def get_voronoi_areas (xy_coordinates : 'np.ndarray', box : 'np.ndarray') -> 'np.ndarray':
+    """Get the area of the 2D Voronoi cell of every point, considering periodic boundary conditions.
+    Points are replicated in the 8 neighbour images of the box so cells in the box are always closed.
+    If there is no box then cells in the border are open and their area is returned as nan."""
+    points_count = len(xy_coordinates)
+    # Voronoi requires at least 4 points in 2D
+    # Also we cannot tessellate a leaflet with no box and too few points
+    has_box = box[0] > 0 and box[1] > 0
+    if has_box:
+        wrapped = xy_coordinates % box
+        shifts = np.array([ (i, j) for i in (0, -1, 1) for j in (0, -1, 1) ]) * box
+        points = (wrapped[np.newaxis,:,:] + shifts[:,np.newaxis,:]).reshape(-1, 2)
+    else:
+        if points_count < 4:
+            return np.full(points_count, np.nan)
+        points = xy_coordinates
+    voronoi = Voronoi(points)
+    # Calculate areas of all cells at once by splitting every cell in triangles
+    # Every ridge between two points makes a triangle with each of these points
+    ridge_points = voronoi.ridge_points
+    ridge_vertices = np.array(voronoi.ridge_vertices)
+    # Skip ridges which extend to infinity
+    closed = (ridge_vertices >= 0).all(axis=1)
+    # Ridges only matter when at least one of the points is an original point
+    # Note that original points come first since the first shift is (0, 0)
+    relevant = closed & (ridge_points < points_count).any(axis=1)
+    ridge_points = ridge_points[relevant]
+    ridge_vertices = ridge_vertices[relevant]
+    first_vertices = voronoi.vertices[ridge_vertices[:,0]]
+    second_vertices = voronoi.vertices[ridge_vertices[:,1]]
+    areas = np.zeros(points_count)
+    for side in range(2):
+        point_indices = ridge_points[:,side]
+        original = point_indices < points_count
+        origins = points[point_indices[original]]
+        a = first_vertices[original] - origins
+        b = second_vertices[original] - origins
+        triangle_areas = 0.5 * np.abs(a[:,0] * b[:,1] - a[:,1] * b[:,0])
+        areas += np.bincount(point_indices[original], weights=triangle_areas, minlength=points_count)
+    # Cells which are not closed have no valid area
+    if not has_box:
+        regions = [ voronoi.regions[region] for region in voronoi.point_region ]
+        open_cells = np.array([ len(region) == 0 or -1 in region for region in regions ])
+        areas[open_cells] = np.nan
+    return areas
+
+
+def get_apl_grids (
+    xy_coordinates : 'np.ndarray',
+    areas : 'np.ndarray',
+    leaflet_heads : list,
+    interpolation : str = 'linear',
+    res = 100j):
+    """Interpolate per-lipid areas in a regular grid for every leaflet."""
     # Define common grid for both plots
-    x_all = df['X coords']
-    y_all = df['Y coords']
+    x_all = xy_coordinates[:,0]
+    y_all = xy_coordinates[:,1]
     grid_x, grid_y = np.mgrid[min(x_all):max(x_all):res,
                              min(y_all):max(y_all):res]
-    for leaflet in ['lower leaflet', 'upper leaflet']:
-        df_leaflet = df[df['leaflet'] == leaflet]
-        points = np.stack((np.array(df_leaflet['X coords']).T, np.array(df_leaflet['Y coords']).T), axis=-1)
-        values = np.array(df_leaflet['Area per lipid'])
-        grid = griddata(points, values, (grid_x, grid_y), method='cubic')
+    grids = []
+    for leaflet in LEAFLETS:
+        heads = np.concatenate([ h for l, h in leaflet_heads if l == leaflet ])
+        heads = heads[np.isfinite(areas[heads])]
+        # If there are not enough points to interpolate then leave the grid empty
+        if len(heads) < 3 and interpolation == 'linear' or len(heads) == 0:
+            grids.append(np.full(grid_x.shape, np.nan))
+            continue
+        points = xy_coordinates[heads]
+        values = areas[heads]
+        grid = griddata(points, values, (grid_x, grid_y), method=interpolation)
         grids.append(grid)
-    return grids, grid_x, grid_y, m, s
+    return grids, grid_x, grid_y
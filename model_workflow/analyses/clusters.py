@@ -6,8 +6,8 @@ import mdtraj as mdt
 
 from model_workflow.utils.auxiliar import round_to_thousandths, save_json, otherwise
 from model_workflow.utils.auxiliar import numerate_filename, get_analysis_name
-from model_workflow.utils.auxiliar import reprint, delete_previous_log
-from model_workflow.tools.get_screenshot import get_screenshot
+from model_workflow.utils.auxiliar import delete_previous_log
+from model_workflow.tools.get_screenshot import get_screenshots
 from model_workflow.tools.get_reduced_trajectory import get_reduced_trajectory
 from model_workflow.utils.type_hints import *
 
@@ -197,9 +197,10 @@ def clusters_analysis (
         # Now for every cluster find the most representative frame (i.e. the one with less RMSD distance to its neighbours)
         # Then make a screenshot for this specific frame
         representative_frames = []
-        # Save the screenshot parameters so we can keep images coherent between clusters
-        screenshot_parameters = None
-        print(' Generating cluster screenshots') # This will be reprinted
+        # Save the coordinates and filenames of every screenshot so we can take them all together
+        # This way images are coherent between clusters and VMD is run only once
+        screenshots_coordinates = []
+        screenshot_filenames = []
         for c, cluster in enumerate(clusters):
             most_representative_frame = None
             min_distance = float('inf') # Positive infinity
@@ -216,19 +217,18 @@ def clusters_analysis (
             representative_frames.append(most_representative_frame)
             # Once we have the most representative frame we take a screenshot
             # This screenshots will be then uploaded to the database as well
-            # Generate a pdb with coordinates from the most representative frame
+            # Get coordinates from the most representative frame
             mdt_frame = traj[most_representative_frame]
             coordinates = mdt_frame.xyz[0] * 10 # We multiply by to restor Ångstroms
             # WARNING: a PDB generated by MDtraj may have problems thus leading to artifacts in the screenshot
             # WARNING: to avoid this we add the coordinates to the structure
-            # coordinates.save(AUXILIAR_PDB_FILENAME)
-            auxiliar_structure.set_new_coordinates(coordinates)
+            screenshots_coordinates.append(coordinates)
             # Set the screenshot filename from the input template
             screenshot_filename = output_screenshots_filename.replace('*', str(r).zfill(2)).replace('??', str(c).zfill(2))
-            # Generate the screenshot
-            reprint(f' Generating cluster screenshot {c+1}/{n_clusters}')
-            screenshot_parameters = get_screenshot(auxiliar_structure, screenshot_filename,
-                parameters=screenshot_parameters, message=None)
+            screenshot_filenames.append(screenshot_filename)
+        # Generate all screenshots at once
+        print(f' Generating {n_clusters} cluster screenshots')
+        get_screenshots(auxiliar_structure, screenshots_coordinates, screenshot_filenames, message=None)
 
         # Set the output clusters which include all frames in the cluster and the main or more representative frame
         output_clusters = []
@@ -1,8 +1,11 @@
-from model_workflow.utils.pyt_spells import get_reduced_pytraj_trajectory
+from model_workflow.tools.get_reduced_trajectory import calculate_frame_step
+from model_workflow.utils.pyt_spells import get_pytraj_trajectory
 from model_workflow.utils.auxiliar import save_json
 from model_workflow.utils.type_hints import *
+import numpy as np
 
-import pytraj as pt
+# Conversion factor from amu/Å³ to g/cm³, as cpptraj does for mass densities
+AMU_PER_ANG3_TO_G_PER_CM3 = 1.66053906660
 
 def density (
     input_structure_filepath : str,
@@ -12,7 +15,8 @@ def density (
     structure : 'Structure',
     snapshots : int,
     density_types = ['number', 'mass', 'charge', 'electron'],
-    frames_limit = 1000):
+    frames_limit = 1000,
+    delta : float = 0.25):
 
     if membrane_map is None or membrane_map['n_mems'] == 0:
         print('-> Skipping density analysis')
@@ -20,7 +24,8 @@ def density (
     print('-> Running density analysis')
 
     # Load
-    tj, frame_step, frames_count = get_reduced_pytraj_trajectory(input_structure_filepath, input_trajectory_filepath, snapshots, frames_limit)
+    tj = get_pytraj_trajectory(input_structure_filepath, input_trajectory_filepath)
+    frame_step, _ = calculate_frame_step(snapshots, frames_limit)
     
     # Set every selections to be analyzed separately
     components = []
@@ -33,8 +38,8 @@ def density (
             'charge': {}, # charge will be all 0 because we cannot add charges to pytraj topology
             'electron': {}
         })
-    # Parse selections to pytraj masks
-    pytraj_masks = [ component['selection'].to_pytraj() for component in components ]
+    # Get atom indices of every selection
+    component_atom_indices = [ component['selection'].atom_indices for component in components ]
     # Add polar atoms selection
     polar_atoms = []
     for n in range(membrane_map['n_mems']):
@@ -45,17 +50,75 @@ def density (
         'selection': polar_atoms,
         'number': {},'mass': {},'charge': {},'electron': {}
     }) 
-    pytraj_masks.append('@'+', '.join(map(str,polar_atoms)))
+    component_atom_indices.append(polar_atoms)
 
-    # Run pytraj
-    for density_type in density_types:
-        out = pt.density(tj, pytraj_masks, density_type)
-        # Iterate pytraj results
-        results = iter(out.values())
-        for component in components:
-            # Mine pytraj results
-            component[density_type]['dens'] = list(next(results))
-            component[density_type]['stdv'] = list(next(results))
+    # Set the weight of every atom for every density type
+    # Electrons are the atomic number minus the charge, as cpptraj does
+    topology = tj.top
+    masses = np.array(topology.mass, dtype=float)
+    charges = np.array(topology.charge, dtype=float)
+    atomic_numbers = np.array([ atom.atomic_number for atom in topology.atoms ], dtype=float)
+    all_weights = {
+        'number': np.ones(topology.n_atoms),
+        'mass': masses * AMU_PER_ANG3_TO_G_PER_CM3,
+        'charge': charges,
+        'electron': atomic_numbers - charges,
+    }
+    weights = np.array([ all_weights[density_type] for density_type in density_types ])
+
+    # Flatten all selections in a single pair of arrays: atom index and component index
+    # Note that an atom may belong to several components (e.g. polar atoms)
+    membership_atoms = np.concatenate([ np.array(indices, dtype=int) for indices in component_atom_indices ])
+    membership_components = np.concatenate([ np.full(len(indices), c, dtype=int)
+        for c, indices in enumerate(component_atom_indices) ])
+    components_count = len(components)
+    types_count = len(density_types)
+
+    # Accumulate per-frame densities of all components and types in a single trajectory pass
+    # Bins are relative to the first bin (bin_offset) and arrays grow as new z ranges are found
+    bin_offset = None
+    density_sums = np.zeros((types_count, components_count, 0))
+    density_squared_sums = np.zeros((types_count, components_count, 0))
+    frames_count = 0
+    for frame in tj.iterframe(start=0, stop=snapshots, step=frame_step):
+        frames_count += 1
+        if len(membership_atoms) == 0:
+            continue
+        # Bin z coordinates of all atoms at once
+        atom_bins = np.floor(frame.xyz[membership_atoms, 2] / delta).astype(int)
+        min_bin, max_bin = atom_bins.min(), atom_bins.max()
+        # Grow accumulators if the current frame falls outside the current bins
+        if bin_offset is None:
+            bin_offset = min_bin
+        bins_count = density_sums.shape[2]
+        new_offset = min(bin_offset, min_bin)
+        new_bins_count = max(bin_offset + bins_count, max_bin + 1) - new_offset
+        if new_offset != bin_offset or new_bins_count != bins_count:
+            padding = ((0, 0), (0, 0), (bin_offset - new_offset, new_bins_count - bins_count - (bin_offset - new_offset)))
+            density_sums = np.pad(density_sums, padding)
+            density_squared_sums = np.pad(density_squared_sums, padding)
+            bin_offset, bins_count = new_offset, new_bins_count
+        # Count every atom in its component and bin, for all density types at once
+        keys = membership_components * bins_count + (atom_bins - bin_offset)
+        # Slice volume is the box area in the XY plane times the bin width
+        box = frame.box.values
+        volume = box[0] * box[1] * delta
+        frame_densities = np.array([
+            np.bincount(keys, weights=type_weights[membership_atoms], minlength=components_count * bins_count)
+            for type_weights in weights ]).reshape(types_count, components_count, bins_count) / volume
+        density_sums += frame_densities
+        density_squared_sums += frame_densities ** 2
+
+    # Get the average and standard deviation along frames
+    averages = density_sums / max(frames_count, 1)
+    stdvs = np.sqrt(np.maximum(density_squared_sums / max(frames_count, 1) - averages ** 2, 0))
+    for t, density_type in enumerate(density_types):
+        for c, component in enumerate(components):
+            component[density_type]['dens'] = averages[t, c].tolist()
+            component[density_type]['stdv'] = stdvs[t, c].tolist()
+    # Set the center of every bin
+    bins_count = density_sums.shape[2]
+    z = ((np.arange(bins_count) + (bin_offset or 0) + 0.5) * delta).tolist()
 
     # Parse the selection to atom indices
     # Selections could be removed to make the file smaller
@@ -63,5 +126,5 @@ def density (
         if component['name'] == 'polar': continue
         component['selection'] = component['selection'].atom_indices
     # Export results
-    data = {'data': { 'comps': components, 'z': list(out['z']) } }
-    save_json(data, output_analysis_filepath)
\ No newline at end of file
+    data = {'data': { 'comps': components, 'z': z } }
+    save_json(data, output_analysis_filepath)
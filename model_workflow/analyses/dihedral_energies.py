@@ -46,29 +46,11 @@ def compute_dihedral_energies (
     # Compute dihedral torsions using MDtraj
     trajectory_torsions = mdt.compute_dihedrals(traj, dihedral_atom_indices)
 
-    # Results are returned by frame
+    # Results are returned by frame, i.e. an array with shape (frames, dihedrals)
     # DANI: Creo, porque he hecho las pruebas con una trayectoria de 1 frame xD
-    # Iterate frames and calculate dihedral energies for each frame
-    for frame_torsions in trajectory_torsions:
-
-        # Iterate every dihedral with its torsion
-        for dihedral_data, torsion in zip(dihedrals_data, frame_torsions):
-            atom_indices = dihedral_data['atom_indices']
-            # Dihedral torsion energy is the sum of the torsion energy of its terms
-            torsion_energy = 0
-            # Iterate dihedral terms
-            for term in dihedral_data['terms']:
-                # Get dihedral term parameters
-                k = term['force']
-                if k == 0: continue
-                n = term['period']
-                δ = term['phase']
-                φ = torsion
-                # Calculate the dihedral torsion energy according to the formula
-                term_energy = (k/2) * (1 + np.cos(n*φ - δ))
-                torsion_energy += term_energy
-            # Add torison energies to the dihedral energies object
-            dihedral_energies[atom_indices]['torsion'].append(torsion_energy)
+
+    # Calculate the dihedral torsion energies for all frames and dihedrals at once
+    torsion_energies = get_torsion_energies(trajectory_torsions, dihedrals_data)
 
     # Now calculate non covalent energies
     # These energies are always computed between atoms 1-4 in the dihedral
@@ -77,34 +59,17 @@ def compute_dihedral_energies (
 
     # Compute atom distance along the trajectory using MDtraj
     trajectory_distances = mdt.compute_distances(traj, dihedral_1_4_indices)
-            
-    # Results are returned by frame
-    # Iterate frames and calculate dihedral energies for each frame
-    for frame_distances in trajectory_distances:
-
-        # Iterate every dihedral with its 1-4 distance
-        for dihedral_data, distance in zip(dihedrals_data, frame_distances):
-            # Get scaling factors for both electrostatic and Van Der Waals parameters
-            # Note that these may be missing for some dihedrals since all its terms are to be ignored
-            # SANTI: Cuando esto pasa hay que caluclar la energía igualmente, pero sin escalarla
-            scee = dihedral_data.get('ee_scaling', 1)
-            scnb = dihedral_data.get('vdw_scaling', 1)
-            # get Leonard-Johns constants to calculate Van Der Waals energies
-            acoef = dihedral_data['lj_acoef']
-            bcoef = dihedral_data['lj_bcoef']
-            # Note that charges are not actual atom charges, but they are already scaled
-            q1 = dihedral_data['atom1_charge']
-            q4 = dihedral_data['atom4_charge']
-            # MDtraj outputs in nm and we want distance in Angstroms
-            r14 = distance * 10
-            # Calculate the dihedral electrostatic energy according to the formula
-            ee_energy = (1/scee) * (q1 * q4) / r14
-            # Calculate the dihedral Var Der Waals energy according to the formula
-            vdw_energy = (1/scnb) * (( acoef / (r14 ** 12) ) - ( bcoef / (r14 ** 6) ))
-            # Add non covalent energies to the dihedral energies object
-            atom_indices = dihedral_data['atom_indices']
-            dihedral_energies[atom_indices]['ee'].append(ee_energy)
-            dihedral_energies[atom_indices]['vdw'].append(vdw_energy)
+
+    # Calculate the dihedral electrostatic and Van Der Waals energies for all frames and dihedrals at once
+    ee_energies, vdw_energies = get_non_covalent_energies(trajectory_distances, dihedrals_data)
+
+    # Add energies to the dihedral energies object
+    # Note that dihedrals sharing the same atom indices are merged
+    for d, dihedral_data in enumerate(dihedrals_data):
+        atom_indices = dihedral_data['atom_indices']
+        dihedral_energies[atom_indices]['torsion'].extend(torsion_energies[:,d].tolist())
+        dihedral_energies[atom_indices]['ee'].extend(ee_energies[:,d].tolist())
+        dihedral_energies[atom_indices]['vdw'].extend(vdw_energies[:,d].tolist())
 
     # Reformat output data by calculating average values instead of per-frame values
     output_data = []
@@ -117,4 +82,48 @@ def compute_dihedral_energies (
         })
 
     # Write results to disk
-    save_json(output_data, output_analysis_filepath)
\ No newline at end of file
+    save_json(output_data, output_analysis_filepath)
+
+# Calculate the dihedral torsion energies from the torsions of every frame and dihedral
+# Torsions are an array with shape (frames, dihedrals) and so are the returned energies
+def get_torsion_energies (trajectory_torsions : np.ndarray, dihedrals_data : List[dict]) -> np.ndarray:
+    # Pack dihedral term parameters in arrays with shape (dihedrals, terms)
+    # Dihedrals with less terms are padded with zero force terms, which add no energy
+    max_terms = max([ len(data['terms']) for data in dihedrals_data ], default=0)
+    forces = np.zeros((len(dihedrals_data), max_terms))
+    periods = np.zeros((len(dihedrals_data), max_terms))
+    phases = np.zeros((len(dihedrals_data), max_terms))
+    for d, dihedral_data in enumerate(dihedrals_data):
+        for t, term in enumerate(dihedral_data['terms']):
+            forces[d,t] = term['force']
+            periods[d,t] = term['period']
+            phases[d,t] = term['phase']
+
+    # Calculate the dihedral torsion energy according to the formula for all frames, dihedrals and terms at once
+    # Dihedral torsion energy is the sum of the torsion energy of its terms
+    φ = trajectory_torsions[:,:,np.newaxis]
+    torsion_energies = ((forces/2) * (1 + np.cos(periods*φ - phases))).sum(axis=2)
+    return torsion_energies
+
+# Calculate the dihedral electrostatic and Van Der Waals energies from the 1-4 distances of every frame and dihedral
+# Distances are an array with shape (frames, dihedrals) in nm and so are both returned energies
+def get_non_covalent_energies (trajectory_distances : np.ndarray, dihedrals_data : List[dict]) -> Tuple[np.ndarray, np.ndarray]:
+    # Get scaling factors for both electrostatic and Van Der Waals parameters
+    # Note that these may be missing for some dihedrals since all its terms are to be ignored
+    # SANTI: Cuando esto pasa hay que caluclar la energía igualmente, pero sin escalarla
+    scee = np.array([ data.get('ee_scaling', 1) for data in dihedrals_data ], dtype=float)
+    scnb = np.array([ data.get('vdw_scaling', 1) for data in dihedrals_data ], dtype=float)
+    # get Leonard-Johns constants to calculate Van Der Waals energies
+    acoef = np.array([ data['lj_acoef'] for data in dihedrals_data ], dtype=float)
+    bcoef = np.array([ data['lj_bcoef'] for data in dihedrals_data ], dtype=float)
+    # Note that charges are not actual atom charges, but they are already scaled
+    q1 = np.array([ data['atom1_charge'] for data in dihedrals_data ], dtype=float)
+    q4 = np.array([ data['atom4_charge'] for data in dihedrals_data ], dtype=float)
+    # MDtraj outputs in nm and we want distance in Angstroms
+    r14 = trajectory_distances * 10
+    # Calculate the dihedral electrostatic energy according to the formula for all frames and dihedrals at once
+    ee_energies = (1/scee) * (q1 * q4) / r14
+    # Calculate the dihedral Var Der Waals energy according to the formula
+    r14_6 = r14 ** 6
+    vdw_energies = (1/scnb) * (( acoef / (r14_6 ** 2) ) - ( bcoef / r14_6 ))
+    return ee_energies, vdw_energies
@@ -16,19 +16,21 @@
 # Gelpí, J.L., Kalko, S.G., Barril, X., Cirera, J., de la Cruz, X., Luque, F.J. and Orozco, M. (2001), Classical molecular interaction potentials: Improved setup procedure in molecular dynamics simulations of proteins. Proteins, 45: 428-437. doi:10.1002/prot.1159
 
 # Imports libraries
-from os import mkdir, remove
-from os.path import exists
-from shutil import copyfile
+from os import mkdir, remove, replace
+from os.path import exists, abspath
+from shutil import copyfile, rmtree
 from pathlib import Path
 from glob import glob
 import re
 import math
+import numpy
 from subprocess import run, PIPE
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-from model_workflow.tools.get_pdb_frames import get_pdb_frames
-from model_workflow.utils.auxiliar import load_json, save_json, warn, numerate_filename, get_analysis_name
+from model_workflow.utils.pyt_spells import get_reduced_pytraj_trajectory
+from model_workflow.utils.auxiliar import load_json, save_json, warn, reprint, numerate_filename, get_analysis_name
 from model_workflow.utils.constants import PROTEIN_RESIDUE_NAME_LETTERS, NUCLEIC_RESIDUE_NAME_LETTERS
-from model_workflow.utils.structures import Structure
 from model_workflow.utils.file import File
 from model_workflow.utils.type_hints import *
 
@@ -57,7 +59,9 @@ def energies (
     snapshots : int,
     frames_limit : int,
     verbose : bool = False,
-    debug : bool = False):
+    debug : bool = False,
+    # Number of frames to be processed in parallel
+    cores : int = 1):
 
     print('-> Running energies analysis')
 
@@ -92,8 +96,10 @@ def energies (
     # This is useful to restore these values in case the analysis is disrupt since it is a long analysis
     energies_backup = File(energies_folder + '/backup.json')
 
-    # Define an additional file generated by CMIP which must be handled (written in the energies folder and deleted)
-    restart_file = File(energies_folder + '/restart')
+    # The debug mode leaves everything ready in the energies folder for the first frame and stops
+    # For this reason it makes no sense to run it in parallel
+    if debug:
+        cores = 1
 
     # Check the number of atoms on each interacting agent
     # If there is any agent with more than 80000 atoms CMIP will fail so we must skip this specific energies analysis by now
@@ -126,28 +132,32 @@ def energies (
     set_cmip_elements(energies_structure)
 
     # Save the structure back to a pdb
+    # This is used as topology to read the trajectory coordinates
     energies_structure_file = File(energies_folder + '/energies.pdb')
     energies_structure.generate_pdb_file(energies_structure_file.path)
 
-    # Transform an agent structure to a cmip input pdb, which includes charges and cmip-friendly elements
+    # Set the scratch folder where CMIP is run by the main process (i.e. not by frame workers)
+    # Note that paths must be absolute since CMIP is run from inside the scratch folder
+    main_scratch_folder = abspath(energies_folder)
+
+    # Prepare the template of a CMIP input pdb, which includes charges and cmip-friendly elements
+    # Only coordinates change along frames so everything else is prepared here once
     # If this is to be a host file then leave only atoms involved in the interaction: both host and guest agents
     # If this is to be a host file, all guest atoms are set dummy* as well
     # If this is to be a guest file then remove all host atoms as well
-    # Note that the frame structure is not the standard structure, which would already include charges
-    # For this reason, charges are included in the frame structure before
+    # Charges are taken from the input charges list since the energies structure does not include them
     # Also flag some atoms as 'dummy' by adding a 'X' before the element
     # *Dummy atoms are not considered in the calculation but they stand for a region with low dielectric
     # If removed, the void left by these atoms would be considered to be filled with solvent, which has a high dielectric
     # These dielectric differences have a strong impact on the calculation
     # By default we set as dummy host atoms involved in a covalent bond with guest atoms
-    def pdb2cmip (
+    def prepare_cmip_template (
         agent_name : str,
         host_file : bool,
-        frame_structure : 'Structure',
         host_selection : 'Selection',
         guest_selection : 'Selection',
         strong_bonds : Optional[list]
-    ) -> File:
+    ) -> dict:
         # Get atom indices for host atoms involved in a covalent bond with guest atoms
         # If this is the host, they will be further marked as dummy for CMIP to ignore them in the calculations
         # If this is the guest, they will be removed
@@ -166,104 +176,128 @@ def energies (
         # If this is the guest file then keep only guest atoms
         # Always remove strong bond atoms in the guest
         selection = host_selection + guest_selection if host_file else guest_selection
-        strong_bond_selection = frame_structure.select_atom_indices(strong_bond_atom_indices)
+        strong_bond_selection = energies_structure.select_atom_indices(strong_bond_atom_indices)
         guest_strong_bonds = guest_selection & strong_bond_selection
         selection -= guest_strong_bonds
-        # Filter the selected atoms in the structure
-        selected_structure = frame_structure.filter(selection)
-        # Set atom charges (non standard attribute), which are used further to write the adapted cmip pdb
-        # Set also the elements to macth the original structure, since the frame generator messes the elements
-        for a, atom in enumerate(selected_structure.atoms):
-            atom_index = selection.atom_indices[a]
-            charge = charges[atom_index]
-            setattr(atom, 'charge', charge)
-            cmip_element = energies_structure.atoms[atom_index].element
-            atom.element = cmip_element
-        # Write a special pdb which contains charges as CMIP expects to find them and dummy atoms flagged
-        output_filepath = f'{energies_folder}/{agent_name}_{"host" if host_file else "guest"}.cmip.pdb'
+        # Set the constant parts of every atom line: the part before the coordinates and the part after them
+        heads = []
+        tails = []
+        for a, atom_index in enumerate(selection.atom_indices):
+            atom = energies_structure.atoms[atom_index]
+            index = str(a+1).rjust(5)
+            atom_name = atom.name
+            name =  ' ' + atom_name.ljust(3) if len(atom_name) < 4 else atom_name
+            residue = atom.residue
+            residue_name = residue.name.ljust(3)
+            chain = atom.chain
+            chain_name = chain.name.rjust(1)
+            residue_number = str(residue.number).rjust(4)
+            icode = residue.icode.rjust(1)
+            charge = "{:.4f}".format(charges[atom_index])
+            # In case this atom is making an strong bond between both interacting agents we add an 'X' before the element
+            # This way CMIP will ignore the atom. Otherwise it would return high non-sense Van der Waals values
+            is_dummy = atom_index in dummy_atom_indices
+            cmip_dummy_flag = 'X' if is_dummy else ''
+            # Note that elements were already set in CMIP format
+            element = atom.element
+            heads.append('ATOM  ' + index + ' ' + name + ' ' + residue_name + ' '
+                + chain_name + residue_number + icode + '   ')
+            tails.append(' ' + str(charge).rjust(7) + '  ' + cmip_dummy_flag + element + '\n')
+        return {
+            'filename': f'{agent_name}_{"host" if host_file else "guest"}.cmip.pdb',
+            'atom_indices': numpy.array(selection.atom_indices, dtype=int),
+            'heads': heads,
+            'tails': tails,
+        }
+
+    # Write a special pdb which contains charges as CMIP expects to find them and dummy atoms flagged
+    # Use a template from the previous function and the current frame coordinates
+    def write_cmip_pdb (template : dict, frame_coordinates : 'numpy.ndarray', scratch_folder : str) -> File:
+        output_filepath = f'{scratch_folder}/{template["filename"]}'
+        coordinates = frame_coordinates[template['atom_indices']]
         with open(output_filepath, "w") as file:
             # Write a line for each atom
-            for a, atom in enumerate(selected_structure.atoms):
-                index = str(a+1).rjust(5)
-                atom_name = atom.name
-                name =  ' ' + atom_name.ljust(3) if len(atom_name) < 4 else atom_name
-                residue = atom.residue
-                residue_name = residue.name.ljust(3)
-                chain = atom.chain
-                chain_name = chain.name.rjust(1)
-                residue_number = str(residue.number).rjust(4)
-                icode = residue.icode.rjust(1)
-                coords = atom.coords
+            for head, tail, coords in zip(template['heads'], template['tails'], coordinates):
                 x_coord, y_coord, z_coord = [ "{:.3f}".format(coord).rjust(8) for coord in coords ]
-                charge = "{:.4f}".format(atom.charge) # Charge was manually added before, it is not a standard attribute
-                # In case this atom is making an strong bond between both interacting agents we add an 'X' before the element
-                # This way CMIP will ignore the atom. Otherwise it would return high non-sense Van der Waals values
-                real_index = selection.atom_indices[a]
-                # Set if atom is to be ignored
-                is_dummy = real_index in dummy_atom_indices
-                cmip_dummy_flag = 'X' if is_dummy else ''
-                element = atom.element
-                atom_line = ('ATOM  ' + index + ' ' + name + ' ' + residue_name + ' '
-                    + chain_name + residue_number + icode + '   ' + x_coord + y_coord + z_coord
-                    + ' ' + str(charge).rjust(7) + '  ' + cmip_dummy_flag + element + '\n')
-                file.write(atom_line)
-
+                file.write(head + x_coord + y_coord + z_coord + tail)
         return File(output_filepath)
 
-    # Run CMIP in 'checkonly' mode (i.e. start and stop) for both agents
-    # Mine the grid generated by CMIP for both agents and calculate a new grid which would include both
-    # Finally, modify the provided 'cmip_inputs' with the new grid parameters
-    def adapt_cmip_grid (agent1_cmip_pdb : File, agent2_cmip_pdb : File, cmip_inputs : File) -> tuple:
-
+    # Run CMIP in 'checkonly' mode (i.e. start and stop) for an agent and mine the grid generated by CMIP
+    def get_cmip_checkonly_grid (agent_cmip_pdb : File, other_cmip_pdb : File, scratch_folder : str) -> tuple:
         # Set a name for the checkonly CMIP outputs
         # This name is not important, since the data we want is in the CMIP logs
-        cmip_checkonly_output = File(energies_folder + '/checkonly.energy.pdb')
-
+        cmip_checkonly_output = File(scratch_folder + '/checkonly.energy.pdb')
+        # Set the additional file generated by CMIP which must be handled
+        restart_file = File(scratch_folder + '/restart')
         # Run CMIP in 'checkonly' mode and save the grid dimensions output
-        # First do it for the agent 1
-        cmip_logs_agent1 = run([
-            "cmip",
-            "-i",
-            cmip_inputs_checkonly_source.path,
-            "-pr",
-            agent1_cmip_pdb.path,
-            "-vdw",
-            vdw_source.path,
-            "-hs",
-            agent2_cmip_pdb.path,
-            "-byat",
-            cmip_checkonly_output.path,
-            "-rst",
-            restart_file.path
-        ], stdout=PIPE, stderr=PIPE).stdout.decode()
-
-        # Mine the grid dimensions from CMIP logs
-        agent1_center, agent1_density, agent1_units = mine_cmip_output(
-            cmip_logs_agent1.split("\n"))
-
-        # Run CMIP in 'checkonly' mode and save the grid dimensions output
-        # Now do it for the agent 2
-        cmip_logs_agent2 = run([
+        # Note that CMIP is run from the scratch folder so all paths must be absolute
+        cmip_logs = run([
             "cmip",
             "-i",
-            cmip_inputs_checkonly_source.path,
+            cmip_inputs_checkonly_source.absolute_path,
             "-pr",
-            agent2_cmip_pdb.path,
+            agent_cmip_pdb.absolute_path,
             "-vdw",
-            vdw_source.path,
+            vdw_source.absolute_path,
             "-hs",
-            agent1_cmip_pdb.path,
+            other_cmip_pdb.absolute_path,
             "-byat",
-            cmip_checkonly_output.path,
+            cmip_checkonly_output.absolute_path,
             "-rst",
-            restart_file.path
-        ], stdout=PIPE, stderr=PIPE).stdout.decode()
-
+            restart_file.absolute_path
+        ], stdout=PIPE, stderr=PIPE, cwd=scratch_folder).stdout.decode()
+        # Delete the 'ckeckonly' file
+        if cmip_checkonly_output.exists:
+            cmip_checkonly_output.remove()
         # Mine the grid dimensions from CMIP logs
-        agent2_center, agent2_density, agent2_units = mine_cmip_output(
-            cmip_logs_agent2.split("\n"))
+        return mine_cmip_output(cmip_logs.split("\n"))
+
+    # Set an additional margin around the atoms envelope for the CMIP grid (Å)
+    grid_safety_margin = 2
+
+    # Calculate a CMIP grid which is valid for all frames
+    # CMIP is run in 'checkonly' mode for both agents in a single frame to find out the margin it leaves around atoms
+    # Then this margin is applied around the envelope of agent atoms along all frames
+    # Finally, a new grid which would include both agent grids is calculated and written in a new CMIP inputs file
+    def setup_cmip_grid (
+        agent1_template : dict,
+        agent2_template : dict,
+        agent1_envelope : tuple,
+        agent2_envelope : tuple,
+        frame_coordinates : 'numpy.ndarray',
+        cmip_inputs : File
+    ) -> tuple:
+
+        # Write both agent files for the sample frame
+        agent1_cmip_pdb = write_cmip_pdb(agent1_template, frame_coordinates, main_scratch_folder)
+        agent2_cmip_pdb = write_cmip_pdb(agent2_template, frame_coordinates, main_scratch_folder)
+
+        # Get the grid CMIP would use for every agent in the sample frame and then extend it to the envelope
+        agent_grids = []
+        for template, envelope, agent_cmip_pdb, other_cmip_pdb in [
+            (agent1_template, agent1_envelope, agent1_cmip_pdb, agent2_cmip_pdb),
+            (agent2_template, agent2_envelope, agent2_cmip_pdb, agent1_cmip_pdb)
+        ]:
+            center, density, units = get_cmip_checkonly_grid(agent_cmip_pdb, other_cmip_pdb, main_scratch_folder)
+            # Get the margin between the sample frame atoms and the grid boundaries
+            sample_coordinates = frame_coordinates[template['atom_indices']]
+            sample_minimum = sample_coordinates.min(axis=0)
+            sample_maximum = sample_coordinates.max(axis=0)
+            grid_half_size = numpy.array(density) * numpy.array(units) / 2
+            lower_margin = sample_minimum - (numpy.array(center) - grid_half_size)
+            upper_margin = (numpy.array(center) + grid_half_size) - sample_maximum
+            # Apply the same margin to the envelope, plus an additional safety margin
+            envelope_minimum, envelope_maximum = envelope
+            grid_minimum = envelope_minimum - lower_margin - grid_safety_margin
+            grid_maximum = envelope_maximum + upper_margin + grid_safety_margin
+            grid_center = tuple((grid_minimum + grid_maximum) / 2)
+            grid_density = tuple((grid_maximum - grid_minimum) / numpy.array(units))
+            agent_grids.append((grid_center, grid_density, units))
+        agent1_cmip_pdb.remove()
+        agent2_cmip_pdb.remove()
 
         # Calculate grid dimensions for a new grid which contains both previous grids
+        (agent1_center, agent1_density, agent1_units), (agent2_center, agent2_density, agent2_units) = agent_grids
         new_center, new_density = compute_new_grid(
             agent1_center,
             agent1_density,
@@ -297,6 +331,10 @@ def energies (
             new_density[2] = math.ceil(new_density[2] * proportion)
             grid_unit_size = math.ceil(grid_unit_size / proportion * 1000) / 1000
             print(f'WARNING: Grid resolution has been reduced -> unit size = {grid_unit_size}')
+            # Make sure the rounding did not leave us above the limit anyway
+            reduced_grid_points = (new_density[0] + 1) * (new_density[1] + 1) * (new_density[2] + 1)
+            if reduced_grid_points > grid_points_limit:
+                raise ValueError(f'CMIP grid points ({reduced_grid_points}) still exceed the limit ({grid_points_limit})')
 
         # Set the new lines to be written in the local CMIP inputs file
         grid_inputs = [
@@ -310,19 +348,16 @@ def energies (
             f" inty={grid_unit_size} \n",
             f" intz={grid_unit_size} \n",
         ]
-        # Add previous lines to the local inputs file
-        with open(cmip_inputs.path, "r+") as file:
+        # Copy the source cmip inputs file adding previous lines
+        with open(cmip_inputs_source.path, "r") as file:
             lines = file.readlines()
-            file.seek(0)
+        with open(cmip_inputs.path, "w") as file:
             for line in lines:
                 if line == '&end \n':
                     for grid_input in grid_inputs:
                         file.write(grid_input)
                 file.write(line)
 
-        # Delete the 'ckeckonly' file
-        cmip_checkonly_output.remove()
-
         # Calculate the resulting box origin and size and return both values
         # These values are used for display / debug purposes only
         new_size = (new_density[0] * grid_unit_size, new_density[1] * grid_unit_size, new_density[2] * grid_unit_size)
@@ -330,25 +365,28 @@ def energies (
         return new_origin, new_size
 
     # Run the CMIP software to get the desired energies
-    def get_cmip_energies (cmip_inputs : File, guest : File, host : File) -> tuple:
+    def get_cmip_energies (cmip_inputs : File, guest : File, host : File, scratch_folder : str) -> tuple:
         # Set the cmip output filename, which is to be read rigth after it is generated
-        cmip_output_file = File(energies_folder + '/cmip_output.pdb')
+        cmip_output_file = File(scratch_folder + '/cmip_output.pdb')
+        # Set the additional file generated by CMIP which must be handled
+        restart_file = File(scratch_folder + '/restart')
         # Run cmip
+        # Note that CMIP is run from the scratch folder so all paths must be absolute
         cmip_logs = run([
             "cmip",
             "-i",
-            cmip_inputs.path,
+            cmip_inputs.absolute_path,
             "-pr",
-            guest.path,
+            guest.absolute_path,
             "-vdw",
-            vdw_source.path,
+            vdw_source.absolute_path,
             "-hs",
-            host.path,
+            host.absolute_path,
             "-byat",
-            cmip_output_file.path,
+            cmip_output_file.absolute_path,
             "-rst",
-            restart_file.path,
-        ], stdout=PIPE, stderr=PIPE).stdout.decode()
+            restart_file.absolute_path,
+        ], stdout=PIPE, stderr=PIPE, cwd=scratch_folder).stdout.decode()
         # Mine the electrostatic (es) and Van der Walls (vdw) energies for each atom
         # Group the results by atom adding their values
         atom_energies = []
@@ -386,69 +424,114 @@ def energies (
                 atom_energies.append(energies)
         return atom_energies
 
-    # Given a pdb structure, use CMIP to extract energies
+    # Get the trajectory frames to be analyzed
+    # Coordinates are read directly from the trajectory so there is no need to write and parse a pdb for every frame
+    reduced_trajectory, step, count = get_reduced_pytraj_trajectory(energies_structure_file.path, input_trajectory_file.path, snapshots, frames_limit)
+    non_exceeding_interactions = [interaction for interaction in interactions if not interaction.get('exceeds', False)]
+
+    # WARNING: At this point structure should be corrected
+    # WARNING: Repeated atoms will make the analysis fail
+
+    # Prepare everything which does not depend on coordinates once per interaction
+    interaction_setups = []
+    for i, interaction in enumerate(non_exceeding_interactions):
+
+        # Get covalent bonds between both agents, if any
+        # They will be not taken in count during the calculation
+        # Otherwise we would have a huge energy peak in this atom since they are very close
+        strong_bonds = interaction.get('strong_bonds', None)
+
+        # Get interaction and agent names, just for the logs
+        interaction_name = interaction['name']
+        agent1_name = interaction['agent_1'].replace(' ', '_').replace('/', '_')
+        agent2_name = interaction['agent_2'].replace(' ', '_').replace('/', '_')
+        # Get agent atom selections
+        agent1_atom_indices = interaction[f'atom_indices_1']
+        agent1_selection = energies_structure.select_atom_indices(agent1_atom_indices)
+        if not agent1_selection:
+            raise ValueError(f'Empty agent 1 "{agent1_name}" from interaction "{interaction_name}"')
+        agent2_atom_indices = interaction[f'atom_indices_2']
+        agent2_selection = energies_structure.select_atom_indices(agent2_atom_indices)
+        if not agent2_selection:
+            raise ValueError(f'Empty agent 2 "{agent2_name}" from interaction "{interaction_name}"')
+
+        # Prepare the CMIP friendly input pdb templates for every calculation
+        # First prepare the host files and the prepare the guest files
+        # There is only a difference between host and guest files:
+        # Host files include both agent atoms but the guest atoms are all marked as dummy
+        # Guest files include only guest atoms while host atoms are removed
+        interaction_setups.append({
+            'name': interaction_name,
+            'agent1_name': agent1_name,
+            'agent2_name': agent2_name,
+            'agent1_host': prepare_cmip_template(agent_name = agent1_name, host_file = True,
+                host_selection=agent1_selection, guest_selection=agent2_selection, strong_bonds=strong_bonds),
+            'agent2_host': prepare_cmip_template(agent_name = agent2_name, host_file = True,
+                host_selection=agent2_selection, guest_selection=agent1_selection, strong_bonds=strong_bonds),
+            'agent1_guest': prepare_cmip_template(agent_name = agent1_name, host_file = False,
+                host_selection=agent2_selection, guest_selection=agent1_selection, strong_bonds=strong_bonds),
+            'agent2_guest': prepare_cmip_template(agent_name = agent2_name, host_file = False,
+                host_selection=agent1_selection, guest_selection=agent2_selection, strong_bonds=strong_bonds),
+            # Set the CMIP inputs file for this interaction, which is to include the grid
+            'cmip_inputs': File(f'{energies_folder}/{numerate_filename(CMIP_INPUTS_FILE, i)}'),
+        })
+
+    # Find the envelope of every agent along all frames (i.e. the minimum and maximum coordinates in every dimension)
+    # Then set the CMIP box dimensions and densities to fit both the host and the guest in all frames
+    # Note that the grid is the same for all frames so CMIP is run in 'checkonly' mode only once per agent
+    print(' Setting CMIP grids')
+    envelopes = [ [ None, None ] for setup in interaction_setups ]
+    sample_frame_coordinates = None
+    for frame in reduced_trajectory:
+        frame_coordinates = frame.xyz
+        if sample_frame_coordinates is None:
+            sample_frame_coordinates = numpy.array(frame_coordinates)
+        for setup, envelope in zip(interaction_setups, envelopes):
+            for a, template in enumerate([ setup['agent1_guest'], setup['agent2_guest'] ]):
+                agent_coordinates = frame_coordinates[template['atom_indices']]
+                minimum = agent_coordinates.min(axis=0)
+                maximum = agent_coordinates.max(axis=0)
+                if envelope[a] is None:
+                    envelope[a] = (minimum, maximum)
+                else:
+                    envelope[a] = (numpy.minimum(envelope[a][0], minimum), numpy.maximum(envelope[a][1], maximum))
+    for setup, envelope in zip(interaction_setups, envelopes):
+        # Box origin and size are modified in the cmip inputs
+        # Values returned are only used for display / debug purposes
+        box_origin, box_size = setup_cmip_grid(setup['agent1_guest'], setup['agent2_guest'],
+            envelope[0], envelope[1], sample_frame_coordinates, setup['cmip_inputs'])
+
+    # Given frame coordinates, use CMIP to extract energies
     # Output energies are returned by atom
-    def get_frame_energy (frame_structure : 'Structure') -> List[dict]:
+    # All intermediate files are written in the scratch folder, which must not be shared with other running frames
+    def get_frame_energy (frame_coordinates : 'numpy.ndarray', scratch_folder : str) -> List[dict]:
 
-        # WARNING: At this point structure should be corrected
-        # WARNING: Repeated atoms will make the analysis fail
+        # Logs are only printed when frames are processed one by one, otherwise they would be mixed
+        logs = cores == 1
 
         # Repeat the whole process for each interaction
         data = []
-        for interaction in interactions:
+        for setup in interaction_setups:
 
-            # Check if the interaction has been marked as 'exceeds', in which case we skip it
-            if interaction.get('exceeds', False):
-                continue
+            # Get interaction and agent names, just for the logs
+            if logs: print(f' Processing {setup["name"]}')
+            agent1_name = setup['agent1_name']
+            agent2_name = setup['agent2_name']
 
-            # Get covalent bonds between both agents, if any
-            # They will be not taken in count during the calculation
-            # Otherwise we would have a huge energy peak in this atom since they are very close
-            strong_bonds = interaction.get('strong_bonds', None)
+            # Write the CMIP friendly input pdb structures for the current coordinates
+            agent1_cmip_host = write_cmip_pdb(setup['agent1_host'], frame_coordinates, scratch_folder)
+            agent2_cmip_host = write_cmip_pdb(setup['agent2_host'], frame_coordinates, scratch_folder)
+            agent1_cmip_guest = write_cmip_pdb(setup['agent1_guest'], frame_coordinates, scratch_folder)
+            agent2_cmip_guest = write_cmip_pdb(setup['agent2_guest'], frame_coordinates, scratch_folder)
 
-            # Get interaction and agent names, just for the logs
-            interaction_name = interaction['name']
-            print(f' Processing {interaction_name}')
-            agent1_name = interaction['agent_1'].replace(' ', '_').replace('/', '_')
-            agent2_name = interaction['agent_2'].replace(' ', '_').replace('/', '_')
-            # Get agent atom selections
-            agent1_atom_indices = interaction[f'atom_indices_1']
-            agent1_selection = frame_structure.select_atom_indices(agent1_atom_indices)
-            if not agent1_selection:
-                raise ValueError(f'Empty agent 1 "{agent1_name}" from interaction "{interaction_name}"')
-            agent2_atom_indices = interaction[f'atom_indices_2']
-            agent2_selection = frame_structure.select_atom_indices(agent2_atom_indices)
-            if not agent2_selection:
-                raise ValueError(f'Empty agent 2 "{agent2_name}" from interaction "{interaction_name}"')
-
-            # Prepare the CMIP friendly input pdb structures for every calculation
-            # First prepare the host files and the prepare the guest files
-            # There is only a difference between host and guest files:
-            # Host files include both agent atoms but the guest atoms are all marked as dummy
-            # Guest files include only guest atoms while host atoms are removed
-            agent1_cmip_host = pdb2cmip(agent_name = agent1_name, host_file = True, frame_structure=frame_structure,
-                host_selection=agent1_selection, guest_selection=agent2_selection, strong_bonds=strong_bonds)
-            agent2_cmip_host = pdb2cmip(agent_name = agent2_name, host_file = True, frame_structure=frame_structure,
-                host_selection=agent2_selection, guest_selection=agent1_selection, strong_bonds=strong_bonds)
-            agent1_cmip_guest = pdb2cmip(agent_name = agent1_name, host_file = False, frame_structure=frame_structure,
-                host_selection=agent2_selection, guest_selection=agent1_selection, strong_bonds=strong_bonds)
-            agent2_cmip_guest = pdb2cmip(agent_name = agent2_name, host_file = False, frame_structure=frame_structure,
-                host_selection=agent1_selection, guest_selection=agent2_selection, strong_bonds=strong_bonds)
-
-            # Copy the source cmip inputs file in the local directory
-            # Inputs will be modified to adapt the cmip grid to both agents together
-            # Note than modified inputs file is not conserved along frames
-            # Structures may change along trajectory thus requiring a different grid size
-            cmip_inputs = File(f'{energies_folder}/{CMIP_INPUTS_FILE}')
-            copyfile(cmip_inputs_source.path, cmip_inputs.path)
-
-            # Set the CMIP box dimensions and densities to fit both the host and the guest
-            # Box origin and size are modified in the cmip inputs
-            # Values returned are only used for display / debug purposes
-            box_origin, box_size = adapt_cmip_grid(agent1_cmip_guest, agent2_cmip_guest, cmip_inputs)
+            # Get the CMIP inputs, which already include the grid
+            cmip_inputs = setup['cmip_inputs']
 
             # If the debug flag is passed then, instead of calculating energies, leave it all ready and stop here
             if debug:
+                # Copy in the energies folder the CMIP inputs with the expected name
+                debug_cmip_inputs = File(f'{energies_folder}/{CMIP_INPUTS_FILE}')
+                copyfile(cmip_inputs.path, debug_cmip_inputs.path)
                 # Copy in the energies folder a small python script used to sum output energies
                 debug_script = File(f'{energies_folder}/{DEBUG_ENERGIES_SUM_SCRIPT}')
                 copyfile(debug_script_source.path, debug_script.path)
@@ -473,10 +556,10 @@ def energies (
                 raise SystemExit(' READY TO DEBUG -> Please go to the corresponding replica "energies" directory and follow the README instructions')
 
             # Run the CMIP software to get the desired energies
-            print(f'  Calculating energies for {agent1_name} as guest and {agent2_name} as host')
-            agent1_atom_energies = get_cmip_energies(cmip_inputs, agent1_cmip_guest, agent2_cmip_host)
-            print(f'  Calculating energies for {agent2_name} as guest and {agent1_name} as host')
-            agent2_atom_energies = get_cmip_energies(cmip_inputs, agent2_cmip_guest, agent1_cmip_host)
+            if logs: print(f'  Calculating energies for {agent1_name} as guest and {agent2_name} as host')
+            agent1_atom_energies = get_cmip_energies(cmip_inputs, agent1_cmip_guest, agent2_cmip_host, scratch_folder)
+            if logs: print(f'  Calculating energies for {agent2_name} as guest and {agent1_name} as host')
+            agent2_atom_energies = get_cmip_energies(cmip_inputs, agent2_cmip_guest, agent1_cmip_host, scratch_folder)
 
             # Print total energies at the end for every agent if the verbose flag has been passed
             if verbose:
@@ -488,51 +571,110 @@ def energies (
                         total_both += atom_energies[2]
                     print(f' Total energies for {agent_name}: vmd {total_vdw}, es {total_es}, both {total_both}')
 
-            # DANI: Usa esto para escribir los resultados de las energías por átomo
-            # sample = {
-            #     'agent1': { 'energies': agent1_atom_energies, 'pdb': agent1_cmip },
-            #     'agent2': { 'energies': agent2_atom_energies, 'pdb': agent2_cmip },
-            #     'box': { 'origin': box_origin, 'size': box_size } 
-            # }
-            # save_json(sample, 'energies_sample.json')
-
             data.append({ 'agent1': agent1_atom_energies, 'agent2': agent2_atom_energies })
 
             # Erase the 2 previous log lines
-            print(ERASE_3_PREVIOUS_LINES)
+            if logs: print(ERASE_3_PREVIOUS_LINES)
 
         return data
 
-    # Extract the energies for each frame in a reduced trajectory
-    frames, step, count = get_pdb_frames(energies_structure_file.path, input_trajectory_file.path, snapshots, frames_limit)
-    non_exceeding_interactions = [interaction for interaction in interactions if not interaction.get('exceeds', False)]
-
     # Load backup data in case there is a backup file
     if energies_backup.exists:
         print(' Recovering energies backup')
         interactions_data = load_json(energies_backup.path)
     else:
         interactions_data = [[] for interaction in non_exceeding_interactions]
-    for frame_number, current_frame_pdb in enumerate(frames):
-        # If we already have this frame in the backup then skip it
-        if frame_number < len(interactions_data[0]):
-            continue
-        # Run the main analysis over the current frame
-        # Append the result data for each interaction
-        current_frame_structure = Structure.from_pdb_file(current_frame_pdb)
-        frame_energies_data = get_frame_energy(current_frame_structure)
-        for i, data in enumerate(frame_energies_data):
-            interactions_data[i].append(data)
+
+    # Set the scratch folders where CMIP is run
+    # CMIP writes some files (e.g. restart, fortran units) in fixed paths so every worker needs its own folder
+    # If there is only one worker then CMIP is run directly in the energies folder
+    if cores == 1:
+        scratch_folders = [ main_scratch_folder ]
+    else:
+        scratch_folders = [ abspath(f'{energies_folder}/worker_{w}') for w in range(cores) ]
+        for scratch_folder in scratch_folders:
+            if not exists(scratch_folder):
+                mkdir(scratch_folder)
+    # Available scratch folders are handled through a queue so each running frame takes one and releases it after
+    available_scratch_folders = Queue()
+    for scratch_folder in scratch_folders:
+        available_scratch_folders.put(scratch_folder)
+
+    # Run the main analysis over a frame using the first available scratch folder
+    def process_frame (frame_coordinates : 'numpy.ndarray') -> List[dict]:
+        scratch_folder = available_scratch_folders.get()
+        try:
+            return get_frame_energy(frame_coordinates, scratch_folder)
+        finally:
+            available_scratch_folders.put(scratch_folder)
+
+    # Frames may be finished in any order but the backup must always store consecutive frames
+    # Keep finished frames here until all their previous frames are finished as well
+    finished_frames = {}
+    def merge_finished_frames ():
+        next_frame_number = len(interactions_data[0])
+        # Nothing to merge if the next expected frame is not finished yet
+        if next_frame_number not in finished_frames:
+            return
+        while next_frame_number in finished_frames:
+            frame_energies_data = finished_frames.pop(next_frame_number)
+            for i, data in enumerate(frame_energies_data):
+                interactions_data[i].append(data)
+            next_frame_number += 1
         # Save a backup just in case the process is interrupted further
-        save_json(interactions_data, energies_backup.path)
+        # Write it to a different file and then replace the backup so it is never half written
+        backup_buffer = energies_backup.path + '.tmp'
+        save_json(interactions_data, backup_buffer)
+        replace(backup_buffer, energies_backup.path)
+
+    # Process frames in parallel
+    # Note that CMIP is an external process so threads are enough to run several frames at a time
+    # Limit the number of frames submitted at a time to avoid loading too many frame coordinates in memory
+    # Print an empty line for the reprint to not delete a previous log
+    # In debug mode frames are not queued ahead so the energies folder is left ready for the first frame
+    max_pending_frames = 1 if debug else cores * 2
+    print()
+    with ThreadPoolExecutor(max_workers=cores) as executor:
+        pending = {}
+        try:
+            for frame_number, frame in enumerate(reduced_trajectory):
+                # If we already have this frame in the backup then skip it
+                if frame_number < len(interactions_data[0]):
+                    continue
+                # We display the frame with a +1 to make it 1-based instead of 0-based
+                reprint(f'Frame {frame_number * step + 1} ({frame_number + 1} / {count})')
+                # Copy the coordinates since the frame may be reused by the trajectory iterator
+                frame_coordinates = numpy.array(frame.xyz)
+                future = executor.submit(process_frame, frame_coordinates)
+                pending[future] = frame_number
+                # Wait for some frame to finish if there are too many submitted frames
+                while len(pending) >= max_pending_frames:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finished_frames[pending.pop(future)] = future.result()
+                    merge_finished_frames()
+            # Wait for the remaining frames
+            for future in list(pending):
+                finished_frames[pending.pop(future)] = future.result()
+            merge_finished_frames()
+        # If any frame fails (or the debug mode stops) then do not run the queued frames
+        # Frames which are already running are still waited before leaving
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
 
     # Cleanup here some CMIP residual files since it is not to be run again
+    # Remove worker scratch folders with everything inside
+    for scratch_folder in scratch_folders:
+        if scratch_folder != main_scratch_folder:
+            rmtree(scratch_folder)
     # Remove the restart file since we do not use it and it may be heavy sometimes
+    restart_file = File(main_scratch_folder + '/restart')
     if restart_file.exists:
         restart_file.remove()
     # Remove fortran unit files generated when running CMIP
     # Note that we can not define where these files are written but they appear where CMIP is run
-    fortran_unit_files = glob('fort.*')
+    fortran_unit_files = glob(main_scratch_folder + '/fort.*')
     for filepath in fortran_unit_files:
         remove(filepath)
 
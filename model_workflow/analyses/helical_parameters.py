@@ -4,7 +4,8 @@ from os.path import exists
 import pandas as pd
 import math
 import subprocess
-from shutil import move
+from shutil import move, rmtree
+from concurrent.futures import ThreadPoolExecutor
 import glob
 
 from model_workflow.utils.auxiliar import save_json, store_binary_data
@@ -116,7 +117,9 @@ def helical_parameters (
     structure : 'Structure',
     structure_filename : str,
     frames_limit : int,
-    dna_selection : str = None
+    dna_selection : str = None,
+    snapshots : int = None,
+    cores : int = 1,
 ):
     actual_path = os.getcwd()
     print('-> Running helical analysis')
@@ -167,7 +170,7 @@ def helical_parameters (
     #     structure_filename,
     # )
 
-    # terminal_execution(input_trajectory_filename, structure_filename, residue_index_ranges, sequences[0],folder_path)
+    # terminal_execution(input_trajectory_filename, structure_filename, residue_index_ranges, sequences[0], folder_path, snapshots, cores)
     # Save in a dictionary all the computations done by the different functions called by send_files function
     dictionary_information = send_files(sequences[0], frames_limit, folder_path)
     # Set the path into the original directory outside the folder helicalparameters
@@ -342,7 +345,9 @@ def hydrogen_bonds(
 
 
 # Function to execute Curves+ and Canals software to generate the output needed
-def terminal_execution(trajectory_input,topology_input,strand_indexes,sequence,folder_path):
+# If several cores are available the trajectory is split in frame chunks which are run in parallel
+# Then the .ser files of every chunk are stitched back in frame order
+def terminal_execution(trajectory_input,topology_input,strand_indexes,sequence,folder_path,snapshots=None,cores=1):
     helical_parameters_folder = f"{folder_path}/helical_parameters"
     # If the folder already exists dont create it again
     if not os.path.exists(helical_parameters_folder):
@@ -351,12 +356,72 @@ def terminal_execution(trajectory_input,topology_input,strand_indexes,sequence,f
     possible_residual_filenames = glob.glob(helical_parameters_folder+'/*.cda') + glob.glob(helical_parameters_folder+'/*.lis') + glob.glob(helical_parameters_folder+'/*.ser')
     for filename in possible_residual_filenames:
         os.remove(filename)
-        
+
+    # If there is only one core or we do not know the number of frames then run the whole trajectory at once
+    chunks_count = min(cores, snapshots) if snapshots else 1
+    if chunks_count <= 1:
+        print(' Running curves and canals')
+        run_curves_and_canals(helical_parameters_folder, trajectory_input, topology_input, strand_indexes, sequence)
+        return
+
+    # Split frames in contiguous chunks
+    # Note that Curves+ frame numbers start at 1
+    chunk_limits = np.linspace(0, snapshots, chunks_count + 1).astype(int)
+    frame_ranges = [ (chunk_limits[c] + 1, chunk_limits[c + 1]) for c in range(chunks_count) ]
+    chunk_folders = [ f"{helical_parameters_folder}/chunk_{c}" for c in range(chunks_count) ]
+    for chunk_folder in chunk_folders:
+        if exists(chunk_folder):
+            rmtree(chunk_folder)
+        os.mkdir(chunk_folder)
+    print(f' Running curves and canals in {chunks_count} chunks of frames')
+    # Run every chunk in its own folder
+    # Note that the heavy work is done by external processes so threads are enough
+    with ThreadPoolExecutor(max_workers=chunks_count) as executor:
+        futures = [ executor.submit(run_curves_and_canals, chunk_folder, trajectory_input, topology_input,
+            strand_indexes, sequence, frame_range) for chunk_folder, frame_range in zip(chunk_folders, frame_ranges) ]
+        # Raise errors, if any
+        for future in futures:
+            future.result()
+
+    # Stitch the .ser files of all chunks in frame order
+    ser_filenames = sorted([ filename for filename in os.listdir(chunk_folders[0]) if filename.endswith('.ser') ])
+    for ser_filename in ser_filenames:
+        with open(f"{helical_parameters_folder}/{ser_filename}", 'w') as output_file:
+            frame_offset = 0
+            for chunk_folder, frame_range in zip(chunk_folders, frame_ranges):
+                with open(f"{chunk_folder}/{ser_filename}", 'r') as chunk_file:
+                    for line in chunk_file:
+                        output_file.write(renumber_ser_line(line, frame_offset))
+                frame_offset += frame_range[1] - frame_range[0] + 1
+    # Remove chunk folders
+    for chunk_folder in chunk_folders:
+        rmtree(chunk_folder)
+
+# Add an offset to the frame number (the first column) of a .ser file line while keeping the column width
+def renumber_ser_line(line, frame_offset):
+    stripped_line = line.lstrip()
+    if not stripped_line:
+        return line
+    frame_number = stripped_line.split()[0]
+    if not frame_number.isdigit():
+        return line
+    rest = stripped_line[len(frame_number):]
+    width = len(line) - len(rest)
+    return f"{int(frame_number) + frame_offset:>{width}}{rest}"
+
+# Run Curves+ and then Canals in the given folder
+# A range of frames (first and last, starting at 1) may be passed to analyze only these frames
+def run_curves_and_canals(working_folder,trajectory_input,topology_input,strand_indexes,sequence,frame_range=None):
+    # Set input paths relative to the working folder since Curves+ does not accept long paths
+    trajectory_path = os.path.relpath(trajectory_input, working_folder)
+    topology_path = os.path.relpath(topology_input, working_folder)
+    # Set the frames to be analyzed
+    frames_instruction = f",itst={frame_range[0]},itnd={frame_range[1]},itdel=1" if frame_range else ""
     # Indicate all the instructions with the desired commands, keep in mind that there could be more commands to include and obtain other results and files
     instructions = [
         "Cur+ <<!",
         " &inp",
-        f"  file={trajectory_input},ftop={topology_input},lis={helical_parameters_folder}/test,lib={standard_prefix}",
+        f"  file={trajectory_path},ftop={topology_path},lis=test,lib={standard_prefix}{frames_instruction}",
         " &end",
         "2 1 -1 0 0",
         f"{strand_indexes[0][0]}:{strand_indexes[0][1]}",
@@ -365,22 +430,18 @@ def terminal_execution(trajectory_input,topology_input,strand_indexes,sequence,f
     ]
     instructions = ["\n".join(instructions)]
     cmd = " ".join(instructions)
-    print(' Running curves')
     # Execute the software using the instructions written previously
-    process = subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.PIPE,shell=True,executable=os.getenv('SHELL', '/bin/sh'))
+    process = subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.PIPE,shell=True,executable=os.getenv('SHELL', '/bin/sh'),cwd=working_folder)
 
     out, err = process.communicate()
     process.wait()
     out.decode("utf-8")
 
-    # Enter inside helicalparameters folder to execute Canals software as it needs the Curves+ output as input
-    os.chdir(helical_parameters_folder)
-    
     # If output has not been generated then warn the user
-    if not os.path.exists('test.cda'):
+    if not os.path.exists(f'{working_folder}/test.cda'):
         raise SystemExit('Something went wrong with Curves+ software')
     # Change the file name as Canals just take the name of the .cda file to differentiate between .lis and .cda
-    move("test.cda","cinput.cda")
+    move(f"{working_folder}/test.cda",f"{working_folder}/cinput.cda")
     # We have set up level1 and level2 to 0 as if lev1=lev2=0, lev1 is set to 1 and lev2 is set to the length of the oligmer
     level1 = 0
     level2 = 0
@@ -401,15 +462,14 @@ def terminal_execution(trajectory_input,topology_input,strand_indexes,sequence,f
     instructions2 = ["\n".join(instructions2)]
     cmd2 = " ".join(instructions2)
     #logs = subprocess.run(instructions,stderr=subprocess.PIPE).stderr.decode()
-    print(' Running canals')
-    process = subprocess.Popen(cmd2,stdout=subprocess.PIPE,stderr=subprocess.PIPE,shell=True,executable=os.getenv('SHELL', '/bin/sh'))
+    process = subprocess.Popen(cmd2,stdout=subprocess.PIPE,stderr=subprocess.PIPE,shell=True,executable=os.getenv('SHELL', '/bin/sh'),cwd=working_folder)
     
     out, err = process.communicate()
     process.wait()
     out.decode("utf-8")
 
     # If output has not been generated then warn the user
-    if not os.path.exists('canal_output_phaseC.ser'):
+    if not os.path.exists(f'{working_folder}/canal_output_phaseC.ser'):
         raise SystemExit('Something went wrong with Canals software')
 
 
@@ -8,14 +8,41 @@
 # atoms. WARNING: In irregular pdb topologies, there may be atoms with identical residue number, 
 # residue type and atom name. This makes impossible to know the real resulted atom. For this reason 
 # topology has been corrected previously and duplicated atoms have been renamed
+#
+# The per-frame presence of every hydrogen bond is stored as a bit matrix (hydrogen bonds x frames)
+# Each row is packed with numpy.packbits (8 frames per byte) and the whole matrix is base64 encoded
+# The 'acceptors', 'donors' and 'hydrogens' lists are the index table: the nth row belongs to the nth triplet
 
 import pytraj as pt
+import numpy
 import re
+from base64 import b64encode, b64decode
 
 from model_workflow.utils.pyt_spells import get_reduced_pytraj_trajectory
 from model_workflow.utils.auxiliar import save_json
 from model_workflow.utils.type_hints import *
 
+# Set the format tag for the packed hydrogen bond values
+# This is written in the output so readers know how to decode the 'hbonds' field
+HBONDS_ENCODING = 'packbits-base64'
+
+# Pytraj hbond 'old keys' pattern
+# e.g. "ASN_15@OD1-LEU_373@N-H" (acceptor residue and atom, donor residue and atom, hydrogen atom)
+HBOND_KEY_PATTERN = re.compile(r'\w*_(\d*)@(.*)-\w*_(\d*)@(.*)-(.*)', re.M|re.I)
+
+# Pack a boolean matrix (hydrogen bonds x frames) in a JSON serializable string
+# Every row is padded to a full byte so rows may be decoded independently
+def pack_hbond_values (values : 'numpy.ndarray') -> str:
+    packed = numpy.packbits(numpy.asarray(values, dtype=bool), axis=1)
+    return b64encode(packed.tobytes()).decode('ascii')
+
+# Recover the boolean matrix (hydrogen bonds x frames) from its packed string
+def unpack_hbond_values (packed_values : str, hbonds_count : int, frames_count : int) -> 'numpy.ndarray':
+    row_bytes = (frames_count + 7) // 8
+    packed = numpy.frombuffer(b64decode(packed_values), dtype=numpy.uint8)
+    packed = packed.reshape(hbonds_count, row_bytes)
+    return numpy.unpackbits(packed, axis=1, count=frames_count).astype(bool)
+
 # Perform an hydrogen bonds analysis for each interaction interface
 # The 'interactions' input may be an empty list (i.e. there are no interactions)
 # In case there are no interactions the analysis stops
@@ -86,49 +113,55 @@ def hydrogen_bonds (
         # This makes impossible to know what is the name and what is the number of the residue sometimes
         hbond_keys = hbonds._old_keys
 
+        # Get all hbond values at once as a numeric matrix (datasets x frames)
+        # Note that rows are in the same order than the old keys
+        # Note that the first row is the total number of hbonds per frame and it is discarded by the key parser
+        hbond_matrix = hbonds.values
+
         # Get residues in each interaction agent interface
-        interface_1 = interaction['interface_1']
-        interface_2 = interaction['interface_2']
+        interface_1 = set(interaction['interface_1'])
+        interface_2 = set(interaction['interface_2'])
+
+        # Residue conversions are cached since most residues participate in several hydrogen bonds
+        residues_cache = {}
+        def get_residue (pytraj_residue_number : str) -> 'Residue':
+            residue = residues_cache.get(pytraj_residue_number, None)
+            if residue is None:
+                residue = pytraj_residue_index_2_residue(int(pytraj_residue_number))
+                residues_cache[pytraj_residue_number] = residue
+            return residue
 
         acceptor_atom_index_list = []
         donor_atom_index_list = []
         hydrogen_atom_index_list = []
-        hbond_values = []
+        # Rows in the hbond matrix which are accepted
+        accepted_rows = []
         
         # Search all predicted hydrogen bonds
-        for i, hb in enumerate(hbonds):
-            key = hbond_keys[i]
-            # hb.key example: "ASN15_OD1-LEU373_N-H"
-            # matchObj = re.match( r'\w{3}(\d*)_(.*)-\w{3}(\d*)_(.*)-(.*)', hb.key, re.M|re.I)
-            # hb.key example: "ASN_15@OD1-LEU_373@N-H"
-            matchObj = re.match( r'\w*_(\d*)@(.*)-\w*_(\d*)@(.*)-(.*)', key, re.M|re.I)
+        for row, key in enumerate(hbond_keys):
+            matchObj = HBOND_KEY_PATTERN.match(key)
+            # Skip non hydrogen bond keys (e.g. 'total_solute_hbonds')
+            if matchObj is None:
+                continue
             # Mine all data from the parsed results
-            if matchObj is not None:
-                acceptor_resnum = matchObj.group(1)
-                acceptor_atom = matchObj.group(2)
-                donor_resnum = matchObj.group(3)
-                donor_atom = matchObj.group(4)
-                hydrogen_atom = matchObj.group(5)
-
-                # Get the acceptor and donor residues in source notation
-                acceptor = pytraj_residue_index_2_residue(int(acceptor_resnum))
-                donor = pytraj_residue_index_2_residue(int(donor_resnum))
-                
-                # WARNING: The analysis may return hydrogen bonds between residues from the same agent
-                # Accept the hydrogen bond only if its residues belong to different interaction agents
-                if ((acceptor in interface_1 and donor in interface_2)
-                or (acceptor in interface_2 and donor in interface_1)):
-                    
-                    # Get the absolute index of each atom
-                    acceptor_atom_index_list.append(get_atom_index(acceptor, acceptor_atom))
-                    donor_atom_index_list.append(get_atom_index(donor, donor_atom))
-                    hydrogen_atom_index_list.append(get_atom_index(donor, hydrogen_atom))
-                    # List 'hb.values' because it is a ndarray, which is not JSON serializable
-                    # Then convert the 0s and 1s into trues and falses
-                    # This is because booleans are lighter once parsed in hte database
-                    values = list( map(bool, (map(int, hb.values))) )
-                    #hbond_values.append(' '.join(map(str, hb.values)))
-                    hbond_values.append(values) 
+            acceptor_resnum, acceptor_atom, donor_resnum, donor_atom, hydrogen_atom = matchObj.groups()
+            # Get the acceptor and donor residues in source notation
+            acceptor = get_residue(acceptor_resnum)
+            donor = get_residue(donor_resnum)
+            # WARNING: The analysis may return hydrogen bonds between residues from the same agent
+            # Accept the hydrogen bond only if its residues belong to different interaction agents
+            if not ((acceptor in interface_1 and donor in interface_2)
+            or (acceptor in interface_2 and donor in interface_1)):
+                continue
+            # Get the absolute index of each atom
+            acceptor_atom_index_list.append(get_atom_index(acceptor, acceptor_atom))
+            donor_atom_index_list.append(get_atom_index(donor, donor_atom))
+            hydrogen_atom_index_list.append(get_atom_index(donor, hydrogen_atom))
+            accepted_rows.append(row)
+
+        # Pack the presence of every accepted hydrogen bond along frames
+        # Values are 0s and 1s so any non-zero value is a formed hydrogen bond
+        hbond_values = hbond_matrix[accepted_rows] != 0
 
         # Write 
         output_analysis.append(
@@ -137,7 +170,9 @@ def hydrogen_bonds (
                 'acceptors': acceptor_atom_index_list,
                 'donors': donor_atom_index_list,
                 'hydrogens': hydrogen_atom_index_list,
-                'hbonds': hbond_values,
+                'frames': hbond_matrix.shape[1],
+                'encoding': HBONDS_ENCODING,
+                'hbonds': pack_hbond_values(hbond_values),
             }
         )
 
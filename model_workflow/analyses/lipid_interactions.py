@@ -2,7 +2,7 @@ from model_workflow.tools.get_reduced_trajectory import calculate_frame_step
 from model_workflow.utils.topology_converter import to_MDAnalysis_topology
 from model_workflow.utils.auxiliar import save_json
 from model_workflow.utils.type_hints import *
-from collections import Counter
+from MDAnalysis.lib.distances import capped_distance
 import numpy as np
 import MDAnalysis
 
@@ -12,9 +12,14 @@ def lipid_interactions (
     output_analysis_filepath : str,
     membrane_map: dict,
     snapshots : int,
-    frames_limit: int = 100):
+    frames_limit: int = 100,
+    cutoff: float = 6):
     """
         Lipid-protein interactions analysis.
+
+        For every protein residue, count how many lipid residues of each type are
+        closer than the cutoff along the trajectory. All protein-lipid atom pairs are
+        found at once per frame with a cell-list search and then mapped to residues.
     """
     if membrane_map is None or membrane_map['n_mems'] == 0:
         print('-> Skipping lipid-protein interactions analysis')
@@ -26,26 +31,53 @@ def lipid_interactions (
     frame_step, frame_count = calculate_frame_step(snapshots, frames_limit)
     lipids = set([ data['resname'] for data in membrane_map['references'].values()])
     lipids_str = " ".join(lipids)
-    resids = np.unique(u.select_atoms('protein').resindices)
-    ocupancy = {resid: Counter() for resid in resids}
+    protein = u.select_atoms('protein')
+    lipid_atoms = u.select_atoms(f'(resname {lipids_str}) and not protein')
+    resids = np.unique(protein.resindices)
+    n_residues = len(resids)
+
+    # Precompute index arrays to map atom pairs to residues
+    # Every protein atom is mapped to its residue index and every lipid atom to its lipid residue and lipid type
+    lipid_types = sorted(lipids)
+    lipid_type_indices = { lipid: l for l, lipid in enumerate(lipid_types) }
+    protein_atom_resindices = protein.resindices
+    lipid_atom_resindices = lipid_atoms.resindices
+    lipid_atom_types = np.array([ lipid_type_indices[resname] for resname in lipid_atoms.resnames ], dtype=int)
+    # Lipid residue indices are only used to find unique protein residue - lipid residue pairs
+    n_all_residues = len(u.residues)
+
+    # Accumulate counts for every protein residue (rows) and lipid type (columns)
+    ocupancy = np.zeros((n_all_residues, len(lipid_types)))
 
     # Only iterate through the frames you need
     for ts in u.trajectory[0:snapshots:frame_step]:
-        # Select non-protein atoms near the protein once
-        non_protein_near = u.select_atoms(f'(around 6 protein) and (resname {lipids_str}) and not protein')
-        # Make residue selections only once
-        for resid in resids:
-            residue_atoms = u.select_atoms(f'resid {resid}')
-            # Find non-protein atoms near this specific residue
-            nearby = non_protein_near.select_atoms(f'around 6 global group residuegroup', 
-                                                residuegroup=residue_atoms)
-            # Count residue names
-            ocupancy[resid].update(Counter(nearby.residues.resnames))
+        # Skip the search if there is nothing to search
+        if len(protein) == 0 or len(lipid_atoms) == 0:
+            continue
+        # Find all protein - lipid atom pairs closer than the cutoff at once
+        # Note that periodic boundary conditions are considered, as the 'around' selection does
+        pairs = capped_distance(protein.positions, lipid_atoms.positions,
+            max_cutoff=cutoff, box=ts.dimensions, return_distances=False)
+        if len(pairs) == 0:
+            continue
+        # Map atom pairs to residue pairs and keep every residue pair only once
+        # Thus every lipid residue is counted once per protein residue, no matter how many atoms are close
+        residue_pairs = protein_atom_resindices[pairs[:,0]] * n_all_residues + lipid_atom_resindices[pairs[:,1]]
+        residue_pairs, first_pair_indices = np.unique(residue_pairs, return_index=True)
+        protein_residues = residue_pairs // n_all_residues
+        lipid_residue_types = lipid_atom_types[pairs[first_pair_indices,1]]
+        # Count residue names
+        np.add.at(ocupancy, (protein_residues, lipid_residue_types), 1)
 
-    ocupancy_arrs = {lipid: np.zeros(len(ocupancy)) for lipid in lipids}
-    for resid, counter in ocupancy.items():
-        for lipid, count in counter.items():
-            ocupancy_arrs[lipid][resid] = count
+    # Keep only protein residues
+    # Note that arrays are indexed by residue index, as protein residues are expected to come first
+    ocupancy_arrs = {}
+    for lipid in lipids:
+        ocupancy_arr = np.zeros(n_residues)
+        lipid_ocupancy = ocupancy[:, lipid_type_indices[lipid]]
+        for resid in resids:
+            ocupancy_arr[resid] = lipid_ocupancy[resid]
+        ocupancy_arrs[lipid] = ocupancy_arr
 
     # Normalize the occupancy arrays by dividing by the number of frames
     for lipid in lipids:
@@ -53,4 +85,4 @@ def lipid_interactions (
         ocupancy_arrs[lipid] = ocupancy_arrs[lipid].tolist()
     # Save the data
     data = { 'data': ocupancy_arrs}
-    save_json(data, output_analysis_filepath)
\ No newline at end of file
+    save_json(data, output_analysis_filepath)
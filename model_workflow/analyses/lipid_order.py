@@ -34,6 +34,13 @@ def lipid_order (
     u = MDAnalysis.Universe(mda_top, input_trajectory_filepath)
     order_parameters_dict = {}
     frame_step, _ = calculate_frame_step(snapshots, frames_limit)
+    # Gather every C-H pair of every reference, chain and carbon in a single set of index arrays
+    # Every carbon (of every chain of every reference) is a group and every pair is labeled with its group index
+    carbon_indices = []
+    hydrogen_indices = []
+    pair_groups = []
+    # Keep track of which group belongs to which reference, chain and carbon name
+    groups = []
     for ref, ref_data in membrane_map['references'].items():
         # Take the first residue of the reference
         res = u.residues[ref_data["resindices"][0]]
@@ -41,30 +48,54 @@ def lipid_order (
             carbon_groups = get_all_acyl_chains(res)
         else:
             carbon_groups = [res.atoms.select_atoms('element C and bonded element H').indices]
-
-        order_parameters_dict[ref] = {}
         # For every 'tail'
         for chain_idx, group in enumerate(carbon_groups):
             atoms = res.universe.atoms[group]
             C_names = sorted([atom.name for atom in atoms],key=natural_sort_key)
             # Find all C-H bonds indices
             ch_pairs = find_CH_bonds(u, ref_data["resindices"], C_names)
-            # Initialize the order parameters to sum over the trajectory
-            order_parameters = []
-            costheta_sums = {C_name: np.zeros(len(ch_pairs[C_name]['C'])) for C_name in C_names}
-            n = 0
-            # Loop over the trajectory
-            for ts in u.trajectory[0:snapshots:frame_step]:
-                for C_name in C_names:
-                    d = u.atoms[ch_pairs[C_name]['C']].positions - u.atoms[ch_pairs[C_name]['H']].positions
-                    costheta_sums[C_name] += d[:,2]**2/np.linalg.norm(d, axis=1)**2
-                n += 1
-            order_parameters = 1.5 * np.array([costheta_sums[C_name].mean() for C_name in C_names])/n - 0.5
-            serrors = 1.5 * np.array([costheta_sums[C_name].std() for C_name in C_names])/n
-            order_parameters_dict[ref][str(chain_idx)] = {
-                'atoms': C_names,
-                'avg': order_parameters.tolist(),
-                'std': serrors.tolist()}
+            for C_name in C_names:
+                group_index = len(groups)
+                groups.append((ref, str(chain_idx), C_name))
+                carbon_indices.append(ch_pairs[C_name]['C'])
+                hydrogen_indices.append(ch_pairs[C_name]['H'])
+                pair_groups.append(np.full(len(ch_pairs[C_name]['C']), group_index))
+    carbon_indices = np.concatenate(carbon_indices).astype(int) if groups else np.zeros(0, dtype=int)
+    hydrogen_indices = np.concatenate(hydrogen_indices).astype(int) if groups else np.zeros(0, dtype=int)
+    pair_groups = np.concatenate(pair_groups).astype(int) if groups else np.zeros(0, dtype=int)
+    # Initialize the cos² sums of every pair to sum over the trajectory
+    costheta_sums = np.zeros(len(carbon_indices))
+    n = 0
+    # Loop over the trajectory only once
+    # Positions of all pairs are taken at once in every frame
+    for ts in u.trajectory[0:snapshots:frame_step]:
+        positions = ts.positions
+        d = positions[carbon_indices] - positions[hydrogen_indices]
+        costheta_sums += d[:,2]**2 / np.einsum('ij,ij->i', d, d)
+        n += 1
+    # Now get the mean and standard deviation of every group at once
+    groups_count = len(groups)
+    pairs_counts = np.bincount(pair_groups, minlength=groups_count)
+    # Avoid zero divisions for carbons with no hydrogens
+    safe_counts = np.maximum(pairs_counts, 1)
+    means = np.bincount(pair_groups, weights=costheta_sums, minlength=groups_count) / safe_counts
+    squared_means = np.bincount(pair_groups, weights=costheta_sums**2, minlength=groups_count) / safe_counts
+    stds = np.sqrt(np.maximum(squared_means - means**2, 0))
+    # Carbons with no pairs had a nan mean in the previous implementation
+    means[pairs_counts == 0] = np.nan
+    stds[pairs_counts == 0] = np.nan
+    order_parameters = 1.5 * means / max(n, 1) - 0.5
+    serrors = 1.5 * stds / max(n, 1)
+    # Set the results in the output format
+    for group_index, (ref, chain_idx, C_name) in enumerate(groups):
+        ref_order_parameters = order_parameters_dict.setdefault(ref, {})
+        chain = ref_order_parameters.setdefault(chain_idx, { 'atoms': [], 'avg': [], 'std': [] })
+        chain['atoms'].append(C_name)
+        chain['avg'].append(float(order_parameters[group_index]))
+        chain['std'].append(float(serrors[group_index]))
+    # Make sure references with no chains are still in the output
+    for ref in membrane_map['references']:
+        order_parameters_dict.setdefault(ref, {})
     # Save the data
     data = { 'data': order_parameters_dict}
     save_json(data, output_analysis_filepath)
@@ -6,7 +6,7 @@
 from os import remove
 import mdtraj as mdt
 
-from model_workflow.tools.get_screenshot import get_screenshot
+from model_workflow.tools.get_screenshot import get_screenshots
 from model_workflow.utils.auxiliar import save_json
 from model_workflow.utils.type_hints import *
 
@@ -78,24 +78,19 @@ def markov (
             rsmd = mdt.rmsd(frame_coordinates[frame], frame_coordinates[other_frame], atom_indices=parsed_selection.atom_indices)[0]
             rmsd_row.append(float(rsmd))
         rmsd_matrix.append(rmsd_row)
-    # Make a copy of the structure to avoid mutating the original structure
-    reference_structure = structure.copy()
     print(' Taking screenshots of selected frames')
-    frame_count = str(len(frame_coordinates))
-    # Save the screenshot parameters so we can keep images coherent between states
-    screenshot_parameters = None
-    # For each frame coordinates, generate PDB file, take a scrrenshot and delete it
+    # Take all screenshots together so we can keep images coherent between states and VMD is run only once
+    screenshots_coordinates = []
+    screenshot_filenames = []
     for i, frame in enumerate(frame_coordinates.values(), 1):
-        # Update the current frame log
-        print(f'  Screenshot {i}/{frame_count}', end='\r')
         # Get the actual coordinates
         coordinates = frame.xyz[0] * 10 # We multiply by to restor Ångstroms
-        # Update the reference structure coordinates
-        reference_structure.set_new_coordinates(coordinates)
+        screenshots_coordinates.append(coordinates)
         # Set the screenshot filename
-        screenshot_filename = f'markov_screenshot_{str(i).zfill(2)}.jpg'
-        # Generate the screenshot
-        screenshot_parameters = get_screenshot(reference_structure, screenshot_filename, parameters=screenshot_parameters)
+        screenshot_filenames.append(f'markov_screenshot_{str(i).zfill(2)}.jpg')
+    # Generate the screenshots
+    # Note that the structure is not mutated
+    get_screenshots(structure, screenshots_coordinates, screenshot_filenames, message=None)
     # Export the analysis data to a json file
     data = {
         'frames': highest_population_frames,
@@ -8,8 +8,7 @@ from pathlib import Path
 
 from model_workflow.tools.nassa_base import Base
 from model_workflow.tools.nassa_loaders import load_sequence
-from model_workflow.tools.nassa_loaders import load_serfile
-from model_workflow.utils.constants import NASSA_ANALYSES_CANALS, BLUE_HEADER, COLOR_END, CYAN_HEADER, GREEN_HEADER
+from model_workflow.utils.constants import NASSA_ANALYSES_CANALS, BLUE_HEADER, COLOR_END, CYAN_HEADER, GREEN_HEADER, GLOBALS
 
 from model_workflow.utils.heatmaps_nassa import basepair_plot
 from model_workflow.utils.heatmaps_nassa import bconf_heatmap
@@ -51,13 +50,7 @@ class BasePairCorrelation(Base):
         for bpcorr_coord in bpcorr_coordiantes:
             for coord in self.coordinate_info.keys():
                 if coord == bpcorr_coord:
-                    crd_data = []
-                    for ser_file in self.coordinate_info[coord]:
-                        ser = load_serfile(
-                            ser_file,
-                            self.tail,
-                            self.n_lines)
-                        crd_data.append(ser)
+                    crd_data = self.load_serfiles(self.coordinate_info[coord])
                     extracted[coord.lower()] = crd_data
                     self.logger.info(f"loaded {len(crd_data)} files for coordinate <{coord}>")
             
@@ -69,12 +62,14 @@ class BasePairCorrelation(Base):
     def transform(self, data):
         sequences = data.pop("sequences")
         # iterate over trajectories
+        # trajectories are analyzed in parallel if more than one core is available
+        trajectories_series = [
+            {coord.lower(): data[coord][traj] for coord in data.keys()}
+            for traj in range(len(sequences))]
+        coordinate_corrs = self.parallel_map(
+            self.iterate_trajectory, sequences, trajectories_series)
         corr_results = {}
-        for traj, seq in enumerate(sequences):
-            trajectory_series = {coord.lower(): data[coord][traj]
-                                 for coord in data.keys()}
-            coordinate_corr = self.iterate_trajectory(
-                seq, trajectory_series)
+        for seq, coordinate_corr in zip(sequences, coordinate_corrs):
             corr_results[seq.sequence] = coordinate_corr
         joined_df = []
         for seq, val in corr_results.items():
@@ -209,13 +204,7 @@ class BConformations(Base):
         for bconf_coord in bconf_coordiantes:
             for coord in self.coordinate_info.keys():
                 if coord == bconf_coord:
-                    crd_data = []
-                    for ser_file in self.coordinate_info[coord]:
-                        ser = load_serfile(
-                            ser_file,
-                            self.tail,
-                            self.n_lines)
-                        crd_data.append(ser)
+                    crd_data = self.load_serfiles(self.coordinate_info[coord])
                     extracted[coord.lower()] = crd_data
                     self.logger.info(
                         f"loaded {len(crd_data)} files for coordinate <{coord}>")
@@ -223,7 +212,7 @@ class BConformations(Base):
 
     def transform(self, data):
         sequences = data.pop("sequences")
-        angles_df = []
+        trajectories_angles = {"epsilC": [], "zetaC": [], "epsilW": [], "zetaW": []}
         # get dataframe for each coordinate
         for traj, seq in enumerate(sequences):
             # start reading from the 4th column:
@@ -232,17 +221,18 @@ class BConformations(Base):
             # skip last two bases
             end = seq.size - (seq.baselen + seq.flanksize)
             # select relevant subset of columns
-            epsilC = data["epsilc"][traj][start:end]
-            zetaC = data["zetac"][traj][start:end]
-            epsilW = data["epsilw"][traj][start:end]
-            zetaW = data["zetaw"][traj][start:end]
-            traj_df = self.get_angles_difference(
-                seq,
-                epsilC,
-                zetaC,
-                epsilW,
-                zetaW)
-            angles_df.append(traj_df)
+            trajectories_angles["epsilC"].append(data["epsilc"][traj][start:end])
+            trajectories_angles["zetaC"].append(data["zetac"][traj][start:end])
+            trajectories_angles["epsilW"].append(data["epsilw"][traj][start:end])
+            trajectories_angles["zetaW"].append(data["zetaw"][traj][start:end])
+        # trajectories are analyzed in parallel if more than one core is available
+        angles_df = self.parallel_map(
+            self.get_angles_difference,
+            sequences,
+            trajectories_angles["epsilC"],
+            trajectories_angles["zetaC"],
+            trajectories_angles["epsilW"],
+            trajectories_angles["zetaW"])
         angles_df = pd.concat(angles_df, axis=1)
         # percentages BI
         B_I = (angles_df < 0).sum(axis=0) * 100 / len(angles_df) # self.n_lines
@@ -346,13 +336,7 @@ class CoordinateCorrelation(Base):
         for crdcorr_coord in crdcorr_coordiantes:
             for coord in self.coordinate_info.keys():
                 if coord == crdcorr_coord:
-                    crd_data = []
-                    for ser_file in self.coordinate_info[coord]:
-                        ser = load_serfile(
-                            ser_file,
-                            self.tail,
-                            self.n_lines)
-                        crd_data.append(ser)
+                    crd_data = self.load_serfiles(self.coordinate_info[coord])
                     extracted[coord.lower()] = crd_data
                     self.logger.info(
                         f"loaded {len(crd_data)} files for coordinate <{coord}>")
@@ -361,13 +345,13 @@ class CoordinateCorrelation(Base):
     def transform(self, data):
         sequences = data.pop("sequences")
         # iterate over trajectories
-        corr_results = {}
-        for traj, seq in enumerate(sequences):
-            trajectory_series = {coord.lower(): data[coord][traj]
-                                 for coord in data.keys()}
-            correlations = self.iterate_trajectory(
-                seq, trajectory_series)
-            corr_results[traj] = correlations
+        # trajectories are analyzed in parallel if more than one core is available
+        trajectories_series = [
+            {coord.lower(): data[coord][traj] for coord in data.keys()}
+            for traj in range(len(sequences))]
+        correlations = self.parallel_map(
+            self.iterate_trajectory, sequences, trajectories_series)
+        corr_results = dict(enumerate(correlations))
         return corr_results
 
     def iterate_trajectory(self, sequence, coordinates):
@@ -505,13 +489,7 @@ class CoordinateDistributions(Base):
         for coordist_coord in coordist_coordiantes:
             for coord in self.coordinate_info.keys():
                 if coord == coordist_coord:
-                    crd_data = []
-                    for ser_file in self.coordinate_info[coord]:
-                        ser = load_serfile(
-                            ser_file,
-                            self.tail,
-                            self.n_lines)
-                        crd_data.append(ser)
+                    crd_data = self.load_serfiles(self.coordinate_info[coord])
                     extracted[coord.lower()] = crd_data
                     self.logger.info(
                         f"loaded {len(crd_data)} files for coordinate <{coord}>")
@@ -557,10 +535,12 @@ class CoordinateDistributions(Base):
             dataseries,
             sequence,
             coordinate):
-        trajectory_info = []
         # iterate over subunits
         start = 2 + sequence.flanksize
         end = sequence.size - (2 + sequence.baselen + sequence.flanksize - 1)
+        subunits = []
+        ic_subunits = []
+        subunits_series = []
         for idx in range(start, end):
             # get unit and inverse-complement unit
             subunit = sequence.get_subunit(idx)
@@ -570,8 +550,27 @@ class CoordinateDistributions(Base):
             # add 1 to idx since .ser table includes an index
             ser = dataseries[idx + 1]
             ser = ser[~np.isnan(ser)].to_numpy()
-            if ser.shape[0] < 2:
-                self.logger.info("skipping because of insufficient data!")
+            subunits.append(subunit)
+            ic_subunits.append(ic_subunit)
+            subunits_series.append(ser)
+        # model subunits with enough data
+        # subunits are modeled in batches, one per core, which run in parallel if more than one core is available
+        modeled = [ser.shape[0] >= 2 for ser in subunits_series]
+        modeled_series = [ser for ser, m in zip(subunits_series, modeled) if m]
+        modeled_subunits = [subunit for subunit, m in zip(subunits, modeled) if m]
+        batches = np.array_split(np.arange(len(modeled_series)), max(self.cores, 1))
+        batches = [batch for batch in batches if len(batch) > 0]
+        batches_information = self.parallel_map(
+            self.subunits_iteration,
+            [[modeled_series[i] for i in batch] for batch in batches],
+            [[modeled_subunits[i] for i in batch] for batch in batches],
+            [coordinate] * len(batches))
+        modeled_information = iter([info for batch_information in batches_information for info in batch_information])
+        trajectory_info = []
+        for subunit, ic_subunit, is_modeled in zip(subunits, ic_subunits, modeled):
+            if not is_modeled:
+                self.logger.info(
+                    f"skipping {self.unit_name} {subunit} because of insufficient data!")
                 subunit_information = dict(
                     coordinate=coordinate,
                     binormal=False,
@@ -587,12 +586,7 @@ class CoordinateDistributions(Base):
                     w2=np.nan)
                 subunit_information[self.unit_name] = subunit
             else:
-                # reshape dataset
-                ser = ser.reshape(-1, 1)
-                subunit_information = self.subunit_iteration(
-                    ser,
-                    subunit,
-                    coordinate)
+                subunit_information = next(modeled_information)
             if not self.bimod:
                 subunit_information["unimodal"] = True
             trajectory_info.append(subunit_information)
@@ -604,18 +598,19 @@ class CoordinateDistributions(Base):
         trajectory_df = pd.DataFrame.from_dict(trajectory_info)
         return trajectory_df
 
-    def subunit_iteration(
+    def subunits_iteration(
             self,
-            ser,
-            subunit,
+            sers,
+            subunits,
             coordinate):
-        # model subunit's series
+        # model all subunits' series at once
         bibi = BiBiTransformer(max_iter=self.max_iter, tol=self.tol)
-        subunit_info = bibi.fit_transform(ser)
-        # add subunit name and coordinate to info dictionary
-        subunit_info[self.unit_name] = subunit
-        subunit_info["coordinate"] = coordinate
-        return subunit_info
+        subunits_info = bibi.fit_transform_batch(sers)
+        # add subunit name and coordinate to info dictionaries
+        for subunit_info, subunit in zip(subunits_info, subunits):
+            subunit_info[self.unit_name] = subunit
+            subunit_info["coordinate"] = coordinate
+        return subunits_info
 
     def add_modality_labels(self, data):
         df = data.set_index(self.unit_name)
@@ -717,13 +712,7 @@ class StiffnessDistributions(Base):
         for stiff_coord in stiff_coordiantes:
             for coord in self.coordinate_info.keys():
                 if coord == stiff_coord:
-                    crd_data = []
-                    for ser_file in self.coordinate_info[coord]:
-                        ser = load_serfile(
-                            ser_file,
-                            self.tail,
-                            self.n_lines)
-                        crd_data.append(ser)
+                    crd_data = self.load_serfiles(self.coordinate_info[coord])
                     extracted[coord.lower()] = crd_data
                     self.logger.info(
                         f"loaded {len(crd_data)} files for coordinate <{coord}>")
@@ -732,12 +721,13 @@ class StiffnessDistributions(Base):
     def transform(self, data):
         sequences = data.pop("sequences")
         results = {"stiffness": [], "covariances": {}, "constants": {}}
-        for traj, seq in enumerate(sequences):
-            traj_series = {coord.lower(): data[coord][traj]
-                           for coord in data.keys()}
-            traj_results = self.get_stiffness(
-                seq,
-                traj_series)
+        # trajectories are analyzed in parallel if more than one core is available
+        trajectories_series = [
+            {coord.lower(): data[coord][traj] for coord in data.keys()}
+            for traj in range(len(sequences))]
+        trajectories_results = self.parallel_map(
+            self.get_stiffness, sequences, trajectories_series)
+        for traj_results in trajectories_results:
             results["stiffness"].append(traj_results["stiffness"])
             results["covariances"].update(traj_results["covariances"])
             results["constants"].update(traj_results["constants"])
@@ -899,9 +889,14 @@ class StiffnessDistributions(Base):
 # The overwrite flag could be used to overwrite the output folder if it already exists.
 def run_nassa(analysis_name: str, 
               config_archive: dict,
-              overwrite_nassa: bool = False):
+              overwrite_nassa: bool = False,
+              cores: Optional[int] = None):
     """Run the NASSA analysis pipeline"""
 
+    # Use the number of cores set from the command line unless it is specified
+    if cores is None:
+        cores = GLOBALS['cores']
+
     # Dictionary with the available NASSA analyses and their corresponding classes
     analyses = {
         "bpcorr": BasePairCorrelation,
@@ -943,7 +938,7 @@ def run_nassa(analysis_name: str,
         config_archive["coordinate_info"] = {
             coord: config_archive["coordinate_info"][coord] for coord in coordinate_files}
         # Call the analysis class with the configuration archive and run NASSA software 
-        analysis_instance = analysis_class(**config_archive)
+        analysis_instance = analysis_class(**{**config_archive, "cores": cores})
         analysis_instance.run()
     # If the analysis name is not valid, an error is raised
     else:
@@ -18,17 +18,21 @@
 # Peter Schmldtke, Axel Bidon-Chanal, Javier Luque, Xavier Barril, “MDpocket: open-source cavity detection 
 # and characterization on molecular dynamics trajectories.”, Bioinformatics. 2011 Dec 1;27(23):3276-85
 
-from os.path import exists, getsize, split
-from os import mkdir, remove, chdir
+from os.path import exists, getsize, split, basename
+from os import mkdir, remove, chdir, listdir, replace, rmdir
+from shutil import rmtree
 import re
 import collections
+import numpy
 
 from subprocess import run, PIPE
+from concurrent.futures import ThreadPoolExecutor
 
 from model_workflow.tools.get_reduced_trajectory import get_reduced_trajectory
 from model_workflow.utils.auxiliar import warn, ToolError, save_json
 from model_workflow.utils.file import File
 from model_workflow.utils.constants import GREY_HEADER, COLOR_END
+from model_workflow.utils.type_hints import *
 
 CURSOR_UP_ONE = '\x1b[1A'
 ERASE_LINE = '\x1b[2K'
@@ -51,8 +55,11 @@ def pockets (
     snapshots : int,
     frames_limit : int = 100,
     # Get only the 10 first pockets since the analysis is quite slow by now
-    # DANI: Cuando hagamos threading y no haya limite de tamaño para cargar en mongo podremos hacer más pockets
-    maximum_pockets_number : int = 10):
+    # Note that pockets are analyzed in parallel so this number may be raised along with the number of cores
+    # DANI: Cuando no haya limite de tamaño para cargar en mongo podremos hacer más pockets
+    maximum_pockets_number : int = 10,
+    # Number of pockets to be analyzed in parallel
+    cores : int = 1):
 
     print('-> Running pockets analysis')
 
@@ -153,52 +160,13 @@ def pockets (
             raise ToolError('We had errors with mdpocket while searching pockets')
 
     # Read and harvest the gird file
-    with open(grid_filename, 'r') as file:
-
-        # First, mine the grid dimensions and origin
-        dimensions = None
-        dimensions_pattern = "counts ([0-9]+) ([0-9]+) ([0-9]+)"
-        origin = None
-        origin_pattern = "origin ([.0-9-]+) ([.0-9-]+) ([.0-9-]+)"
-        for line in file:
-            search = re.search(dimensions_pattern, line)
-            if search != None:
-                dimensions = (int(search.group(1)),int(search.group(2)),int(search.group(3)))
-            search = re.search(origin_pattern, line)
-            if search != None:
-                origin = (float(search.group(1)),float(search.group(2)),float(search.group(3)))
-            if origin and dimensions:
-                break
-        if not dimensions:
-            # This may happend when one of the dimensions is negative, which an mdpocket error
-            # DANI: El origen de esto no está claro pero cuando me pasó vino acompañado de muchos errores:
-            # DANI: '! No Pockets Found while refining' y '! No pocket to reindex.'
-            # DANI: Además de algún 'Error in creating clustering tree, return NULL pointer...breaking up!'
-            raise Exception('Failed to mine dimensions')
-
-        # Next, mine the grid values
-        grid_values = []
-        grid_values_pattern = "^([.0-9]+) ([.0-9]+) ([.0-9]+) $"
-        # The last line of the grid may have less than 3 values
-        last_line_grid_values_pattern_1 = "^([.0-9]+) ([.0-9]+) $"
-        last_line_grid_values_pattern_2 = "^([.0-9]+) $" 
-        for line in file:
-            search = re.search(grid_values_pattern, line)
-            if (search != None):
-                grid_values.append(float(search.group(1)))
-                grid_values.append(float(search.group(2)))
-                grid_values.append(float(search.group(3)))
-                continue
-            # This should only happend at the end
-            search = re.search(last_line_grid_values_pattern_1, line)
-            if (search != None):
-                grid_values.append(float(search.group(1)))
-                grid_values.append(float(search.group(2)))
-                continue
-            search = re.search(last_line_grid_values_pattern_2, line)
-            if (search != None):
-                grid_values.append(float(search.group(1)))
-                continue
+    header_lines, dimensions, origin, grid_values = read_dx_grid(grid_filename)
+    if not dimensions:
+        # This may happend when one of the dimensions is negative, which an mdpocket error
+        # DANI: El origen de esto no está claro pero cuando me pasó vino acompañado de muchos errores:
+        # DANI: '! No Pockets Found while refining' y '! No pocket to reindex.'
+        # DANI: Además de algún 'Error in creating clustering tree, return NULL pointer...breaking up!'
+        raise Exception('Failed to mine dimensions')
 
     # Set a function to get the value of a given 'x, y, z' grid point
     # Grid points are disposed first in 'z' order, then 'y', and finally 'x'
@@ -305,26 +273,23 @@ def pockets (
                 return False
         return True
             
-    # Save also each point coordinates
-    for x in range(xl):
-        for y in range(yl):
-            for z in range(zl):
-                index = get_index(x,y,z)
-                # If it is not a pocket then pass
-                value = grid_values[index]
-                if value < cuttoff:
-                    continue
-                # If it is a pocket but it has been already tagged then pass
-                pocket = pockets[index]
-                if pocket:
-                    continue
-                # If it is not wide enought to start a pocket then pass
-                point = (x,y,z)
-                if not is_pocket_base(point):
-                    continue
-                # If none of the previous values was marked as a pocket then we set a new pocket number
-                pockets_count += 1
-                set_pocket(start_point=point, pocket_number=pockets_count)
+    # Iterate over pocket points only (i.e. points over the cutoff)
+    # Note that points are iterated in the grid order ('z' first, then 'y', and finally 'x')
+    candidate_indices = numpy.flatnonzero(grid_values >= cuttoff)
+    for index in candidate_indices.tolist():
+        # If it is a pocket but it has been already tagged then pass
+        pocket = pockets[index]
+        if pocket:
+            continue
+        # If it is not wide enought to start a pocket then pass
+        x, rem = divmod(index, yl*zl)
+        y, z = divmod(rem, zl)
+        point = (x,y,z)
+        if not is_pocket_base(point):
+            continue
+        # If none of the previous values was marked as a pocket then we set a new pocket number
+        pockets_count += 1
+        set_pocket(start_point=point, pocket_number=pockets_count)
 
     # Exclude the first result which will always be 0 and it stands for no-pocket points
     biggest_pockets = collections.Counter(pockets).most_common()
@@ -340,29 +305,27 @@ def pockets (
         biggest_pockets = biggest_pockets[0:maximum_pockets_number]
         pockets_number = maximum_pockets_number
 
-    # First of all, get all header lines from the original grid file
-    # We need them to write grid files further
-    with open(grid_filename,'r') as file:
-        header_lines = []
-        header_pattern = "^[a-z]"
-        for line in file:
-            if re.match(header_pattern, line):
-                header_lines.append(line)
-            elif re.match(grid_values_pattern, line):
-                break
-
-    # Set the dict where all output data will be stored
-    output_analysis = []
+    # Keep pocket numbers as an array to build every pocket grid at once
+    pockets_array = numpy.array(pockets)
 
     # Next, we analyze each selected pocket independently. The steps for each pocket are:
     # 1 - Create a new grid file
     # 2 - Conver the grid to pdb
     # 3 - Analyze this pdb with mdpocket
     # 4 - Harvest the volumes over time and write them in the pockets analysis file
+    # Steps 1 and 2 are done here for all pockets, step 3 is run in parallel and step 4 is done at the end
+    # Every pocket mdpocket is run in its own scratch directory inside the mdpocket folder so outputs do not collide
+    # Then outputs are moved to the mdpocket folder
+    # Note that paths must be relative to this directory and they are kept short because of the mdpocket characters limit
+    pocket_auxiliar_trajectory_filepath = f'../../{pockets_trajectory_file.filename}'
+    pocket_auxiliar_structure_filepath = f'../../{structure_file.filename}'
+    pocket_jobs = []
+    pocket_outputs = []
     for p, pock in enumerate(biggest_pockets, 1):
         # WARNING: This name must match the final name of the pocket file once loaded in the database
         pocket_name = 'pocket_' + str(p).zfill(2)
         pocket_output = mdpocket_folder_name + '/' + pocket_name
+        pocket_outputs.append((pocket_name, pocket_output))
         # Check if current pocket files already exist and are complete. If so, skip this pocket
         # Output files:
         # - pX.dx: it is created and completed at the begining by this workflow
@@ -371,89 +334,97 @@ def pockets (
         # - pX_mdpocket.pdb: it is completed at the begining but remains size 0 until the end of mdpocket
         # Note that checking pX_mdpocket_atoms.pdb or pX_mdpocket.pdb is enought to know if mdpocket was completed
         checking_filename = pocket_output + '_mdpocket.pdb'
-        if not (exists(checking_filename) and getsize(checking_filename) > 0):
-
-            # Update the logs
+        if exists(checking_filename) and getsize(checking_filename) > 0:
+            continue
+        # Set the scratch directory where mdpocket is run
+        # Remove it if it already exists, since it comes from an interrupted run
+        pocket_directory = pocket_output + '_run'
+        if exists(pocket_directory):
+            rmtree(pocket_directory)
+        mkdir(pocket_directory)
+
+        # Create the new grid for this pocket, where all values from other pockets are set to 0
+        pocket_value = pock[0]
+        pocket_mask = pockets_array == pocket_value
+        write_dx_grid(pocket_output + '.dx', header_lines, numpy.where(pocket_mask, grid_values, 0))
+
+        # Convert the grid coordinates to pdb
+        new_pdb_lines = []
+        # HARDCODE: Since we are cding to the current file we must remove the MD path from the prefix
+        fixed_pockets_prefix = pockets_prefix.split('/')[-1]
+        new_pdb_filename = fixed_pockets_prefix + '_' + str(p).zfill(2) + '.pdb'
+        for lines_count, j in enumerate(numpy.flatnonzero(pocket_mask).tolist(), 1):
+            x, rem = divmod(j, yl*zl)
+            y, z = divmod(rem, zl)
+            atom_num = str(lines_count).rjust(6,' ')
+            x_coordinates = str(round((origin[0] + x) * 1000) / 1000).rjust(8, ' ')
+            y_coordinates = str(round((origin[1] + y) * 1000) / 1000).rjust(8, ' ')
+            z_coordinates = str(round((origin[2] + z) * 1000) / 1000).rjust(8, ' ')
+            line = "ATOM "+ atom_num +"  C   PTH     1    "+ x_coordinates + y_coordinates + z_coordinates +"  0.00  0.00\n"
+            new_pdb_lines.append(line)
+
+        # Write the pdb file
+        with open(new_pdb_filename,'w') as file:
+            for line in new_pdb_lines:
+                file.write(line)
+
+        pocket_jobs.append((p, pocket_directory, pocket_name, checking_filename, new_pdb_filename))
+
+    # Run the mdpocket analysis focusing in a specific pocket
+    # Logs are only displayed when pockets are analyzed one by one, otherwise they would be mixed
+    logs = cores == 1
+    def analyze_pocket (p : int, pocket_directory : str, pocket_name : str, checking_filename : str, pocket_pdb_filename : str):
+        if logs:
             print(f' Analyzing pocket {p}/{pockets_number}', end='\r')
-            
-            # Create the new grid for this pocket, where all values from other pockets are set to 0
-            pocket_value = pock[0]
-            new_grid_values = [str(value).ljust(5,'0') if pockets[v] == pocket_value else '0.000' for v, value in enumerate(grid_values)]
-            new_grid_filename = mdpocket_folder_name + '/' + pocket_name + '.dx'
-            with open(new_grid_filename,'w') as file:
-                # Write the header lines
-                for line in header_lines:
-                    file.write(line)
-                # Write values in lines of 3 values
-                count = 0
-                line = ''
-                for value in new_grid_values:
-                    if count == 0:
-                        line = value
-                        count += 1
-                    elif count == 1:
-                        line = line + ' ' + value
-                        count += 1
-                    elif count == 2:
-                        line = line + ' ' + value + ' \n'
-                        file.write(line)
-                        count = 0
-
-            # Set a function to get the 'x, y, z' coordinates of a given grid point index
-            def get_coordinates (index : int) -> tuple:
-                x, rem = divmod(index, yl*zl)
-                y, z = divmod(rem, zl)
-                return (x,y,z)
-
-            # Convert the grid coordinates to pdb
-            new_pdb_lines = []
-            lines_count = 0
-            # HARDCODE: Since we are cding to the current file we must remove the MD path from the prefix
-            fixed_pockets_prefix = pockets_prefix.split('/')[-1]
-            new_pdb_filename = fixed_pockets_prefix + '_' + str(p).zfill(2) + '.pdb'
-            for j, pocket in enumerate(pockets):
-                if pocket != pocket_value:
-                    continue
-                x,y,z = get_coordinates(j)
-                lines_count += 1
-                atom_num = str(lines_count).rjust(6,' ')
-                x_coordinates = str(round((origin[0] + x) * 1000) / 1000).rjust(8, ' ')
-                y_coordinates = str(round((origin[1] + y) * 1000) / 1000).rjust(8, ' ')
-                z_coordinates = str(round((origin[2] + z) * 1000) / 1000).rjust(8, ' ')
-                line = "ATOM "+ atom_num +"  C   PTH     1    "+ x_coordinates + y_coordinates + z_coordinates +"  0.00  0.00\n"
-                new_pdb_lines.append(line)
-
-            # Write the pdb file
-            with open(new_pdb_filename,'w') as file:
-                for line in new_pdb_lines:
-                    file.write(line)
-
-            # Run the mdpocket analysis focusing in this specific pocket
             print(GREY_HEADER)
-            error_logs = run([
-                "mdpocket",
-                "--trajectory_file",
-                auxiliar_trajectory_filepath,
-                "--trajectory_format",
-                "xtc",
-                "-f",
-                # WARNING: There is a silent sharp limit of characters here
-                # To avoid the problem we must use the relative path instead of the absolute path
-                auxiliar_structure_filepath,
-                "-o",
-                pocket_output,
-                "--selected_pocket",
-                new_pdb_filename,
-            ], stderr=PIPE).stderr.decode()
+        process = run([
+            "mdpocket",
+            "--trajectory_file",
+            pocket_auxiliar_trajectory_filepath,
+            "--trajectory_format",
+            "xtc",
+            "-f",
+            # WARNING: There is a silent sharp limit of characters here
+            # To avoid the problem we must use the relative path instead of the absolute path
+            pocket_auxiliar_structure_filepath,
+            "-o",
+            pocket_name,
+            "--selected_pocket",
+            f'../../{pocket_pdb_filename}',
+        ], stdout=None if logs else PIPE, stderr=PIPE, cwd=pocket_directory)
+        error_logs = process.stderr.decode()
+        if logs:
             print(COLOR_END)
+        # If file does not exist or is still empty at this point then somethin went wrong
+        scratch_checking_filename = pocket_directory + '/' + basename(checking_filename)
+        if not exists(scratch_checking_filename) or getsize(scratch_checking_filename) == 0:
+            print(error_logs)
+            raise Exception(f'Something went wrong with mdpocket while analysing pocket {p}')
+        # Move outputs to the mdpocket folder and remove the scratch directory
+        # The checking file is moved at the end so an interrupted move is never taken as a complete pocket
+        output_filenames = sorted(listdir(pocket_directory), key=lambda filename: filename == basename(checking_filename))
+        for output_filename in output_filenames:
+            replace(pocket_directory + '/' + output_filename, mdpocket_folder_name + '/' + output_filename)
+        rmdir(pocket_directory)
+        # Remove previous lines
+        if logs:
+            print(ERASE_4_PREVIOUS_LINES)
 
-            # If file does not exist or is still empty at this point then somethin went wrong
-            if not exists(checking_filename) or getsize(checking_filename) == 0:
-                print(error_logs)
-                raise Exception(f'Something went wrong with mdpocket while analysing pocket {p}')
+    # Run all pending pockets
+    if len(pocket_jobs) > 0:
+        if not logs:
+            print(f' Analyzing {len(pocket_jobs)} pockets ({min(cores, len(pocket_jobs))} at a time)')
+        with ThreadPoolExecutor(max_workers=cores) as executor:
+            futures = [ executor.submit(analyze_pocket, *job) for job in pocket_jobs ]
+            # Get results to raise any error which happened in the meantime
+            for future in futures:
+                future.result()
 
-            # Remove previous lines
-            print(ERASE_4_PREVIOUS_LINES)
+    # Set the dict where all output data will be stored
+    output_analysis = []
+
+    # Mine the output of every pocket
+    for pocket_name, pocket_output in pocket_outputs:
 
         # Mine data from the mdpocket 'descriptors' output file
         descriptors_data = {}
@@ -528,4 +499,62 @@ def pockets (
     start = 0
 
     # Export the analysis in json format
-    save_json({ 'data': output_analysis, 'start': start, 'step': step }, output_analysis_filepath)
\ No newline at end of file
+    save_json({ 'data': output_analysis, 'start': start, 'step': step }, output_analysis_filepath)
+
+# Read a grid file in OpenDX format (.dx)
+# Return the header lines, the grid dimensions, the grid origin and the grid values as a flat array
+# Grid values are disposed first in 'z' order, then 'y', and finally 'x'
+def read_dx_grid (filename : str) -> tuple:
+    with open(filename, 'r') as file:
+        content = file.read()
+    lines = content.split('\n')
+    # First, mine header lines along with the grid dimensions and origin
+    header_lines = []
+    dimensions = None
+    dimensions_pattern = "counts ([0-9]+) ([0-9]+) ([0-9]+)"
+    origin = None
+    origin_pattern = "origin ([.0-9-]+) ([.0-9-]+) ([.0-9-]+)"
+    header_pattern = "^[a-z]"
+    body_start = len(lines)
+    for l, line in enumerate(lines):
+        # Header lines start with a letter
+        # Comments are skipped since the original grid parser never kept them
+        if line.startswith('#'):
+            continue
+        if not re.match(header_pattern, line):
+            body_start = l
+            break
+        header_lines.append(line + '\n')
+        search = re.search(dimensions_pattern, line)
+        if search != None:
+            dimensions = (int(search.group(1)),int(search.group(2)),int(search.group(3)))
+        search = re.search(origin_pattern, line)
+        if search != None:
+            origin = (float(search.group(1)),float(search.group(2)),float(search.group(3)))
+    # If dimensions are missing there is nothing else to do
+    if not dimensions:
+        return header_lines, None, origin, None
+    # Next, parse the grid values at once
+    # Values are listed 3 per line, although the last line may have less values
+    # Note that there may be some trailing lines after the values (e.g. 'attribute', 'object') which are ignored
+    body_end = next((l for l in range(body_start, len(lines)) if re.match(header_pattern, lines[l])), len(lines))
+    body = ' '.join(lines[body_start:body_end])
+    grid_values = numpy.fromstring(body, dtype=float, sep=' ')
+    expected_values = dimensions[0] * dimensions[1] * dimensions[2]
+    if len(grid_values) != expected_values:
+        raise ValueError(f'Wrong number of values in grid {filename}: expected {expected_values} but found {len(grid_values)}')
+    return header_lines, dimensions, origin, grid_values
+
+# Write a grid file in OpenDX format (.dx) given its header lines and values
+# Values are written in lines of 3 values
+def write_dx_grid (filename : str, header_lines : List[str], grid_values : 'numpy.ndarray'):
+    # Non-zero values are written as they are and zeros are written as '0.000'
+    values = [ str(value).ljust(5,'0') if value else '0.000' for value in grid_values.tolist() ]
+    with open(filename, 'w') as file:
+        # Write the header lines
+        for line in header_lines:
+            file.write(line)
+        # Write values in lines of 3 values
+        # Note that residual values which do not complete a line are not written, as mdpocket does not need them
+        for v in range(0, len(values) - 2, 3):
+            file.write(values[v] + ' ' + values[v+1] + ' ' + values[v+2] + ' \n')
@@ -1,9 +1,9 @@
-from biobb_mem.lipyphilic_biobb.lpp_zpositions import lpp_zpositions, frame_df
-from model_workflow.utils.pyt_spells import get_reduced_pytraj_trajectory
+from model_workflow.tools.get_reduced_trajectory import calculate_frame_step
+from model_workflow.utils.pyt_spells import get_pytraj_trajectory
+from model_workflow.utils.selections import Selection
 from model_workflow.utils.auxiliar import save_json
 from model_workflow.utils.type_hints import *
-from contextlib import redirect_stdout
-import os
+import numpy as np
 
 
 def thickness (
@@ -19,47 +19,71 @@ def thickness (
         return
     print('-> Running thickness analysis')
 
-    tj, frame_step, frames_count = get_reduced_pytraj_trajectory(input_structure_filepath, input_trajectory_filepath, snapshots, frames_limit)
     head_sel = []
     for n in range(membrane_map['n_mems']):
         head_sel.extend(membrane_map['mems'][str(n)]['polar_atoms']['top'])
         head_sel.extend(membrane_map['mems'][str(n)]['polar_atoms']['bot'])
-    head_sel_mda = 'index ' + " ".join(map(str,(head_sel)))
-    # Run the analysis on the whole membrane
-    prop = {
-        'lipid_sel': head_sel_mda,
-        'steps': frame_step,
-        'height_sel': head_sel_mda,
-        'ignore_no_box': True,
-        'disable_logs': True
-    }
-    print(' Running BioBB LiPyphilic ZPositions')
-    with redirect_stdout(None):
-        lpp_zpositions(input_top_path=input_structure_filepath,
-                    input_traj_path=input_trajectory_filepath,
-                    output_positions_path='.zpositions.csv',
-                    properties=prop)
-    df = frame_df('.zpositions.csv') # Per frame data
-    os.remove('.zpositions.csv')
+    # Load only the head group atoms, so every frame is read with the minimum coordinates
+    head_selection = Selection(head_sel)
+    tj = get_pytraj_trajectory(input_structure_filepath, input_trajectory_filepath, head_selection)
+    frame_step, _ = calculate_frame_step(snapshots, frames_limit)
 
-    # Calculate the mean z position of midplane wrt the box axis using pytraj
+    # Calculate the head group z positions relative to the membrane midpoint in one streamed pass
+    # This is the same than the LiPyphilic ZPositions analysis with a single bin:
+    # z positions are wrapped in the box and the midpoint is the mean z position of all head groups
+    # Also calculate the mean z position of midplane wrt the box axis (unwrapped)
+    frames = []
+    mean_positive = []
+    mean_negative = []
+    std_positive = []
+    std_negative = []
+    thickness = []
+    std_thickness = []
     midplane_z = []
-    for i in range(0, frames_count):
-        frame = tj[i]
-        selected_atoms = frame[head_sel]
-        mean_z = selected_atoms.mean(axis=0)[2]
-        midplane_z.append(float(mean_z))
+    for f, frame in enumerate(tj.iterframe(start=0, stop=snapshots, step=frame_step)):
+        z_coordinates = np.array(frame.xyz[:, 2], dtype=float)
+        midplane_z.append(float(z_coordinates.mean()))
+        # Wrap z coordinates if there is a box
+        box_z = frame.box.values[2]
+        if box_z > 0:
+            z_coordinates = z_coordinates % box_z
+        z_positions = z_coordinates - z_coordinates.mean()
+        # Get the statistics of every leaflet
+        positive = z_positions[z_positions > 0]
+        negative = z_positions[z_positions < 0]
+        frame_mean_positive = _mean(positive)
+        frame_mean_negative = _mean(negative)
+        frames.append(f)
+        mean_positive.append(frame_mean_positive)
+        mean_negative.append(frame_mean_negative)
+        std_positive.append(_std(positive))
+        std_negative.append(_std(negative))
+        thickness.append(frame_mean_positive - frame_mean_negative)
+        std_thickness.append(_std(np.abs(z_positions)))
     # Save the data
     data = { 'data':{
-        'frame': df.index.tolist(),
-        'mean_positive': df['mean_positive'].tolist(),
-        'mean_negative': df['mean_negative'].tolist(),
-        'std_positive': df['std_positive'].tolist(),
-        'std_negative': df['std_negative'].tolist(),
-        'thickness': df['thickness'].tolist(),
-        'std_thickness': df['std_thickness'].tolist(),
+        'frame': frames,
+        'mean_positive': mean_positive,
+        'mean_negative': mean_negative,
+        'std_positive': std_positive,
+        'std_negative': std_negative,
+        'thickness': thickness,
+        'std_thickness': std_thickness,
         'midplane_z': midplane_z,
         'step': frame_step
         }
     }
-    save_json(data, output_analysis_filepath)
\ No newline at end of file
+    save_json(data, output_analysis_filepath)
+
+# Get the mean of an array as a float, or nan if the array is empty
+def _mean (values : 'np.ndarray') -> float:
+    if len(values) == 0:
+        return float('nan')
+    return float(values.mean())
+
+# Get the sample standard deviation of an array as a float, or nan if there are not enough values
+# Note that the sample standard deviation is used for coherence with pandas
+def _std (values : 'np.ndarray') -> float:
+    if len(values) < 2:
+        return float('nan')
+    return float(values.std(ddof=1))
@@ -34,6 +34,14 @@ def main ():
     # Apply common arguments as necessary
     if hasattr(args, 'no_symlinks') and args.no_symlinks:
         GLOBALS['no_symlinks'] = True
+    if hasattr(args, 'cores') and args.cores:
+        GLOBALS['cores'] = args.cores
+    if hasattr(args, 'offline') and args.offline:
+        GLOBALS['offline'] = True
+    if hasattr(args, 'remote_cache') and args.remote_cache:
+        GLOBALS['remote_cache'] = True
+    if hasattr(args, 'no_fingerprints') and args.no_fingerprints:
+        GLOBALS['fingerprints'] = False
     # Find which subcommand was called
     subcommand = args.subcommand
     # If there is not subcommand then print help
@@ -246,6 +254,22 @@ common_parser = ArgumentParser(add_help=False)
 # However symlinks are not always allowed in all file systems so this is sometimes necessary
 common_parser.add_argument("-ns", "--no_symlinks", default=False, action='store_true', help="Do not use symlinks internally")
 
+# Set the number of parallel workers to be used by those processes which support parallelization
+# Note that each worker may launch its own third party process (e.g. CMIP) so memory usage grows accordingly
+common_parser.add_argument("-nc", "--cores", type=int, default=1, help="Number of parallel workers (1 by default)")
+
+# If this argument is passed then external services (e.g. UniProt, PDB, BLAST) are never requested
+# Only results already in the lookup cache are used
+common_parser.add_argument("-off", "--offline", default=False, action='store_true', help="Do not request external services but use cached lookups only")
+
+# If this argument is passed then files downloaded from the remote database are kept in a cache shared by all runs
+# The cache directory is set by the MWF_CACHE environmental variable and its size limit (in GB) by MWF_CACHE_SIZE
+common_parser.add_argument("-rc", "--remote_cache", default=False, action='store_true', help="Keep downloaded files in a shared cache so they are downloaded only once")
+
+# If this argument is passed then processed files are considered modified whenever their modification time changes
+# Otherwise their content fingerprint is checked, so copied or touched files are not processed again
+common_parser.add_argument("-nofp", "--no_fingerprints", default=False, action='store_true', help="Do not check file content fingerprints but modification times only")
+
 # Define console arguments to call the workflow
 parser = ArgumentParser(description="MoDEL Workflow", formatter_class=RawTextHelpFormatter)
 subparsers = parser.add_subparsers(help='Name of the subcommand to be used', dest="subcommand")
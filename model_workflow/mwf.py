@@ -881,8 +881,9 @@ class MD:
         self._trajectory_file = output_trajectory_file
         self.project._topology_file = output_topology_file
 
-        # Register the last modification times of the recently processed files
+        # Register the last modification times and content fingerprints of the recently processed files
         # This way we know if they have been modifed in the future and checkings need to be rerun
+        # Fingerprints avoid processing again files which were just copied, touched or restored from a backup
         self.register.update_mtime(output_structure_file)
         self.register.update_mtime(output_trajectory_file)
         if output_topology_file != MISSING_TOPOLOGY:
@@ -1754,6 +1755,7 @@ class MD:
             charges = self.charges,
             snapshots = self.snapshots,
             frames_limit = 100,
+            cores = GLOBALS['cores'],
         )
 
     # Dihedral energies
@@ -1804,6 +1806,7 @@ class MD:
             pbc_selection = self.pbc_selection,
             snapshots = self.snapshots,
             frames_limit = 100,
+            cores = GLOBALS['cores'],
         )
 
     # Helical parameters
@@ -1826,6 +1829,8 @@ class MD:
             structure = self.structure,
             structure_filename= self.structure_file.path,
             frames_limit = None,
+            snapshots = self.snapshots,
+            cores = GLOBALS['cores'],
         )
         
     # Markov
@@ -1913,6 +1918,7 @@ class MD:
             input_trajectory_filepath = self.trajectory_file.path,
             output_analysis_filepath = output_apl_filepath,
             membrane_map = self.project.membrane_map,
+            snapshots = self.snapshots,
         )
     # Lipid order
     def run_lipid_order_analysis (self):
@@ -2193,7 +2199,7 @@ class Project:
         else:
             available_directories = sorted(next(walk(self.directory))[1])
             for directory in available_directories:
-                if exists(directory + '/' + REGISTER_FILENAME):
+                if exists(directory + '/' + REGISTER_FILENAME) or exists(directory + '/' + LEGACY_REGISTER_FILENAME):
                     self._md_directories.append(directory)
             # If we found no MD directory then it means MDs were never declared before
             if len(self._md_directories) == 0:
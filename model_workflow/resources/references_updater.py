@@ -5,7 +5,7 @@ from model_workflow.utils.constants import *
 from model_workflow.utils.file import File
 from model_workflow.tools.generate_pdb_references import generate_pdb_references 
 from model_workflow.tools.generate_map import get_uniprot_reference
-from model_workflow.tools.chains import request_interpsocan, get_interproscan_results
+from model_workflow.tools.chains import get_interproscan_results
 from model_workflow.utils.auxiliar import save_json
 
 # Set the database API URL
@@ -125,19 +125,10 @@ def updater(ref_type = 'proteins'):
             for i in range(0, len(sequences_list), batch_size):
                 batch = sequences_list[i:i+batch_size]
                 print(f"Processing batch {i//batch_size + 1}/{(len(sequences_list)-1)//batch_size + 1} ({len(batch)} sequences)")
-                
-                # Save the jobids of every call to InterProScan
-                interproscan_jobids = {}
                 # Request interproscan for each sequence in the batch
-                for sequence in batch:
-                    interproscan_jobid = request_interpsocan(sequence)
-                    interproscan_jobids[sequence] = interproscan_jobid
-                    print(f"  Submitted {sequence} to interproscan: {interproscan_jobid}")
-                # Get the pending interpsocan jobids 
-                pending_jobids = list(interproscan_jobids.values())
                 # Get results and add to references
                 batch_references = [{'sequence': sequence, 'interproscan': None} for sequence in batch]
-                get_interproscan_results(pending_jobids, interproscan_jobids, batch_references, File(references_filename))
+                get_interproscan_results(batch, batch_references, File(references_filename))
                 # Add batch results to main references list
                 new_references.extend(batch_references)
                 # Save progress after each batch
@@ -5,17 +5,42 @@ import time
 from urllib.request import urlopen
 from urllib.parse import urlencode
 from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from model_workflow.utils.auxiliar import warn,load_json, save_json, protein_residue_name_to_letter
+from model_workflow.utils.lookup_cache import LookupCache, get_default_lookup_cache, get_hash_key
 from model_workflow.utils.type_hints import *
 
 # Set analysis version
 CHAINS_VERSION = '0.1'
 
+# Set the InterProScan service base URL
+INTERPROSCAN_URL = 'https://www.ebi.ac.uk/Tools/services/rest/iprscan5'
+# Maximum number of InterProScan jobs to be running at the same time
+# EBI allows up to 30 concurrent jobs per user
+MAX_CONCURRENT_JOBS = 25
+# Waiting time between job status checks
+# It grows after every check while the job is still running, up to the maximum
+POLL_DELAY = 3 # seconds
+MAX_POLL_DELAY = 30 # seconds
+POLL_DELAY_FACTOR = 1.5
+# Maximum time to wait for all jobs to finish
+# AGUS: a veces ha llegado a tardar ~6 minutos que es excesivo, creo que  minutos es suficiente tiempo de espera
+# Unfinished jobs are remembered so a further run waits for them instead of submitting them again
+JOBS_TIMEOUT = 300 # 5 min (seg)
+# Time after which cached InterProScan results are requested again
+INTERPROSCAN_LOOKUPS_TTL = 180 * 24 * 3600 # 180 days
+# Time after which a submitted job is not expected to be available in InterProScan anymore
+INTERPROSCAN_JOB_TTL = 24 * 3600 # 1 day
+# InterProScan status of jobs which are not finished yet
+RUNNING_JOB_STATUS = { 'RUNNING', 'PENDING', 'QUEUED' }
+# InterProScan status of jobs which are not found (e.g. they expired)
+MISSING_JOB_STATUS = { None, 'NOT_FOUND' }
+
 # Get the sequence and name of the chain in the structure and request the InterProScan 
 def request_interpsocan (sequence : str) -> str:
     # Set the request URL
-    request_url = 'https://www.ebi.ac.uk/Tools/services/rest/iprscan5/run'
+    request_url = f'{INTERPROSCAN_URL}/run'
     # Set the POST data
     data = urlencode({
         'email': 'daniel.beltran@irbbarcelona.org',
@@ -38,7 +63,7 @@ def request_interpsocan (sequence : str) -> str:
 # Check the status of the InterProScan job
 def check_interproscan_status (jobid : str) -> str:
     # Set the request URL
-    request_url = f'https://www.ebi.ac.uk/Tools/services/rest/iprscan5/status/{jobid}'   
+    request_url = f'{INTERPROSCAN_URL}/status/{jobid}'
     parsed_response = None
     try:
         with urlopen(request_url) as response:
@@ -55,7 +80,7 @@ def check_interproscan_status (jobid : str) -> str:
 # Obtain the result of the InterProScan job in json format
 def check_interproscan_result (jobid : str) -> dict:
     # Set the request URL
-    request_url = f'https://www.ebi.ac.uk/Tools/services/rest/iprscan5/result/{jobid}/json'   
+    request_url = f'{INTERPROSCAN_URL}/result/{jobid}/json'
     parsed_response = None
     try:
         with urlopen(request_url) as response:
@@ -129,6 +154,84 @@ def import_chains (chains_references_file : 'File') -> dict:
                 imported_chain[expected_field] = None
     return imported_chains
 
+
+# Remove version and pathways from InterProScan results so Mongo don't get confused when they change
+def clean_interproscan_result (interproscan_result : dict) -> dict:
+    interproscan_result.pop('interproscan-version', None)
+    # RUBEN: creo que results siempre tiene un solo elemento, pero por si acaso iteramos
+    for result in interproscan_result['results']:
+        for match in result['matches']:
+            if match['signature']['entry'] is not None:
+                match['signature']['entry'].pop('pathwayXRefs', None)
+    return interproscan_result
+
+# InterProScan lookups through a persistent cache
+# Results are keyed by sequence so the same sequence is never analyzed twice, even in different projects
+# Submitted jobs are also kept until they finish so further runs may wait for them instead of submitting them again
+class ChainLookups:
+    def __init__ (self, cache : Optional[LookupCache] = None):
+        self.cache = cache if cache != None else get_default_lookup_cache()
+
+    # Get the cached InterProScan results of a sequence, if any
+    def find_interproscan_result (self, sequence : str) -> Optional[dict]:
+        found, interproscan_result = self.cache.get('interproscan', get_hash_key(sequence),
+            ttl = INTERPROSCAN_LOOKUPS_TTL)
+        return interproscan_result if found else None
+
+    def save_interproscan_result (self, sequence : str, interproscan_result : dict):
+        self.cache.set('interproscan', get_hash_key(sequence), interproscan_result)
+        self.cache.remove('interproscan_job', get_hash_key(sequence))
+
+    # Get the id of a previously submitted InterProScan job for a sequence, if any
+    def find_interproscan_job (self, sequence : str) -> Optional[str]:
+        found, jobid = self.cache.get('interproscan_job', get_hash_key(sequence), ttl = INTERPROSCAN_JOB_TTL)
+        return jobid if found else None
+
+    def save_interproscan_job (self, sequence : str, jobid : str):
+        self.cache.set('interproscan_job', get_hash_key(sequence), jobid)
+
+    def remove_interproscan_job (self, sequence : str):
+        self.cache.remove('interproscan_job', get_hash_key(sequence))
+
+# Get the InterProScan results of a sequence
+# Resume the job previously submitted for this sequence, if any, or submit a new job otherwise
+# Then check the job status with a growing delay until it finishes or the deadline is reached
+# Return None if the job is not finished before the deadline, but keep it so it can be resumed later
+def get_interproscan_result (sequence : str, lookups : ChainLookups, deadline : float) -> Optional[dict]:
+    jobid = lookups.find_interproscan_job(sequence)
+    resumed = jobid != None
+    while True:
+        # Submit a new job if there is no job to be resumed
+        if jobid == None:
+            if time.time() > deadline:
+                return None
+            jobid = request_interpsocan(sequence)
+            if jobid == None:
+                return None
+            lookups.save_interproscan_job(sequence, jobid)
+        delay = POLL_DELAY
+        status = check_interproscan_status(jobid)
+        while status in RUNNING_JOB_STATUS:
+            if time.time() + delay > deadline:
+                return None
+            time.sleep(delay)
+            delay = min(delay * POLL_DELAY_FACTOR, MAX_POLL_DELAY)
+            status = check_interproscan_status(jobid)
+        if status == 'FINISHED':
+            break
+        # If the status is something that we don´t know then we raise an error in order to solucionate this problem
+        lookups.remove_interproscan_job(sequence)
+        if not (resumed and status in MISSING_JOB_STATUS):
+            raise ValueError('Something went wrong with the InterProScan job: ' + jobid)
+        # A resumed job may have expired so it is submitted again
+        print(f' InterProScan job {jobid} is not available anymore. Submitting it again.')
+        jobid = None
+        resumed = False
+    # Retrive the results from InterProScan
+    interproscan_result = clean_interproscan_result(check_interproscan_result(jobid))
+    lookups.save_interproscan_result(sequence, interproscan_result)
+    return interproscan_result
+
 # Define the main function that will be called from the main script
 # This function will get the parsed chains from the structure and request the InterProScan service
 # to obtain the data for each chain
@@ -136,10 +239,15 @@ def generate_chain_references (
     structure : 'Structure',
     chains_references_file : 'File',
     database_url : str,
-) -> dict:
+    lookups : Optional[ChainLookups] = None,
+) -> List[dict]:
     
     print('-> Getting protein chains data')
 
+    # Set the default lookups, with the shared cache
+    if lookups == None:
+        lookups = ChainLookups()
+
     # Obtain the protein parsed chains from the structure
     protein_parsed_chains = get_protein_parsed_chains(structure)
 
@@ -154,15 +262,16 @@ def generate_chain_references (
     if chains_references_file.exists:
         chains_data += import_chains(chains_references_file)
 
-    # Save the jobids of every call to InterProScan
-    interproscan_jobids = {}
+    # Save the sequences which are missing the InterProScan results
+    pending_sequences = []
 
     # Iterate protein sequences
     for sequence in protein_sequences:
-        # Check if the chain data already exists in the chains file
+        # Check if the chain data already exists in the chains file
         chain_data = next((data for data in chains_data if data['sequence'] == sequence), None)
         # If we have no previous chain data then check if the sequence is already in the MDDB database
-        if chain_data == None:
+        # MDDB is not requested when offline
+        if chain_data == None and not lookups.cache.offline:
             chain_data = check_sequence_in_mddb(sequence, database_url)
             if chain_data is not None:
                 chains_data.append(chain_data)
@@ -178,70 +287,65 @@ def generate_chain_references (
                 'interproscan': None
             }
             chains_data.append(chain_data)
-        # If chain data is missing any analysis then send a job
-        # Request the InterProScan service
-        # Keep the returned job ids to check the status and get the results later
+        # If chain data is missing any analysis then check the shared cache
+        # If the sequence was never analyzed then InterProScan is requested later
         if chain_data['interproscan'] == None:
-            interproscan_jobid = request_interpsocan(sequence)
-            interproscan_jobids[sequence] = interproscan_jobid
-
-    # Get the pending interpsocan jobids 
-    pending_jobids = list(interproscan_jobids.values())
+            interproscan_result = lookups.find_interproscan_result(sequence)
+            if interproscan_result != None:
+                chain_data['version'] = CHAINS_VERSION
+                chain_data['interproscan'] = interproscan_result
+                save_json(chains_data, chains_references_file.path)
+            else:
+                pending_sequences.append(sequence)
 
     # If we already have the results of all the chains then we can skip the next steps
-    if len(pending_jobids) == 0:
+    if len(pending_sequences) == 0:
         print(' All reference chains are already in the backup file')
         return chains_data
+    # InterProScan is not requested when offline
+    if lookups.cache.offline:
+        warn(f'Missing InterProScan results for {len(pending_sequences)} sequences and we are offline')
+        return chains_data
     # RUBEN: Separated functions so can be used in the references updater
-    get_interproscan_results(pending_jobids, interproscan_jobids, chains_data, chains_references_file)
-
+    get_interproscan_results(pending_sequences, chains_data, chains_references_file, lookups)
+    return chains_data
 
+# Get the InterProScan results of several sequences and add them to their chains data
+# Jobs are submitted and checked concurrently and results are saved as soon as they are available
+# Return the sequences whose results could not be obtained before the timeout
 def get_interproscan_results (
-    pending_jobids : list,
-    interproscan_jobids : dict,
-    chains_data : list,
+    sequences : List[str],
+    chains_data : List[dict],
     chains_references_file : 'File',
-) -> None:
-    # Set the timeout for the InterProScan jobs
-    # AGUS: a veces ha llegado a tardar ~6 minutos que es excesivo, creo que  minutos es suficiente tiempo de espera
-    TIMEOUT = 300  # 5 min (seg)
-    start_time = time.time()
-    # Iterate over the jobids to check the status and get the results
-    # If the status is 'FINISHED' then we can get the results and eliminate the jobid from the list 
-    # until there are no more jobids in either list
-    while len(pending_jobids) >= 1:
-        if time.time() - start_time > TIMEOUT:
-            warn("Waiting time exceeded the limit. Chains data could not be obtained. Exiting analysis.")
-            return
-        time.sleep(3)  # Wait for 3 seconds
-        print(f' We are still waiting for {len(pending_jobids)} jobs to finish', end='\r')
-        for sequence, interproscan_jobid in interproscan_jobids.items():
-            # If the jobid is already processed then skip it
-            if interproscan_jobid not in pending_jobids:
+    lookups : Optional[ChainLookups] = None,
+) -> List[str]:
+    # Set the default lookups, with the shared cache
+    if lookups == None:
+        lookups = ChainLookups()
+    pending_sequences = list(sequences)
+    if len(pending_sequences) == 0:
+        return pending_sequences
+    deadline = time.time() + JOBS_TIMEOUT
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_JOBS, len(pending_sequences))) as executor:
+        requested_results = { executor.submit(get_interproscan_result, sequence, lookups, deadline): sequence
+            for sequence in pending_sequences }
+        for requested_result in as_completed(requested_results):
+            interproscan_result = requested_result.result()
+            if interproscan_result == None:
                 continue
-            status = check_interproscan_status(interproscan_jobid)
-            # We only know four possible status for interproscan jobs, but it could be more
-            if status == 'RUNNING' or status == 'PENDING' or status == 'QUEUED':
-                continue
-            # If the status is something that we don´t know then we raise an error in order to solucionate this problem
-            if status != 'FINISHED':
-                raise ValueError('Something went wrong with the InterProScan job: ' + interproscan_jobid)
-            # Retrive the results from InterProScan
-            interproscan_result = check_interproscan_result(interproscan_jobid)
+            sequence = requested_results[requested_result]
             # Get corresponding chain data and add the InterProScan results
             chain_data = next(data for data in chains_data if data['sequence'] == sequence)
             chain_data['version'] = CHAINS_VERSION
             chain_data['interproscan'] = interproscan_result
-            # Remove version and pathways so Mongo don't get confused when they change
-            del chain_data['interproscan']['interproscan-version']
-            # RUBEN: creo que results siempre tiene un solo elemento, pero por si acaso iteramos
-            for result in chain_data['interproscan']['results']:
-                for match in result['matches']:
-                    if match['signature']['entry'] is not None:
-                        del match['signature']['entry']['pathwayXRefs']
-            # Remove the jobid from the queue list
-            pending_jobids.remove(interproscan_jobid)
+            # Remove the sequence from the queue list
+            pending_sequences.remove(sequence)
             # Save the result
             save_json(chains_data, chains_references_file.path)
-
+            print(f' We are still waiting for {len(pending_sequences)} jobs to finish', end='\r')
+    if len(pending_sequences) > 0:
+        warn(f"Waiting time exceeded the limit. Chains data could not be obtained for {len(pending_sequences)} sequences."
+            " Their jobs will be resumed in the next run.")
+        return pending_sequences
     print(' Protein chains data obtained              ')
+    return pending_sequences
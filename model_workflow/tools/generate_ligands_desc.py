@@ -8,19 +8,107 @@ from model_workflow.utils.constants import LIGANDS_MATCH_FLAG, PDB_TO_PUBCHEM, L
 from model_workflow.utils.auxiliar import InputError, load_json, save_json, request_pdb_data
 from model_workflow.utils.type_hints import *
 from model_workflow.utils.structures import Structure
+from model_workflow.utils.lookup_cache import LookupCache, get_default_lookup_cache
 from urllib.request import Request, urlopen
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlparse
 from urllib.error import HTTPError, URLError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock, BoundedSemaphore
+import time
 import re
 
+# Set the services base URLs
+DRUGBANK_URL = 'https://go.drugbank.com'
+CHEMBL_URL = 'https://www.ebi.ac.uk/chembl'
+PUBCHEM_URL = 'https://pubchem.ncbi.nlm.nih.gov'
+RCSB_URL = 'https://www.rcsb.org'
+
+# Maximum number of simultaneous requests to external services
+MAX_CONCURRENT_REQUESTS = 8
+# Maximum number of requests per second to every service
+# PubChem blocks users sending more than 5 requests per second
+DEFAULT_REQUESTS_PER_SECOND = 10
+REQUESTS_PER_SECOND = { urlparse(PUBCHEM_URL).netloc: 5 }
+# Number of retries for failed requests and the base waiting time between retries
+REQUEST_RETRIES = 4
+RETRY_DELAY = 1 # seconds
+# HTTP errors which are worth a retry
+RETRIABLE_HTTP_CODES = { 408, 429, 500, 502, 503, 504 }
+# Time after which cached ligand lookups are requested again
+LIGAND_LOOKUPS_TTL = 30 * 24 * 3600 # 30 days
+
+# Limit the number of requests per second sent to a service
+# It is shared by all threads requesting the same service
+class RateLimiter:
+    def __init__ (self, requests_per_second : float):
+        self.interval = 1 / requests_per_second
+        self.next_time = 0
+        self.lock = Lock()
+
+    # Wait until the next request is allowed
+    def wait (self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+# Rate limiters by service host
+rate_limiters = {}
+rate_limiters_lock = Lock()
+def get_rate_limiter (host : str) -> RateLimiter:
+    with rate_limiters_lock:
+        rate_limiter = rate_limiters.get(host, None)
+        if not rate_limiter:
+            rate_limiter = RateLimiter(REQUESTS_PER_SECOND.get(host, DEFAULT_REQUESTS_PER_SECOND))
+            rate_limiters[host] = rate_limiter
+        return rate_limiter
+
+# Limit the number of simultaneous requests to external services
+# It is shared by all threads, so the limit is kept even when thread pools are nested
+requests_semaphore = BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Open a URL respecting the service rate limit and the limit of simultaneous requests
+# The request counts as running until the response is closed, so this must be used in a 'with' statement
+@contextmanager
+def open_url (request : Union[str, Request], data : Optional[bytes] = None):
+    with requests_semaphore, send_request(request, data) as response:
+        yield response
+
+# Send a request respecting the service rate limit
+# Failed requests are retried with an exponential backoff when the error may be temporal
+# Other errors (e.g. 404) are raised immediately, as urlopen would do
+def send_request (request : Union[str, Request], data : Optional[bytes] = None):
+    url = request.full_url if isinstance(request, Request) else request
+    rate_limiter = get_rate_limiter(urlparse(url).netloc)
+    attempt = 0
+    while True:
+        rate_limiter.wait()
+        try:
+            return urlopen(request, data=data)
+        except HTTPError as error:
+            if error.code not in RETRIABLE_HTTP_CODES or attempt >= REQUEST_RETRIES:
+                raise
+            # Respect the waiting time requested by the server, if any
+            retry_after = error.headers.get('Retry-After', None) if error.headers else None
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else RETRY_DELAY * 2 ** attempt
+        except URLError:
+            if attempt >= REQUEST_RETRIES:
+                raise
+            delay = RETRY_DELAY * 2 ** attempt
+        attempt += 1
+        time.sleep(delay)
+
 def get_drugbank_smiles (id_drugbank : str) -> Optional[str]:
     # Request Drugbank
     request_url = Request(
-        url= f'https://go.drugbank.com/structures/small_molecule_drugs/{id_drugbank}.smiles',
+        url= f'{DRUGBANK_URL}/structures/small_molecule_drugs/{id_drugbank}.smiles',
         headers={'User-Agent': 'Mozilla/5.0'}
     )
     try:
-        with urlopen(request_url) as response:
+        with open_url(request_url) as response:
             smiles = response.read()
     # If the accession is not found in the database then we stop here
     except HTTPError as error:
@@ -31,7 +119,7 @@ def get_drugbank_smiles (id_drugbank : str) -> Optional[str]:
             print('Error when requesting ' + request_url)
             raise ValueError('Something went wrong with the Drugbank request (error ' + str(error.code) + ')')
     # This error may occur if there is no internet connection
-    except URLError as error:
+    except URLError:
         print('Error when requesting ' + request_url)
         raise ValueError('Something went wrong with the MDposit request')
 
@@ -44,11 +132,11 @@ def get_chembl_smiles (id_chembl : str) -> Optional[str]:
     # Request ChemBL
     parsed_response = None
     request_url = Request(
-        url= f'https://www.ebi.ac.uk/chembl/interface_api/es_proxy/es_data/get_es_document/chembl_molecule/{id_chembl}',
+        url= f'{CHEMBL_URL}/interface_api/es_proxy/es_data/get_es_document/chembl_molecule/{id_chembl}',
         headers={'User-Agent': 'Mozilla/5.0'}
     )
     try:
-        with urlopen(request_url) as response:
+        with open_url(request_url) as response:
             parsed_response = json.loads(response.read().decode("utf-8"))
             smiles = parsed_response['_source']['molecule_structures']['canonical_smiles']
             pubchem_id = parsed_response['_source']['_metadata']['unichem'][8]['id']
@@ -69,9 +157,9 @@ def get_chembl_smiles (id_chembl : str) -> Optional[str]:
 def get_pubchem_data (id_pubchem : str) -> Optional[dict]:
     # Request PubChem
     parsed_response = None
-    request_url = f'https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/compound/{id_pubchem}/JSON/'
+    request_url = f'{PUBCHEM_URL}/rest/pug_view/data/compound/{id_pubchem}/JSON/'
     try:
-        with urlopen(request_url) as response:
+        with open_url(request_url) as response:
             #parsed_response = json.loads(response.read().decode("windows-1252"))
             parsed_response = json.loads(response.read().decode("utf-8", errors='ignore'))
     # If the accession is not found in PubChem then the id is not valid
@@ -193,7 +281,7 @@ def get_pubchem_data (id_pubchem : str) -> Optional[dict]:
 def find_drugbank_pubchem (drugbank_id):
     # Request Drugbank
     request_url = Request(
-    url=f'https://go.drugbank.com/drugs/{drugbank_id}',
+    url=f'{DRUGBANK_URL}/drugs/{drugbank_id}',
     headers={
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
         'Accept-Language': 'en-US,en;q=0.9',
@@ -202,7 +290,7 @@ def find_drugbank_pubchem (drugbank_id):
 )
     pubchem_id = None
     try:
-        with urlopen(request_url) as response:
+        with open_url(request_url) as response:
             content = response.read().decode("utf-8")
             pattern = re.compile("http\:\/\/pubchem.ncbi.nlm.nih.gov\/summary\/summary.cgi\?cid\=([0-9]*)")
             match = re.search(pattern, str(content))
@@ -216,7 +304,7 @@ def find_drugbank_pubchem (drugbank_id):
         # If the drugbank ID is not yet in the Drugbank references then return None
         raise ValueError(f'Wrong request. Code: {error.code}')
     # This error may occur if there is no internet connection
-    except URLError as error:
+    except URLError:
         print('Error when requesting ' + request_url)
         raise ValueError('Something went wrong with the DrugBank request')
     
@@ -227,11 +315,11 @@ def find_chembl_pubchem (id_chembl):
     # Request ChemBL
     parsed_response = None
     request_url = Request(
-         url= f'https://www.ebi.ac.uk/chembl/interface_api/es_proxy/es_data/get_es_document/chembl_molecule/{id_chembl}',
+         url= f'{CHEMBL_URL}/interface_api/es_proxy/es_data/get_es_document/chembl_molecule/{id_chembl}',
          headers={'User-Agent': 'Mozilla/5.0'}
     )
     try:
-        with urlopen(request_url) as response:
+        with open_url(request_url) as response:
             parsed_response = json.loads(response.read().decode("utf-8"))
             unichem = parsed_response['_source']['_metadata']['unichem']
             if unichem == None:
@@ -305,10 +393,16 @@ def generate_ligand_mapping (
     input_pdb_ids : List[str],
     output_ligands_filepath : str,
     mercy : List[str] = [],
+    # Cached access to external services
+    lookups : Optional['LigandLookups'] = None,
     ) -> dict:
 
     print('-> Getting ligand references')
 
+    # Set the default lookups, with the shared cache
+    if lookups == None:
+        lookups = LigandLookups()
+
     # Merge input ligands and pdb ligands
     ligands = []
     if input_ligands:
@@ -317,6 +411,10 @@ def generate_ligand_mapping (
     pdb_to_pubchem_cache = register.cache.get(PDB_TO_PUBCHEM, {})
     # Get input ligands from the pdb ids, if any
     if input_pdb_ids:
+        # Ask for all pdb ids which are not cached at the same time
+        missing_pdb_ids = [ pdb_id for pdb_id in input_pdb_ids if pdb_to_pubchem_cache.get(pdb_id, None) == None ]
+        with ThreadPoolExecutor(max_workers = MAX_CONCURRENT_REQUESTS) as executor:
+            requested_pubchem_ids = dict(zip(missing_pdb_ids, executor.map(lookups.pdb_to_pubchem, missing_pdb_ids)))
         for pdb_id in input_pdb_ids:
             # Check we have cached this specific pdb
             pubchem_ids_from_pdb = pdb_to_pubchem_cache.get(pdb_id, None)
@@ -327,9 +425,19 @@ def generate_ligand_mapping (
                 else:
                     print('  This PDB id has no PubChem ids')
 
-            # If we had no cached pdb 2 pubchem then ask for them
+            # If we had no cached pdb 2 pubchem then use the requested ones
+            # Logs are displayed here, in order, since PDB ids were requested at the same time
             if pubchem_ids_from_pdb == None:
-                pubchem_ids_from_pdb = pdb_to_pubchem(pdb_id)
+                pubchem_ids_from_pdb = requested_pubchem_ids[pdb_id]
+                # If we are offline and the pdb id was not in the lookup cache then we can not know its ligands
+                if pubchem_ids_from_pdb == None:
+                    print(f' PubChem ids for PDB id {pdb_id} are not available offline')
+                    continue
+                print(f' Searched PubChem ids for PDB id {pdb_id}: ')
+                if len(pubchem_ids_from_pdb) > 0:
+                    print('  PubChem ids: ' + ', '.join(pubchem_ids_from_pdb))
+                else:
+                    print('  This PDB id has no PubChem ids')
                 # Save the result in the cache
                 pdb_to_pubchem_cache[pdb_id] = pubchem_ids_from_pdb
                 register.update_cache(PDB_TO_PUBCHEM, pdb_to_pubchem_cache)
@@ -365,16 +473,25 @@ def generate_ligand_mapping (
     # AGUS: esto lo creamos por alguna razón para que funcione sin internet (en el cluster) pero realmente
     # AGUS: llena todo el archivo .register con datos que no son necesarios porque toda esa info está en el ligand_references.json
     #ligand_data_cache = register.cache.get(LIGANDS_DATA, {})
-    # Iterate input ligands
-    for ligand in ligands:
-        # Set the pubchem id which may be assigned in different steps
-        pubchem_id = None
-        # If input ligand is not a dict but a single int/string then handle it
+    # If input ligand is not a dict but a single int/string then handle it
+    for l, ligand in enumerate(ligands):
         if type(ligand) == int:
             print(f'A ligand number ID has been identified {ligand}, assuming that is a PubChem ID...')
-            ligand = { 'pubchem': str(ligand) }
+            ligands[l] = { 'pubchem': str(ligand) }
         elif type(ligand) == str:
             raise InputError(f'A name of ligand has been identified: {ligand}. Anyway, provide at least one of the following IDs: DrugBank, PubChem, ChEMBL.')
+    # Request data for all ligands we do not have data for yet at the same time
+    # Note that errors are raised further, when the ligand data is needed
+    executor = ThreadPoolExecutor(max_workers = MAX_CONCURRENT_REQUESTS)
+    requested_ligand_data = {}
+    for l, ligand in enumerate(ligands):
+        if not obtain_ligand_data_from_file(json_ligands_data, ligand):
+            requested_ligand_data[l] = executor.submit(obtain_ligand_data_from_pubchem, ligand, lookups)
+    executor.shutdown(wait = False)
+    # Iterate input ligands
+    for l, ligand in enumerate(ligands):
+        # Set the pubchem id which may be assigned in different steps
+        pubchem_id = None
         # Check if we already have this ligand data
         ligand_data = obtain_ligand_data_from_file(json_ligands_data, ligand)
         # If we do not have its data try to get from the cache
@@ -393,7 +510,7 @@ def generate_ligand_mapping (
         #         register.update_cache(LIGANDS_DATA, ligand_data_cache)
         # Add current ligand data to the general list
         if not ligand_data:
-            ligand_data = obtain_ligand_data_from_pubchem(ligand)
+            ligand_data = requested_ligand_data[l].result()
         ligands_data.append(ligand_data)
         # Get pubchem id
         pubchem_id = ligand_data.get('pubchem', None)
@@ -497,7 +614,9 @@ def obtain_ligand_data_from_file ( ligands_data : List[dict], ligand: dict ) ->
     return None
 
 # Given an input ligand, obtain all necessary data
-def obtain_ligand_data_from_pubchem (ligand : dict) -> dict:
+def obtain_ligand_data_from_pubchem (ligand : dict, lookups : Optional['LigandLookups'] = None) -> dict:
+    if lookups == None:
+        lookups = LigandLookups()
     # Save in a dictionary all ligand data including its name and ids
     # The ID can be of the databases: 'drugbank' , 'pubchem' , 'chembl'
     # Define the needed variables to check if the ligand has a database ID or it is None
@@ -515,15 +634,15 @@ def obtain_ligand_data_from_pubchem (ligand : dict) -> dict:
         ligand_data['pubchem'] = str(ligand.get('pubchem'))
     elif 'drugbank' in ligand:
         ligand_data['drugbank'] = ligand.get('drugbank')
-        ligand_data['pubchem'] = str(find_drugbank_pubchem(ligand_data['drugbank']))
+        ligand_data['pubchem'] = str(lookups.find_drugbank_pubchem(ligand_data['drugbank']))
     elif 'chembl' in ligand:
         ligand_data['chembl'] = ligand.get('chembl')
-        ligand_data['pubchem'] = str(find_chembl_pubchem(ligand_data['chembl']))
+        ligand_data['pubchem'] = str(lookups.find_chembl_pubchem(ligand_data['chembl']))
     else:
         raise InputError('None of the ligand IDs are defined. Please provide at least one of the following IDs: DrugBank, PubChem, ChEMBL.')
     
     # Request ligand data from pubchem
-    pubchem_data = get_pubchem_data(ligand_data['pubchem'])
+    pubchem_data = lookups.get_pubchem_data(ligand_data['pubchem'])
     if not pubchem_data:
         raise RuntimeError('No PubChem data avilable')
 
@@ -689,11 +808,11 @@ def map_ligand_residues (structure : 'Structure', ligand_data : dict) -> dict:
 # e.g. O=C4N3C(C(=O)Nc2cc(nn2c1ccccc1)C)C(SC3CC=CC4NC(=O)C(NC)C)(C)C -> None
 def smiles_to_pubchem_id (smiles : str) -> Optional[str]:
     # Set the request URL
-    request_url = 'https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/smiles/JSON'
+    request_url = f'{PUBCHEM_URL}/rest/pug/compound/smiles/JSON'
     # Set the POST data
     data = urlencode({ 'smiles': smiles }).encode()
     try:
-        with urlopen(request_url, data=data) as response:
+        with open_url(request_url, data=data) as response:
             parsed_response = json.loads(response.read().decode("utf-8"))
     # If the smiles is not found in pubchem then we can stop here
     except HTTPError as error:
@@ -733,7 +852,8 @@ def pdb_ligand_to_pubchem (pdb_ligand_id : str) -> Optional[str]:
         chem_comp(comp_id:$id) { rcsb_chem_comp_related{ resource_name resource_accession_code } }
     }'''
     # Request PDB data
-    parsed_response = request_pdb_data(pdb_ligand_id, query)
+    with requests_semaphore:
+        parsed_response = request_pdb_data(pdb_ligand_id, query)
     related_resources = parsed_response['rcsb_chem_comp_related']
     # It may happend that a ligand code has no related resources at all
     # e.g. ZN
@@ -746,11 +866,11 @@ def pdb_ligand_to_pubchem (pdb_ligand_id : str) -> Optional[str]:
 # Use a web crawler to avoid having to use the PDB API
 def pdb_ligand_to_pubchem_RAW (pdb_ligand_id : str) -> Optional[str]:
     # Set the request URL
-    request_url = f'https://www.rcsb.org/ligand/{pdb_ligand_id}'
+    request_url = f'{RCSB_URL}/ligand/{pdb_ligand_id}'
     # Run the query
     parsed_response = None
     try:
-        with urlopen(request_url) as response:
+        with open_url(request_url) as response:
             parsed_response = response.read().decode("utf-8")
     # If the accession is not found in the PDB then we can stop here
     except HTTPError as error:
@@ -775,11 +895,11 @@ def pdb_ligand_to_pubchem_RAW (pdb_ligand_id : str) -> Optional[str]:
 # DANI: No se ha provado a fondo
 def pdb_ligand_to_pubchem_RAW_RAW (pdb_ligand_id : str) -> Optional[str]:
     # Set the request URL
-    request_url = f'https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/name/{pdb_ligand_id}/json'
+    request_url = f'{PUBCHEM_URL}/rest/pug/compound/name/{pdb_ligand_id}/json'
     # Run the query
     parsed_response = None
     try:
-        with urlopen(request_url) as response:
+        with open_url(request_url) as response:
             parsed_response = json.loads(response.read().decode("utf-8"))
     # If the accession is not found in the PDB then we can stop here
     except HTTPError as error:
@@ -804,7 +924,7 @@ def pdb_ligand_to_pubchem_RAW_RAW (pdb_ligand_id : str) -> Optional[str]:
 
 # Given a PDB id, get all its ligand codes
 # e.g. 2I3I -> 618, BTB, ZN, EDO, LI
-def get_pdb_ligand_codes (pdb_id : str) -> List[str]:
+def get_pdb_ligand_codes (pdb_id : str, logs : bool = True) -> List[str]:
     # Set the request query
     query = '''query structure($id: String!) {
         entry(entry_id: $id) {
@@ -812,7 +932,8 @@ def get_pdb_ligand_codes (pdb_id : str) -> List[str]:
         }
     }'''
     # Request PDB data
-    parsed_response = request_pdb_data(pdb_id, query)
+    with requests_semaphore:
+        parsed_response = request_pdb_data(pdb_id, query)
     # Mine data
     nonpolymers = parsed_response['nonpolymer_entities']
     if nonpolymers == None: return []
@@ -821,31 +942,66 @@ def get_pdb_ligand_codes (pdb_id : str) -> List[str]:
     for nonpolymer in nonpolymers:
         ligand_code = nonpolymer['nonpolymer_comp']['chem_comp']['id']
         ligand_codes.append(ligand_code)
-    print(f' Ligand codes for PDB id {pdb_id}: ' + ', '.join(ligand_codes))
+    if logs:
+        print(f' Ligand codes for PDB id {pdb_id}: ' + ', '.join(ligand_codes))
     return ligand_codes
 
 # Given a pdb id, get its pubchem ids
 # DANI: De momento no usamos las SMILES que alguna vez me han dado problemas (e.g. 2I3I)
 # e.g. 4YDF -> 
-def pdb_to_pubchem (pdb_id : str) -> List[str]:
-    print(f'Searching PubChem ids for PDB {pdb_id}')
+# Logs may be disabled when several PDB ids are searched at the same time, since they would be mixed
+def pdb_to_pubchem (pdb_id : str, logs : bool = True) -> List[str]:
+    if logs:
+        print(f'Searching PubChem ids for PDB {pdb_id}')
     pubchem_ids = []
-    # Iterate over pdb ligand codes
-    ligand_codes = get_pdb_ligand_codes(pdb_id)
-    for ligand_code in ligand_codes:
-        # Ask the PDB API for the ligand
-        pubchem_id = pdb_ligand_to_pubchem(ligand_code)
-        # If this did not work then try mining the PDB client with a web crawler
-        if not pubchem_id:
-            pubchem_id = pdb_ligand_to_pubchem_RAW(ligand_code)
-        # If this did not work then try it from PubChem
-        if not pubchem_id:
-            pubchem_id = pdb_ligand_to_pubchem_RAW_RAW(ligand_code)
+    # Get pdb ligand codes
+    ligand_codes = get_pdb_ligand_codes(pdb_id, logs)
+    # Search the pubchem id of every ligand code at the same time
+    with ThreadPoolExecutor(max_workers = MAX_CONCURRENT_REQUESTS) as executor:
+        ligand_pubchem_ids = list(executor.map(pdb_ligand_code_to_pubchem, ligand_codes))
+    for ligand_code, pubchem_id in zip(ligand_codes, ligand_pubchem_ids):
         # Otherwise we surrender
         if not pubchem_id:
-            print(f' {ligand_code} -> No PubChem id')
+            if logs:
+                print(f' {ligand_code} -> No PubChem id')
             continue
-        print(f' {ligand_code} -> {pubchem_id}')
+        if logs:
+            print(f' {ligand_code} -> {pubchem_id}')
         pubchem_ids.append(pubchem_id)
             
-    return pubchem_ids
\ No newline at end of file
+    return pubchem_ids
+
+# Given a PDB ligand code, get its pubchem id trying all available sources
+def pdb_ligand_code_to_pubchem (ligand_code : str) -> Optional[str]:
+    # Ask the PDB API for the ligand
+    pubchem_id = pdb_ligand_to_pubchem(ligand_code)
+    # If this did not work then try mining the PDB client with a web crawler
+    if not pubchem_id:
+        pubchem_id = pdb_ligand_to_pubchem_RAW(ligand_code)
+    # If this did not work then try it from PubChem
+    if not pubchem_id:
+        pubchem_id = pdb_ligand_to_pubchem_RAW_RAW(ligand_code)
+    return pubchem_id
+
+# Ligand lookups through a persistent cache
+# This way the same ligand is requested only once no matter how many projects include it
+# PubChem data is keyed by PubChem id, while other lookups are keyed by the requested id
+class LigandLookups:
+    def __init__ (self, cache : Optional[LookupCache] = None):
+        self.cache = cache if cache != None else get_default_lookup_cache()
+
+    def get_pubchem_data (self, id_pubchem : str) -> Optional[dict]:
+        return self.cache.lookup('pubchem', str(id_pubchem),
+            lambda: get_pubchem_data(id_pubchem), ttl = LIGAND_LOOKUPS_TTL)
+
+    def find_drugbank_pubchem (self, drugbank_id : str) -> Optional[str]:
+        return self.cache.lookup('drugbank_pubchem', drugbank_id,
+            lambda: find_drugbank_pubchem(drugbank_id), ttl = LIGAND_LOOKUPS_TTL)
+
+    def find_chembl_pubchem (self, id_chembl : str) -> Optional[str]:
+        return self.cache.lookup('chembl_pubchem', id_chembl,
+            lambda: find_chembl_pubchem(id_chembl), ttl = LIGAND_LOOKUPS_TTL)
+
+    def pdb_to_pubchem (self, pdb_id : str) -> Optional[List[str]]:
+        return self.cache.lookup('pdb_pubchem', pdb_id.upper(),
+            lambda: pdb_to_pubchem(pdb_id, logs = False), ttl = LIGAND_LOOKUPS_TTL)
\ No newline at end of file
@@ -5,6 +5,7 @@ import numpy as np
 from model_workflow.utils.auxiliar import protein_residue_name_to_letter
 from model_workflow.utils.auxiliar import InputError, warn, load_json, save_json, request_pdb_data
 from model_workflow.utils.constants import REFERENCE_SEQUENCE_FLAG, NO_REFERABLE_FLAG, NOT_FOUND_FLAG
+from model_workflow.utils.lookup_cache import LookupCache, get_default_lookup_cache, get_hash_key
 from model_workflow.utils.type_hints import *
 
 import xmltodict
@@ -30,6 +31,15 @@ aligner = Align.PairwiseAligner(mode='local')
 aligner.substitution_matrix = substitution_matrices.load("BLOSUM62")
 aligner.open_gap_score = -10
 aligner.extend_gap_score = -0.5
+# Set a label with the aligner parameters, so cached alignments with different parameters are not mixed
+ALIGNMENT_PARAMETERS = f'{aligner.mode} BLOSUM62 {aligner.open_gap_score} {aligner.extend_gap_score}'
+# Alignments already done in this run, by sequences and parameters hash
+# Note that alignments are also saved in the lookup cache so they are not repeated in further runs
+memoized_alignments = {}
+# Size of the k-mers used to discard unrelated sequences before aligning them
+KMER_SIZE = 5
+# Sequences shorter than this are always aligned, since they may not share k-mers even when related
+MIN_KMER_FILTER_LENGTH = 50
 def add_leading_and_trailing_gaps(alignment: Alignment) -> Alignment:
     coords = alignment.coordinates
 
@@ -68,10 +78,16 @@ def generate_protein_mapping (
     mercy : List[str] = [],
     forced_references : Union[list,dict] = [],
     pdb_ids : List[str] = [],
+    # Cached access to external services
+    lookups : Optional['ReferenceLookups'] = None,
 ) -> dict:
 
     print('-> Getting protein references')
 
+    # Set the default lookups, with the shared cache
+    if lookups == None:
+        lookups = ReferenceLookups()
+
     # Remove previous warnings, if any
     register.remove_warnings(REFERENCE_SEQUENCE_FLAG)
     # Forced references must be list or dict
@@ -99,10 +115,10 @@ def generate_protein_mapping (
         reference = references.get(uniprot_accession, None)
         if reference:
             return reference, True
-        reference = get_mdposit_reference(uniprot_accession, database_url)
+        reference = lookups.get_mdposit_reference(uniprot_accession, database_url)
         if reference:
             return reference, True
-        reference = get_uniprot_reference(uniprot_accession)
+        reference = lookups.get_uniprot_reference(uniprot_accession)
         return reference, False
     # Import local references, in case the references json file already exists
     imported_references = None
@@ -160,7 +176,7 @@ def generate_protein_mapping (
                     # Get the forced reference sequence and align it to the chain sequence in order to build the map
                     reference_sequence = reference_sequences[forced_reference]
                     print(' Aligning chain ' + chain + ' with ' + forced_reference + ' reference sequence')
-                    align_results = align(reference_sequence, chain_data['sequence'])
+                    align_results = lookups.align(reference_sequence, chain_data['sequence'], prefilter = False)
                     # The align must match or we stop here and warn the user
                     if not align_results:
                         raise SystemExit('Forced reference ' + chain + ' -> ' + forced_reference + ' does not match in sequence')
@@ -180,7 +196,7 @@ def generate_protein_mapping (
                 # Align the structure sequence with the reference sequence
                 # NEVER FORGET: This system relies on the fact that topology chains are not repeated
                 print(' Aligning chain ' + chain + ' with ' + uniprot_id + ' reference sequence')
-                align_results = align(reference_sequence, chain_data['sequence'])
+                align_results = lookups.align(reference_sequence, chain_data['sequence'])
                 tried_alignments[chain].append(uniprot_id) # Save the alignment try, no matter if it works or not
                 if not align_results:
                     continue
@@ -284,7 +300,7 @@ def generate_protein_mapping (
     if pdb_ids and len(pdb_ids) > 0:
         for pdb_id in pdb_ids:
             # Ask PDB
-            uniprot_ids = pdb_to_uniprot(pdb_id)
+            uniprot_ids = lookups.pdb_to_uniprot(pdb_id)
             if uniprot_ids == None:
                 continue 
             for uniprot_id in uniprot_ids:
@@ -307,7 +323,12 @@ def generate_protein_mapping (
             continue
         # Run the blast
         sequence = chain_data['sequence']
-        uniprot_id = blast(sequence)
+        # If we are offline and the blast is not cached then we can not know if there is a reference
+        # Note that a missing reference must not be written, since it would be taken as a real blast result
+        if not lookups.has_blast(sequence):
+            raise InputError(f'Missing BLAST result for chain {chain_data["name"]} in the lookup cache and we are offline.\n'
+                '  Please run this step again without the --offline flag')
+        uniprot_id = lookups.blast(sequence)
         if not uniprot_id:
             chain_data['match'] = { 'ref': NOT_FOUND_FLAG }
             continue
@@ -459,6 +480,20 @@ def align (ref_sequence : str, new_sequence : str, verbose : bool = False) -> Op
 
     return aligned_mapping, normalized_score
 
+# Get all k-mers in a sequence, skipping those with unknown residues
+def get_kmers (sequence : str, size : int = KMER_SIZE) -> set:
+    kmers = { sequence[i:i+size] for i in range(len(sequence) - size + 1) }
+    return { kmer for kmer in kmers if 'X' not in kmer }
+
+# Check if two sequences may be related, i.e. they share at least one k-mer
+# This is a fast check to skip aligning sequences which have obviously nothing to do with each other
+# Note that unrelated sequences share almost no 5-mers by chance while matching sequences share most of them
+# Short sequences are always considered as related
+def may_be_related (ref_sequence : str, new_sequence : str) -> bool:
+    if len(new_sequence) < MIN_KMER_FILTER_LENGTH or len(ref_sequence) < MIN_KMER_FILTER_LENGTH:
+        return True
+    return not get_kmers(new_sequence).isdisjoint(get_kmers(ref_sequence))
+
 # Given an aminoacids sequence, return a list of uniprot ids
 # Note that we are blasting against UniProtKB / Swiss-Prot so results will always be valid UniProt accessions
 # WARNING: This always means results will correspond to curated entries only
@@ -651,6 +686,76 @@ def pdb_to_uniprot (pdb_id : str) -> Optional[ List[str] ]:
     print(f' UniProt ids for PDB id {pdb_id}: ' + ', '.join(uniprot_ids))
     return uniprot_ids
 
+# Requests to external services used to find protein references
+# This is the default backend for the reference lookups
+# Tests may use a different backend with the same functions to avoid requesting the actual services
+class ReferenceServices:
+    def get_mdposit_reference (self, uniprot_accession : str, database_url : str) -> Optional[dict]:
+        return get_mdposit_reference(uniprot_accession, database_url)
+    def get_uniprot_reference (self, uniprot_accession : str) -> Optional[dict]:
+        return get_uniprot_reference(uniprot_accession)
+    def pdb_to_uniprot (self, pdb_id : str) -> Optional[ List[str] ]:
+        return pdb_to_uniprot(pdb_id)
+    def blast (self, sequence : str) -> Optional[str]:
+        return blast(sequence)
+
+# Time after which cached lookups are requested again
+# Note that BLAST is the slowest request and Swiss-Prot changes slowly so it is kept for longer
+REFERENCE_LOOKUPS_TTL = 30 * 24 * 3600 # 30 days
+BLAST_LOOKUPS_TTL = 180 * 24 * 3600 # 180 days
+
+# Protein reference lookups through a persistent cache
+# This way the same protein is requested only once no matter how many projects include it
+# UniProt, MDposit and PDB lookups are keyed by accession while BLAST lookups are keyed by sequence hash
+class ReferenceLookups:
+    def __init__ (self, cache : Optional[LookupCache] = None, services : Optional[ReferenceServices] = None):
+        self.cache = cache if cache != None else get_default_lookup_cache()
+        self.services = services if services != None else ReferenceServices()
+
+    def get_mdposit_reference (self, uniprot_accession : str, database_url : str) -> Optional[dict]:
+        return self.cache.lookup('mdposit', f'{database_url} {uniprot_accession}',
+            lambda: self.services.get_mdposit_reference(uniprot_accession, database_url), ttl = REFERENCE_LOOKUPS_TTL)
+
+    def get_uniprot_reference (self, uniprot_accession : str) -> Optional[dict]:
+        return self.cache.lookup('uniprot', uniprot_accession,
+            lambda: self.services.get_uniprot_reference(uniprot_accession), ttl = REFERENCE_LOOKUPS_TTL)
+
+    def pdb_to_uniprot (self, pdb_id : str) -> Optional[ List[str] ]:
+        return self.cache.lookup('pdb_uniprot', pdb_id.upper(),
+            lambda: self.services.pdb_to_uniprot(pdb_id), ttl = REFERENCE_LOOKUPS_TTL)
+
+    def blast (self, sequence : str) -> Optional[str]:
+        return self.cache.lookup('blast', get_hash_key(sequence),
+            lambda: self.services.blast(sequence), ttl = BLAST_LOOKUPS_TTL)
+
+    # Check if a blast result is available, i.e. it is cached or we are online
+    def has_blast (self, sequence : str) -> bool:
+        if not self.cache.offline:
+            return True
+        found, _ = self.cache.get('blast', get_hash_key(sequence), ttl = BLAST_LOOKUPS_TTL)
+        return found
+
+    # Align sequences, reusing the results of previous identical alignments
+    # Alignments are memoized in memory for this run and in the cache for further runs
+    # Note that alignments do not require any external service so they are done even when offline
+    # Set prefilter = False to align sequences even when they share no k-mer
+    def align (self, ref_sequence : str, new_sequence : str, prefilter : bool = True) -> Optional[ Tuple[list, float] ]:
+        if prefilter and not may_be_related(ref_sequence, new_sequence):
+            print('    Not related sequences')
+            return None
+        key = f'{get_hash_key(ref_sequence)} {get_hash_key(new_sequence)} {get_hash_key(ALIGNMENT_PARAMETERS)}'
+        if key in memoized_alignments:
+            return memoized_alignments[key]
+        # Alignments never get outdated
+        found, cached_results = self.cache.get('alignment', key, ttl = float('inf'), negative_ttl = float('inf'))
+        if found:
+            align_results = tuple(cached_results) if cached_results else None
+        else:
+            align_results = align(ref_sequence, new_sequence)
+            self.cache.set('alignment', key, align_results)
+        memoized_alignments[key] = align_results
+        return align_results
+
 # This function is used by the generate_metadata script
 # 1. Get structure sequences
 # 2. Calculate which reference domains are covered by the previous sequence
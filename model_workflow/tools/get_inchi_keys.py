@@ -1,6 +1,10 @@
 import MDAnalysis
+import hashlib
+import numpy as np
 from rdkit import Chem
+from concurrent.futures import ProcessPoolExecutor
 from model_workflow.utils.structures import Structure
+from model_workflow.utils.constants import GLOBALS
 from model_workflow.utils.type_hints import *
 from model_workflow.utils.warnings import warn
 from functools import lru_cache
@@ -11,7 +15,7 @@ def get_connected_residues(
         residue: 'MDAnalysis.Residue',
         visited=None):
     """
-    Recursively finds all residues that are connected through bonds to the given residue.
+    Finds all residues that are connected through bonds to the given residue.
     Parameters
     ----------
     residue : MDAnalysis.core.groups.Residue
@@ -26,33 +30,119 @@ def get_connected_residues(
         through bonds to the input residue, either directly or indirectly.
     Notes
     -----
-    This function traverses the molecular structure recursively, following bonds 
-    between residues. It keeps track of visited residues to avoid cycles in the
+    This function traverses the molecular structure following bonds between
+    residues. It keeps track of visited residues to avoid cycles in the
     traversal. Both direct bonds between residues and indirect connections through
-    other residues are included in the result.
+    other residues are included in the result. The traversal uses a stack instead
+    of recursion so long chains of bonded residues do not exceed the recursion limit.
     """
     
     if visited is None:
         visited = set()
     
-    # Add current residue to visited set
-    visited.add(residue.resindex)
-    
-    # Get direct external bonds
-    external_bonds = set([residue.resindex])
-    for bond in residue.atoms.bonds:
-        external_bonds.update(bond.atoms.resindices)
-    
-    # Recursively check external bonds
-    all_external_bonds = external_bonds.copy()
     u = residue.universe
-    for ext_resid in external_bonds:
-        if ext_resid not in visited:
-            # Get external bonds for the connected residue
-            recursive_bonds = get_connected_residues(u.residues[ext_resid], visited)
-            all_external_bonds.update(recursive_bonds)
+    connected = set([residue.resindex])
+    pending = [residue.resindex]
+    while pending:
+        current_resindex = pending.pop()
+        # Add current residue to visited set
+        visited.add(current_resindex)
+        # Get direct external bonds
+        bond_indices = u.residues[current_resindex].atoms.bonds.indices
+        bonded_resindices = set(u.atoms.resindices[bond_indices.flatten()].tolist())
+        for bonded_resindex in bonded_resindices:
+            if bonded_resindex in visited or bonded_resindex in connected:
+                continue
+            connected.add(bonded_resindex)
+            pending.append(bonded_resindex)
     
-    return list(all_external_bonds)
+    return list(connected)
+
+
+def get_residue_groups(u: 'MDAnalysis.Universe') -> List[List[int]]:
+    """
+    Group all residues which are connected through bonds, either directly or indirectly.
+    This is equivalent to calling get_connected_residues for every residue but all bonds are processed at once.
+    Groups are sorted by their first residue index and residue indices in every group are sorted as well.
+    """
+    residues_count = len(u.residues)
+    # Get the residue indices of both atoms in every bond between different residues
+    bond_indices = u.atoms.bonds.indices
+    bond_resindices = u.atoms.resindices[bond_indices] if len(bond_indices) > 0 else np.empty((0, 2), dtype=int)
+    bond_resindices = bond_resindices[bond_resindices[:,0] != bond_resindices[:,1]]
+    bond_resindices = np.unique(np.sort(bond_resindices, axis=1), axis=0)
+    # Join bonded residues with a union-find
+    parents = np.arange(residues_count)
+    def find_root (resindex : int) -> int:
+        while parents[resindex] != resindex:
+            parents[resindex] = parents[parents[resindex]]
+            resindex = parents[resindex]
+        return resindex
+    for resindex_a, resindex_b in bond_resindices:
+        root_a, root_b = find_root(resindex_a), find_root(resindex_b)
+        if root_a != root_b:
+            # Keep the lowest index as root so groups are sorted by their first residue
+            parents[max(root_a, root_b)] = min(root_a, root_b)
+    roots = np.array([ find_root(resindex) for resindex in range(residues_count) ])
+    # Residue indices are sorted already so every group is sorted as well
+    groups = {}
+    for resindex, root in enumerate(roots):
+        groups.setdefault(root, []).append(resindex)
+    return [ groups[root] for root in sorted(groups) ]
+
+
+def get_residue_group_signature(res_atoms: 'MDAnalysis.AtomGroup') -> str:
+    """
+    Get a hash of the residue group graph: residue names, atom names, elements and bonds.
+    Residue groups with the same signature have the same InChI so it is calculated only once.
+    InChI keys also depend on the stereochemistry, which is mined from coordinates.
+    For this reason, the signature includes the chirality of every atom with 4 bonds
+    and the cis/trans configuration of every bond between atoms with 3 bonds.
+    Note that some identical residues may have different signatures (e.g. different conformations),
+    which only means their InChI is calculated again.
+    """
+    atom_indices = res_atoms.indices
+    # Bonds in local indices
+    bonds = res_atoms.intra_bonds.indices
+    # Note that atom indices may be not sorted
+    order = np.argsort(atom_indices)
+    local_bonds = order[np.searchsorted(atom_indices[order], bonds)] if len(bonds) > 0 else np.empty((0, 2), dtype=int)
+    local_bonds = np.sort(local_bonds, axis=1)
+    local_bonds = local_bonds[np.lexsort((local_bonds[:,1], local_bonds[:,0]))]
+    # Get the bonded atoms of every atom, sorted
+    neighbours = [ [] for _ in range(len(atom_indices)) ]
+    for atom_a, atom_b in local_bonds:
+        neighbours[atom_a].append(atom_b)
+        neighbours[atom_b].append(atom_a)
+    for atom_neighbours in neighbours:
+        atom_neighbours.sort()
+    positions = res_atoms.positions
+    # Chirality of atoms with 4 bonds: the sign of the volume made by their neighbours
+    chiralities = []
+    for atom, atom_neighbours in enumerate(neighbours):
+        if len(atom_neighbours) != 4:
+            continue
+        a, b, c, d = positions[atom_neighbours]
+        chiralities.append(atom if np.linalg.det(np.array([b - a, c - a, d - a])) > 0 else -atom - 1)
+    # Cis/trans configuration of bonds between atoms with 3 bonds: the sign of the dihedral cosine
+    configurations = []
+    for atom_a, atom_b in local_bonds:
+        if len(neighbours[atom_a]) != 3 or len(neighbours[atom_b]) != 3:
+            continue
+        neighbour_a = next(n for n in neighbours[atom_a] if n != atom_b)
+        neighbour_b = next(n for n in neighbours[atom_b] if n != atom_a)
+        axis = positions[atom_b] - positions[atom_a]
+        normal_a = np.cross(positions[neighbour_a] - positions[atom_a], axis)
+        normal_b = np.cross(axis, positions[neighbour_b] - positions[atom_b])
+        configurations.append(1 if np.dot(normal_a, normal_b) > 0 else 0)
+    hasher = hashlib.sha256()
+    hasher.update(' '.join(res_atoms.residues.resnames).encode())
+    hasher.update(' '.join(res_atoms.names).encode())
+    hasher.update(' '.join(res_atoms.elements).encode())
+    hasher.update(np.ascontiguousarray(local_bonds, dtype=np.int64).tobytes())
+    hasher.update(np.array(chiralities, dtype=np.int64).tobytes())
+    hasher.update(np.array(configurations, dtype=np.int8).tobytes())
+    return hasher.hexdigest()
 
 
 def process_residue(res_atoms: 'MDAnalysis.AtomGroup', 
@@ -69,9 +159,25 @@ def process_residue(res_atoms: 'MDAnalysis.AtomGroup',
     return (inchikey, inchi, resindex)
 
 
+# Universe used by the worker processes
+# It is set once per process, so it is not sent with every task
+worker_universe = None
+
+def init_worker(u: 'MDAnalysis.Universe'):
+    global worker_universe
+    worker_universe = u
+
+def process_residue_group(res_grp_idx: List[int]) -> Tuple[str, str, List[int]]:
+    """
+    Process a residue group in a worker process.
+    """
+    return process_residue(worker_universe.residues[res_grp_idx].atoms, res_grp_idx)
+
+
 def get_inchi_keys (
     u : 'MDAnalysis.Universe',
-    structure : 'Structure'
+    structure : 'Structure',
+    cores : Optional[int] = None,
 ) -> dict:
     """
     Generate a dictionary mapping InChI keys to residue information for non-standard residues.
@@ -86,32 +192,44 @@ def get_inchi_keys (
         input_structure_file (File): The input structure file.
         input_topology_file (Optional[File]): The input topology file.
         structure (Structure): The Structure object containing residues.
+        cores (Optional[int]): Number of processes used to calculate InChI keys.
+            Set by the common console arguments by default.
 
     Returns:
         dict: A dictionary where keys are InChI keys and values are dictionaries containing
             residue information such as associated residues, InChI strings, bond information,
             and classification.
     """
-    # 1) Prepare residue data for parallel processing (not yet implemented)
+    if cores == None:
+        cores = GLOBALS['cores']
+    # 1) Prepare residue data for parallel processing
     # First group residues that are bonded together
-    results = []
     residues: List[Residue] = structure.residues
-    visited = set()
-    for resindex in range(len(residues)):
-        # Skip residues that have already been visited
-        if resindex in visited:
-            continue
-        # Residues grouped by bonded atoms
-        res_grp_idx = get_connected_residues(u.residues[resindex], visited) 
+    res_groups = []
+    for res_grp_idx in get_residue_groups(u):
         classes = set([residues[grp_idx].classification for grp_idx in res_grp_idx])
         # Skip residues that are aminoacids, nucleics, or too small
         # We also skips residues connected to them: glicoprotein, lipid-anchored protein...
         if any(cls in ['ion', 'solvent', 'dna', 'rna', 'protein'] for cls in classes):
             continue
-        # Select residues atoms with MDAnalysis
-        res_atoms = u.residues[res_grp_idx].atoms
-        # Convert to RDKit and get InChI data
-        results.append(process_residue(res_atoms,res_grp_idx))
+        res_groups.append(res_grp_idx)
+    # Identical residue groups (e.g. many copies of the same lipid) have the same InChI
+    # Find unique groups so the InChI is calculated only once for each
+    signatures = [ get_residue_group_signature(u.residues[res_grp_idx].atoms) for res_grp_idx in res_groups ]
+    unique_groups = {}
+    for signature, res_grp_idx in zip(signatures, res_groups):
+        unique_groups.setdefault(signature, res_grp_idx)
+    # Convert unique groups to RDKit and get InChI data, in parallel if possible
+    unique_signatures = list(unique_groups.keys())
+    if cores > 1 and len(unique_signatures) > 1:
+        with ProcessPoolExecutor(max_workers=min(cores, len(unique_signatures)),
+                                 initializer=init_worker, initargs=(u,)) as executor:
+            unique_results = list(executor.map(process_residue_group, unique_groups.values()))
+    else:
+        unique_results = [ process_residue(u.residues[res_grp_idx].atoms, res_grp_idx)
+                           for res_grp_idx in unique_groups.values() ]
+    inchi_data = { signature: result[0:2] for signature, result in zip(unique_signatures, unique_results) }
+    results = [ (*inchi_data[signature], res_grp_idx) for signature, res_grp_idx in zip(signatures, res_groups) ]
 
     # 2) Process results and build dictionaries
     key_2_name = {} # To see if different name for same residue
@@ -1,7 +1,22 @@
 import time
 import pathlib
 import logging
+from functools import partial
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+
+from model_workflow.tools.nassa_loaders import load_serfile
+
+
+def init_worker(analysis):
+    """Keep the analysis in the worker process, so it is sent only once and not with every task."""
+    global worker_analysis
+    worker_analysis = analysis
+
+
+def run_worker_method(method_name, *args):
+    """Call a method of the analysis kept in the worker process."""
+    return getattr(worker_analysis, method_name)(*args)
 
 
 class Base(ABC):
@@ -17,6 +32,7 @@ class Base(ABC):
     :param bool save_plots: save data visualizations as .pdf files.
     :param bool verbose: print verbose output.
     :param str save_path: path to save directory. If it doesn't exist, it is created during execution. Default is the current working directory.
+    :param int cores: number of processes used to load coordinate files and analyze trajectories or subunits in parallel.
 
     :raises ValueError: If number of sequence files doesn't match number of coordinate files.
     """
@@ -33,7 +49,8 @@ class Base(ABC):
             bimod=True,
             save_tables=True,
             save_plots=True,
-            verbose=True):
+            verbose=True,
+            cores=1):
 
         # sequence and coordinate paths and files from config file
         for coordinate_files in coordinate_info.values():
@@ -50,6 +67,7 @@ class Base(ABC):
         self.unit_name = unit_name
         self.unit_len = unit_len
         self.bimod = bimod
+        self.cores = cores
 
         # create logger
         self.logger = self.create_logger(verbose)
@@ -96,6 +114,40 @@ class Base(ABC):
         """Save data visualizations"""
         pass
 
+    def parallel_map(self, function, *iterables):
+        """Apply a function to every group of items in the iterables and return the results in order.
+        If more than one core is available, items are sent to a pool of processes.
+        Methods of this analysis are called on a copy of the analysis sent once to every process.
+
+        :param function: method of this analysis or picklable module-level function.
+        :param iterables: iterables with the arguments of every call.
+        :return list: function results.
+        """
+        iterables = [list(iterable) for iterable in iterables]
+        calls = min([len(iterable) for iterable in iterables], default=0)
+        if self.cores <= 1 or calls < 2:
+            return list(map(function, *iterables))
+        pool_options = {}
+        # do not send the whole analysis with every task but once to every process
+        if getattr(function, '__self__', None) is self:
+            function = partial(run_worker_method, function.__name__)
+            pool_options = dict(initializer=init_worker, initargs=(self,))
+        with ProcessPoolExecutor(max_workers=min(self.cores, calls), **pool_options) as executor:
+            return list(executor.map(function, *iterables))
+
+    def load_serfiles(self, ser_files):
+        """Load several coordinate series files, in parallel if more than one core is available.
+
+        :param list ser_files: paths to .ser files.
+        :return list: .ser files converted into pandas.DataFrame tables.
+        """
+        ser_files = list(ser_files)
+        return self.parallel_map(
+            load_serfile,
+            ser_files,
+            [self.tail] * len(ser_files),
+            [self.n_lines] * len(ser_files))
+
     def load(self, data, **kwargs):
         """Save data in table and visualization formats.
 
@@ -1,7 +1,8 @@
+import os
 import pathlib
-from collections import deque
 from model_workflow.utils.nucleicacid import NucleicAcid
 import pandas as pd
+import numpy as np
 
 def load_sequence(seqfile, unit_len, unit_name=None):
     """
@@ -74,37 +75,107 @@ def write_sequence(nucleic_acid, filename):
 
 
 
-def load_serfile(ser_file, tail=True, n_lines=None):
+# Suffix of the binary cache written next to every parsed .ser file
+SERFILE_CACHE_SUFFIX = '.cache.npz'
+
+def load_serfile(ser_file, tail=True, n_lines=None, use_cache=True):
     """
     Load single file containing a coordinate's series.
+    Parsed series are cached in a binary file next to the .ser file, which is reused while the .ser file size and modification time do not change.
 
     :param str ser_file: path to .ser file.
     :param bool tail: (Default True) read the last ``n_lines`` of the file. Otherwise, read the first ``n_lines``.
     :param int n_lines: number of rows to read.
+    :param bool use_cache: (Default True) read and write the binary cache.
     :returns pandas.DataFrame: .ser file converted into a pandas.DataFrame table
     """
+    ser_data = None
+    if use_cache:
+        ser_data = read_serfile_cache(ser_file)
+    if ser_data is None:
+        ser_data = parse_serfile(ser_file)
+        if use_cache:
+            write_serfile_cache(ser_file, ser_data)
+    # Select the requested rows
+    if n_lines is None or len(ser_data) == 0:
+        return ser_data
     if tail:
-        #with open(ser_file, "r") as f:
-            # read last line of file, get index number for that line
-        #    total_lines = int(deque(f, 1)[0].split()[0])
-        #extra_kwargs = dict(skiprows=total_lines - n_lines)
-        with open(ser_file, "r") as f:
-            total_lines_str = deque(f, 1)[0].split()[0]
-            total_lines = int(total_lines_str) if total_lines_str.isdigit() else None
-
-        if total_lines is not None and n_lines is not None:
-            extra_kwargs = dict(skiprows=max(0, total_lines - n_lines))
-        else:
-            extra_kwargs = dict()
-    else:
-        extra_kwargs = dict(nrows=n_lines)
-    ser_data = pd.read_csv(
-        ser_file,
-        header=None,
-        sep='\s+',
-        index_col=0,
-        **extra_kwargs)
-    return ser_data
+        # The index in the last line is the total number of lines
+        # Irregular files may have a non numeric index, then the whole file is returned
+        total_lines_str = str(ser_data.index[-1])
+        if not total_lines_str.isdigit():
+            return ser_data
+        total_lines = int(total_lines_str)
+        return ser_data.iloc[max(0, total_lines - n_lines):]
+    return ser_data.iloc[:n_lines]
+
+def parse_serfile(ser_file):
+    """
+    Parse the whole .ser file.
+    Values are read at once with numpy when every line has the same number of columns. Otherwise pandas is used.
+
+    :param str ser_file: path to .ser file.
+    :returns pandas.DataFrame: .ser file converted into a pandas.DataFrame table
+    """
+    text = pathlib.Path(ser_file).read_text()
+    first_line = text.split('\n', 1)[0]
+    columns_count = len(first_line.split())
+    # Non numeric values stop the parsing, which is an error in recent numpy versions
+    try:
+        values = np.fromstring(text, sep=' ') if columns_count > 0 else np.empty(0)
+    except ValueError:
+        values = None
+    tokens_count = len(text.split())
+    # Make sure every value was parsed and the table is regular
+    if values is None or columns_count == 0 or len(values) != tokens_count or len(values) % columns_count != 0:
+        return pd.read_csv(
+            ser_file,
+            header=None,
+            sep='\s+',
+            index_col=0)
+    values = values.reshape(-1, columns_count)
+    index = pd.Index(values[:,0].astype(int), name=0)
+    return pd.DataFrame(values[:,1:], index=index, columns=range(1, columns_count))
+
+def get_serfile_cache_key(ser_file):
+    """Get the size and modification time of a .ser file, which are used to validate its cache."""
+    stat = os.stat(ser_file)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def read_serfile_cache(ser_file):
+    """Read the binary cache of a .ser file if it exists and it is still valid. Otherwise return None."""
+    cache_file = str(ser_file) + SERFILE_CACHE_SUFFIX
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file) as cache:
+            if not np.array_equal(cache['key'], get_serfile_cache_key(ser_file)):
+                return None
+            index = pd.Index(cache['index'], name=0)
+            return pd.DataFrame(cache['values'], index=index, columns=range(1, cache['values'].shape[1] + 1))
+    # If the cache is corrupted then ignore it and parse the file again
+    except (OSError, ValueError, KeyError):
+        return None
+
+def write_serfile_cache(ser_file, ser_data):
+    """Write the binary cache of a .ser file. Data or indices which are not numeric are not cached."""
+    try:
+        values = ser_data.to_numpy(dtype=float)
+        index = ser_data.index.to_numpy(dtype=np.int64)
+    except (TypeError, ValueError):
+        return
+    cache_file = str(ser_file) + SERFILE_CACHE_SUFFIX
+    # Write a temporal file first so a concurrent reader never finds an incomplete cache
+    temporal_cache_file = cache_file + '.tmp.npz'
+    try:
+        np.savez(temporal_cache_file,
+            key=get_serfile_cache_key(ser_file),
+            index=index,
+            values=values)
+        os.replace(temporal_cache_file, cache_file)
+    # The cache is optional, so do not break if the directory is not writable
+    except OSError:
+        return
 
 def write_serfile(data, filename, indent=8, decimals=2, transpose=True):
     """Write data to same format as .ser file.
@@ -119,13 +190,10 @@ def write_serfile(data, filename, indent=8, decimals=2, transpose=True):
     :param transpose: transpose data array before writing. It should be used so array shape is (n_frames, n_cols). Defaults to True
     :type transpose: bool, optional
     """
+    data = np.asarray(data)
     if transpose:
         data = data.T
-    with open(filename, "w") as f:
-        for row in data:
-            s = f"{int(row[0]):>indent}"
-            for elem in row[1:]:
-                elem = round(elem, decimals)
-                s += f"{elem:>indent}"
-            s += "\n"
-            f.write(s)
+    # Format all rows at once: the first column is the integer index and the rest are rounded values
+    columns_count = data.shape[1]
+    row_format = f"%{indent}d" + f"%{indent}.{decimals}f" * (columns_count - 1)
+    np.savetxt(filename, data, fmt=row_format, delimiter='')
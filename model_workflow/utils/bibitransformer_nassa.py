@@ -11,13 +11,17 @@ class BiBiTransformer(TransformerMixin):
     Other parameters such as means, variances and weights are given for both distributions.
 
     :param float confidence_level: confidence level to use in Bayes Factor when determining binormality. (Default 5.0)
-    :param **kwargs: other arguments to be passed to sklearn.mixture.GaussianMixture
+    :param **kwargs: other arguments to be passed to sklearn.mixture.GaussianMixture. ``max_iter``, ``tol`` and ``reg_covar`` are also used by the batched fitting.
 
     :raises ValueError: if ``confidence_level`` is not between 0 and 100.
     """
 
     def __init__(self, confidence_level=5.0, **kwargs):
         self.models = self.GMM_models(**kwargs)
+        # parameters for the batched fitting, with the same defaults than sklearn
+        self.max_iter = kwargs.get("max_iter", 100)
+        self.tol = kwargs.get("tol", 1e-3)
+        self.reg_covar = kwargs.get("reg_covar", 1e-6)
 
         if confidence_level < 0 and confidence_level > 100:
             raise ValueError("confidence_level must be between 0 and 100")
@@ -74,7 +78,17 @@ class BiBiTransformer(TransformerMixin):
             variances.append(v)
             bics.append(b)
             weights.append(w)
+        return self.describe(means, variances, weights, bics)
 
+    def describe(self, means, variances, weights, bics):
+        """Get parameters describing the distribution from the parameters of both fitted models.
+
+        :param means: list with the means of the 1-component and the 2-component models.
+        :param variances: list with the variances of the 1-component and the 2-component models.
+        :param weights: list with the weights of the 1-component and the 2-component models.
+        :param bics: list with the BIC values of the 1-component and the 2-component models.
+
+        :return: Dictionary with distribution information."""
         # bayes factor criteria for normality
         uninormal, binormal, insuf_ev, p = self.bayes_factor_criteria(bics[0],bics[1])
         if binormal:
@@ -152,3 +166,116 @@ class BiBiTransformer(TransformerMixin):
         unimodal = abs(means[1]-means[0]) <= s * \
             (np.sqrt(vars[0]) + np.sqrt(vars[1]))
         return unimodal
+
+    def fit_transform_batch(self, datasets, use_sklearn=False):
+        """Fit many 1D distributions at once and get the parameters describing every distribution.
+        Both models are fitted to all distributions with a vectorized EM over padded arrays.
+        Model selection is then the same than in ``transform``.
+
+        :param datasets: list of arrays of shape (n_samples,) or (n_samples, 1)
+        :param bool use_sklearn: fit every distribution separately with sklearn instead. Useful to verify results.
+
+        :return: List of dictionaries with distribution information."""
+        if use_sklearn:
+            return [self.fit_transform(np.asarray(X).reshape(-1, 1)) for X in datasets]
+        if len(datasets) == 0:
+            return []
+        # pad all distributions to the same length and keep a mask of actual values
+        lengths = np.array([len(X) for X in datasets])
+        data = np.zeros((len(datasets), lengths.max()))
+        mask = np.arange(lengths.max())[np.newaxis, :] < lengths[:, np.newaxis]
+        for i, X in enumerate(datasets):
+            data[i, :lengths[i]] = np.asarray(X, dtype=float).flatten()
+        # fit both models
+        means_1, variances_1, weights_1, log_likelihoods_1 = self.fit_one_component_batch(data, mask, lengths)
+        means_2, variances_2, weights_2, log_likelihoods_2 = self.fit_two_components_batch(data, mask, lengths)
+        # get BIC values as sklearn does: -2 * log-likelihood + free parameters * log(n_samples)
+        # free parameters in 1D are a mean and a variance per component plus the weights minus one
+        bics_1 = -2 * log_likelihoods_1 + 2 * np.log(lengths)
+        bics_2 = -2 * log_likelihoods_2 + 5 * np.log(lengths)
+        infos = []
+        for i in range(len(datasets)):
+            infos.append(self.describe(
+                [means_1[i:i+1], means_2[i]],
+                [variances_1[i:i+1], variances_2[i]],
+                [weights_1[i:i+1], weights_2[i]],
+                [bics_1[i], bics_2[i]]))
+        return infos
+
+    def fit_one_component_batch(self, data, mask, lengths):
+        """Fit a 1-component model to every padded distribution, which has a closed form solution.
+
+        :return: Tuple with means, variances, weights and total log-likelihoods, all with shape (n_distributions,)."""
+        means = (data * mask).sum(axis=1) / lengths
+        variances = (((data - means[:, np.newaxis]) ** 2) * mask).sum(axis=1) / lengths + self.reg_covar
+        weights = np.ones(len(data))
+        log_densities = self._log_gaussian(data, means[:, np.newaxis], variances[:, np.newaxis])
+        log_likelihoods = (log_densities * mask).sum(axis=1)
+        return means, variances, weights, log_likelihoods
+
+    def fit_two_components_batch(self, data, mask, lengths):
+        """Fit a 2-component model to every padded distribution with a shared EM loop.
+        Components are initialized with a 1D k-means started at the 25th and 75th percentiles.
+        Distributions which already converged are not updated anymore.
+
+        :return: Tuple with means, variances and weights with shape (n_distributions, 2) and total log-likelihoods with shape (n_distributions,)."""
+        n_distributions = len(data)
+        masked = np.where(mask, data, np.nan)
+        # initialize responsibilities with k-means
+        centers = np.stack([
+            np.nanpercentile(masked, 25, axis=1),
+            np.nanpercentile(masked, 75, axis=1)], axis=1)
+        for _ in range(10):
+            closest = np.abs(data[:, :, np.newaxis] - centers[:, np.newaxis, :]).argmin(axis=2)
+            responsibilities = np.stack([closest == 0, closest == 1], axis=2) * mask[:, :, np.newaxis].astype(float)
+            counts = responsibilities.sum(axis=1)
+            new_centers = (responsibilities * data[:, :, np.newaxis]).sum(axis=1) / np.maximum(counts, 1)
+            centers = np.where(counts > 0, new_centers, centers)
+        means, variances, weights = self._maximization(data, responsibilities, lengths)
+        # run EM
+        lower_bounds = np.full(n_distributions, -np.inf)
+        converged = np.zeros(n_distributions, dtype=bool)
+        for _ in range(self.max_iter):
+            # expectation step
+            weighted_log_densities = self._log_gaussian(
+                data[:, :, np.newaxis],
+                means[:, np.newaxis, :],
+                variances[:, np.newaxis, :]) + np.log(weights)[:, np.newaxis, :]
+            log_norms = np.logaddexp(weighted_log_densities[:, :, 0], weighted_log_densities[:, :, 1])
+            responsibilities = np.exp(weighted_log_densities - log_norms[:, :, np.newaxis]) * mask[:, :, np.newaxis]
+            new_lower_bounds = (log_norms * mask).sum(axis=1) / lengths
+            # maximization step, only for distributions which did not converge yet
+            new_means, new_variances, new_weights = self._maximization(data, responsibilities, lengths)
+            updating = ~converged[:, np.newaxis]
+            means = np.where(updating, new_means, means)
+            variances = np.where(updating, new_variances, variances)
+            weights = np.where(updating, new_weights, weights)
+            # check convergence after the maximization step, as sklearn does
+            converged |= np.abs(new_lower_bounds - lower_bounds) < self.tol
+            lower_bounds = new_lower_bounds
+            if converged.all():
+                break
+        # get the final log-likelihoods with the final parameters
+        weighted_log_densities = self._log_gaussian(
+            data[:, :, np.newaxis],
+            means[:, np.newaxis, :],
+            variances[:, np.newaxis, :]) + np.log(weights)[:, np.newaxis, :]
+        log_norms = np.logaddexp(weighted_log_densities[:, :, 0], weighted_log_densities[:, :, 1])
+        log_likelihoods = (log_norms * mask).sum(axis=1)
+        return means, variances, weights, log_likelihoods
+
+    def _maximization(self, data, responsibilities, lengths):
+        """Get the parameters of every component from the responsibilities (maximization step)."""
+        # avoid zero divisions as sklearn does
+        counts = responsibilities.sum(axis=1) + 10 * np.finfo(float).eps
+        means = (responsibilities * data[:, :, np.newaxis]).sum(axis=1) / counts
+        squared_differences = (data[:, :, np.newaxis] - means[:, np.newaxis, :]) ** 2
+        variances = (responsibilities * squared_differences).sum(axis=1) / counts + self.reg_covar
+        weights = counts / lengths[:, np.newaxis]
+        weights = weights / weights.sum(axis=1, keepdims=True)
+        return means, variances, weights
+
+    @staticmethod
+    def _log_gaussian(x, mean, variance):
+        """Log-density of a 1D gaussian."""
+        return -0.5 * (np.log(2 * np.pi * variance) + (x - mean) ** 2 / variance)
@@ -1,4 +1,4 @@
-from os import environ
+from os import environ, path
 from shutil import which
 
 # CONSTANTS ---------------------------------------------------------------------------
@@ -8,6 +8,14 @@ from shutil import which
 GLOBALS = {
     # Set if symlinks are allowed
     'no_symlinks': False,
+    # Set the number of parallel workers used by those processes which support parallelization
+    'cores': 1,
+    # Set if external services are not to be requested, so only cached results are used
+    'offline': False,
+    # Set if files downloaded from the remote database are kept in the shared remote cache
+    'remote_cache': False,
+    # Set if processed files are fingerprinted by content, so they are not considered modified when only mtimes change
+    'fingerprints': True,
 }
 
 # Set the possible gromacs calls tried to find the gromacs executable in case it is not froced by the user
@@ -40,6 +48,19 @@ AVAILABLE_TEXT_EDITORS = { name: command for name, command in TEXT_EDITORS.items
 # Database
 DEFAULT_API_URL = 'https://irb-dev.mddbr.eu/api/'
 
+# Local caches shared by all runs
+# Set the name of the environmental variable which is read by the workflow to know the cache directory
+# Set this variable empty to disable the caches
+# Note that remote project files are cached only when requested (--remote_cache) since they may take a lot of disk
+REMOTE_CACHE_ENV = 'MWF_CACHE'
+REMOTE_CACHE_DIRECTORY = environ.get(REMOTE_CACHE_ENV, path.join(path.expanduser('~'), '.cache', 'model_workflow'))
+# Set the name of the environmental variable which is read by the workflow to know the cache maximum size (in GB)
+# Least recently used files are removed from the cache when this size is exceeded
+REMOTE_CACHE_SIZE_ENV = 'MWF_CACHE_SIZE'
+REMOTE_CACHE_MAX_SIZE = int(float(environ.get(REMOTE_CACHE_SIZE_ENV, 20)) * 1024 ** 3)
+# Lookups to external services (e.g. UniProt, PDB, BLAST) are cached in a database in the same directory
+LOOKUP_CACHE_FILEPATH = path.join(REMOTE_CACHE_DIRECTORY, 'lookups.sqlite') if REMOTE_CACHE_DIRECTORY else None
+
 # Selections
 # Set a standard selection for protein and nucleic acid backbones in vmd syntax
 ALL_ATOMS = 'all'
@@ -108,7 +129,9 @@ STRUCTURE_FILENAME = 'structure.pdb'
 TRAJECTORY_FILENAME = 'trajectory.xtc'
 
 # Intermediate filenames
-REGISTER_FILENAME = '.register.json'
+REGISTER_FILENAME = '.register.sqlite'
+# Registers from previous versions are imported when found
+LEGACY_REGISTER_FILENAME = '.register.json'
 
 # Files saving resorted bonds and charges when we have to resort atoms
 # Note that these files have priority when loading both bonds and charges
@@ -3,9 +3,24 @@
 import os
 import sys
 import requests
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import stat      # For file mode constants
+from typing import Optional
 from fuse import FUSE, Operations  # FUSE bindings with fusepy
 
+# Size of the blocks requested to the server
+BLOCK_SIZE = 1024 * 1024 # 1 MB
+# Number of blocks kept in memory
+# Blocks removed from memory are kept in a temporal file in disk
+MEMORY_BLOCKS = 64
+# Number of blocks to be requested in advance when the file is read sequentially
+READ_AHEAD_BLOCKS = 4
+# Number of parallel block requests
+FETCH_WORKERS = 4
+
 
 # Set the functions which are set by default when the file handler is passed to the fuse class
 # These functions are better not overwritten in the file handler
@@ -25,11 +40,41 @@ not_implememnted_fuse_functions = ['fgetattr', 'readlink', 'opendir', 'readdir',
     'flock', 'fallocate', 'copy_file_range', 'lseek']
 
 # FUSE implementation for a single file
+# The remote file is read in blocks through HTTP range requests so only the read regions are downloaded
+# Blocks are cached in memory and, when memory is full, in a temporal file in disk
+# When the file is read sequentially the following blocks are requested in advance
 class FileHandler(Operations):
-    def __init__ (self, url : str):
+    def __init__ (self, url : str,
+        block_size : int = BLOCK_SIZE,
+        memory_blocks : int = MEMORY_BLOCKS,
+        read_ahead_blocks : int = READ_AHEAD_BLOCKS,
+        fetch_workers : int = FETCH_WORKERS,
+        # Directory where the disk cache is written, by default the system temporal directory
+        spill_directory : Optional[str] = None):
         print("Initializing API Virtual File System...")
         self.url = url
+        self.block_size = block_size
+        self.memory_blocks = memory_blocks
+        self.read_ahead_blocks = read_ahead_blocks
+        self.spill_directory = spill_directory
+        # Full response, only used when the server does not support range requests
         self._response = None
+        # Remote file size and range support, requested only once
+        self._size = None
+        self._accepts_ranges = None
+        # Blocks in memory, sorted from the least to the most recently used
+        self._memory_cache = OrderedDict()
+        # Temporal file where blocks removed from memory are written and the indices of the blocks it contains
+        self._spill_file = None
+        self._spilled_blocks = set()
+        # Blocks being requested
+        self._pending_blocks = {}
+        # End of the last read, used to detect sequential reads
+        self._last_read_end = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers = fetch_workers)
+        # Every thread uses its own session so connections are reused
+        self._local = threading.local()
         # Set all missing fuse functions as whistleblowers
         # Most commands will return a clueless 'function not implemented' error when trying to access any of these functions
         # This prevents the error and intead tells the user which function is being called and not yet implemented
@@ -48,16 +93,110 @@ class FileHandler(Operations):
         return function(*args)
 
     def _get_file_size(self):
+        if self._size != None:
+            return self._size
         response = requests.head(self.url, allow_redirects=True)
         response.raise_for_status()  # Raise an exception for HTTP errors
         # Check if Content-Length header exists
-        size = int(response.headers.get('Content-Length', 0))
-        return size
+        self._size = int(response.headers.get('Content-Length', 0))
+        self._accepts_ranges = response.headers.get('Accept-Ranges', 'none').lower() == 'bytes'
+        return self._size
         
     def _fetch_file_content(self):
         """Fetch content from remote API."""
         self._response = requests.get(self.url)
         self._response.raise_for_status()
+
+    def _get_session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _fetch_block(self, index : int) -> bytes:
+        """Request a single block to the remote API."""
+        start = index * self.block_size
+        end = min(start + self.block_size, self._size) - 1
+        response = self._get_session().get(self.url, headers={ 'Range': f'bytes={start}-{end}' })
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise Exception(f'Server did not return a partial content for range request: {self.url}')
+        return response.content
+
+    def _load_block(self, index : int) -> bytes:
+        """Request a block and add it to the cache."""
+        try:
+            block = self._fetch_block(index)
+            with self._lock:
+                self._add_to_memory(index, block)
+            return block
+        finally:
+            with self._lock:
+                self._pending_blocks.pop(index, None)
+
+    def _add_to_memory(self, index : int, block : bytes):
+        """Add a block to the memory cache and spill the least recently used blocks to disk.
+        Note that this must be called with the lock acquired."""
+        self._memory_cache[index] = block
+        self._memory_cache.move_to_end(index)
+        while len(self._memory_cache) > self.memory_blocks:
+            spilled_index, spilled_block = self._memory_cache.popitem(last=False)
+            if spilled_index in self._spilled_blocks:
+                continue
+            if self._spill_file is None:
+                self._spill_file = tempfile.TemporaryFile(dir=self.spill_directory)
+            self._spill_file.seek(spilled_index * self.block_size)
+            self._spill_file.write(spilled_block)
+            self._spilled_blocks.add(spilled_index)
+
+    def _get_cached_block(self, index : int) -> Optional[bytes]:
+        """Get a block from memory or disk, if cached.
+        Note that this must be called with the lock acquired."""
+        block = self._memory_cache.get(index)
+        if block is not None:
+            self._memory_cache.move_to_end(index)
+            return block
+        if index in self._spilled_blocks:
+            self._spill_file.seek(index * self.block_size)
+            block = self._spill_file.read(min(self.block_size, self._size - index * self.block_size))
+            self._add_to_memory(index, block)
+            return block
+        return None
+
+    def _request_block(self, index : int):
+        """Get a block from the cache or a future which returns the block once it is downloaded.
+        Note that this must be called with the lock acquired."""
+        block = self._get_cached_block(index)
+        if block is not None:
+            return block
+        future = self._pending_blocks.get(index)
+        if future is None:
+            future = self._executor.submit(self._load_block, index)
+            self._pending_blocks[index] = future
+        return future
+
+    def _read_range(self, offset : int, length : int) -> bytes:
+        """Read a range of the remote file through the block cache."""
+        size = self._get_file_size()
+        if offset >= size or length <= 0:
+            return b''
+        end = min(offset + length, size)
+        first_block = offset // self.block_size
+        last_block = (end - 1) // self.block_size
+        total_blocks = (size - 1) // self.block_size + 1
+        with self._lock:
+            # Request all needed blocks at once so missing blocks are downloaded in parallel
+            blocks = [ self._request_block(index) for index in range(first_block, last_block + 1) ]
+            # If the file is read sequentially then request the following blocks in advance
+            if self._last_read_end == offset:
+                read_ahead_end = min(last_block + 1 + self.read_ahead_blocks, total_blocks)
+                for index in range(last_block + 1, read_ahead_end):
+                    self._request_block(index)
+            self._last_read_end = end
+        blocks = [ block if isinstance(block, bytes) else block.result() for block in blocks ]
+        data = b''.join(blocks)
+        start = offset - first_block * self.block_size
+        return data[start:start + end - offset]
     
     # Attribute keys
     # Got from https://github.com/skorokithakis/python-fuse-sample/blob/master/passthrough.py
@@ -96,7 +235,11 @@ class FileHandler(Operations):
 
     # Open the URL request
     def open (self, path : str, flags) -> int:
-        # Lazy load content if not already fetched
+        # If the server supports range requests then blocks are requested on demand when read
+        self._get_file_size()
+        if self._accepts_ranges:
+            return 0
+        # Otherwise lazy load content if not already fetched
         if self._response is None:
             self._fetch_file_content()
         # Return a file descriptor (dummy in this case)
@@ -109,6 +252,9 @@ class FileHandler(Operations):
     # When the maximum value is not enought to cover the length the read function is called several times
     # Each time with different offset value
     def read (self, path : str, length : int, offset : int, fh : int) -> str:
+        self._get_file_size()
+        if self._accepts_ranges:
+            return self._read_range(offset, length)
         if self._response is None:
             self._fetch_file_content()
         return self._response.content[offset:offset + length]
@@ -117,6 +263,9 @@ class FileHandler(Operations):
     def destroy (self, path : str):
         if self._response:
             self._response.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._spill_file:
+            self._spill_file.close()
 
     # The following functions are not implemented
     # However they must be defined or FUSE complains when trying to read the file
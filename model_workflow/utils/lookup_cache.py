@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from threading import Lock
+
+from model_workflow.utils.constants import GLOBALS, LOOKUP_CACHE_FILEPATH
+from model_workflow.utils.type_hints import *
+
+# Time after which a cached lookup is considered outdated and it is requested again
+DEFAULT_TTL = 30 * 24 * 3600 # 30 days
+# Time after which a cached empty lookup (e.g. not found) is requested again
+# Empty results may come from temporal errors so they are kept for less time
+DEFAULT_NEGATIVE_TTL = 24 * 3600 # 1 day
+
+# A persistent cache for the results of requests to external services (e.g. UniProt, PDB, BLAST)
+# The cache is shared by all runs so the same request is done only once
+# Results are stored as JSON in a SQLite database, by namespace (i.e. the type of request) and key
+# In offline mode the cache is never missed, but services are never requested and missing results are None
+class LookupCache:
+    def __init__ (self, filepath : Optional[str] = LOOKUP_CACHE_FILEPATH, offline : Optional[bool] = None):
+        self.filepath = filepath
+        # Offline mode is set through the common console arguments by default
+        self.offline = GLOBALS['offline'] if offline == None else offline
+        # Without a file path the cache is kept in memory only
+        if filepath:
+            directory = os.path.dirname(filepath)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+        # The same connection may be used by several threads so it is protected by a lock
+        self._lock = Lock()
+        self._connection = sqlite3.connect(filepath or ':memory:', timeout = 60, check_same_thread = False)
+        with self._lock, self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS lookups ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT, created REAL NOT NULL, '
+                'PRIMARY KEY (namespace, key))')
+
+    def __repr__ (self):
+        return f'<Lookup cache at {self.filepath or "memory"}>'
+
+    # Get a cached result
+    # Return a tuple with a boolean telling if the result was found and the result itself
+    # Outdated results are not found, unless we are offline
+    def get (self, namespace : str, key : str,
+        ttl : float = DEFAULT_TTL, negative_ttl : float = DEFAULT_NEGATIVE_TTL) -> Tuple[bool, Any]:
+        with self._lock:
+            row = self._connection.execute('SELECT value, created FROM lookups WHERE namespace = ? AND key = ?',
+                (namespace, key)).fetchone()
+        if row == None:
+            return False, None
+        value = json.loads(row[0])
+        age = time.time() - row[1]
+        if not self.offline and age > (ttl if value != None else negative_ttl):
+            return False, None
+        return True, value
+
+    # Save a result in the cache
+    def set (self, namespace : str, key : str, value : Any):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO lookups (namespace, key, value, created) VALUES (?, ?, ?, ?)',
+                (namespace, key, json.dumps(value), time.time()))
+
+    # Remove a result from the cache, if any
+    def remove (self, namespace : str, key : str):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM lookups WHERE namespace = ? AND key = ?', (namespace, key))
+
+    # Get a cached result or request it otherwise
+    # Request function must return JSON serializable results
+    # In offline mode missing results are not requested and None is returned instead
+    def lookup (self, namespace : str, key : str, request : Callable,
+        ttl : float = DEFAULT_TTL, negative_ttl : float = DEFAULT_NEGATIVE_TTL) -> Any:
+        found, value = self.get(namespace, key, ttl, negative_ttl)
+        if found:
+            return value
+        if self.offline:
+            print(f'WARNING: Missing {namespace} lookup for {key} in the cache and we are offline')
+            return None
+        value = request()
+        self.set(namespace, key, value)
+        return value
+
+    def close (self):
+        with self._lock:
+            self._connection.close()
+
+# Get a short and stable key for long inputs (e.g. sequences)
+def get_hash_key (value : str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+# Get the default lookup cache
+# If the cache is disabled or it can not be created then use a cache in memory
+# This way lookups are still not repeated in the same run
+def get_default_lookup_cache () -> LookupCache:
+    try:
+        return LookupCache()
+    except (OSError, sqlite3.Error) as error:
+        print(f'WARNING: Cannot use the lookup cache at {LOOKUP_CACHE_FILEPATH}: {error}')
+        return LookupCache(None)
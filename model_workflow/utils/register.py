@@ -1,16 +1,72 @@
+import json
+import sqlite3
+import hashlib
 from sys import argv
-from os.path import exists, getmtime
+from os.path import exists, getmtime, getsize, join
 from datetime import datetime
 from time import strftime, gmtime
 
-from model_workflow.utils.auxiliar import load_json, save_json, warn
+from model_workflow.utils.constants import GLOBALS, LEGACY_REGISTER_FILENAME
+from model_workflow.utils.auxiliar import load_json, warn
 from model_workflow.utils.type_hints import *
 
+# xxhash is much faster than hashlib algorithms but it is optional
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 # Set dates format
 date_style = '%d-%m-%Y %H:%M:%S'
 
+# Set the hash algorithm used for file fingerprints
+FINGERPRINT_ALGORITHM = 'xxh64' if xxhash else 'blake2b'
+# Set the size and number of the blocks sampled along a file to get its fingerprint
+# Files smaller than all blocks together are read entirely
+FINGERPRINT_BLOCK_SIZE = 1024 * 1024 # 1 MB
+FINGERPRINT_BLOCKS = 16
+
+# Get a fingerprint of the file content which is fast enough even for multi-GB trajectories
+# The fingerprint includes the file size and a hash of some blocks sampled along the file
+# The algorithm is included as well, so fingerprints are always compared using the same algorithm
+# Return None if the algorithm is not available
+def get_file_fingerprint (filepath : str, algorithm : str = FINGERPRINT_ALGORITHM) -> Optional[str]:
+    if algorithm == 'xxh64':
+        if not xxhash:
+            return None
+        hasher = xxhash.xxh64()
+    elif algorithm in hashlib.algorithms_available:
+        hasher = hashlib.new(algorithm)
+    else:
+        return None
+    size = getsize(filepath)
+    # Set the offsets of the blocks to be read
+    if size <= FINGERPRINT_BLOCK_SIZE * FINGERPRINT_BLOCKS:
+        offsets = range(0, size, FINGERPRINT_BLOCK_SIZE)
+    else:
+        step = (size - FINGERPRINT_BLOCK_SIZE) / (FINGERPRINT_BLOCKS - 1)
+        offsets = [ round(block * step) for block in range(FINGERPRINT_BLOCKS) ]
+    with open(filepath, 'rb') as file:
+        for offset in offsets:
+            file.seek(offset)
+            hasher.update(file.read(FINGERPRINT_BLOCK_SIZE))
+    return f'{algorithm}:{size}:{hasher.hexdigest()}'
+
+# Set the register database tables
+# Every run is recorded as an entry while the rest of tables keep the current values
+REGISTER_TABLES = [
+    'CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY AUTOINCREMENT, call TEXT, date TEXT)',
+    'CREATE TABLE IF NOT EXISTS mtimes (filename TEXT PRIMARY KEY, mtime TEXT)',
+    'CREATE TABLE IF NOT EXISTS fingerprints (filename TEXT PRIMARY KEY, fingerprint TEXT)',
+    'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS tests (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS warnings (id INTEGER PRIMARY KEY AUTOINCREMENT, tag TEXT, message TEXT)',
+]
+
 # The register tracks activity along multiple runs and thus avoids repeating some already succeeded tests
 # It is also responsible for storing test failure warnings to be written in metadata
+# The register is stored in a SQLite database and every update is written in a single transaction
+# Thus updates are cheap and an interrupted run never leaves a corrupted register
 class Register:
     def __init__ (self, register_file : 'File'):
         # Save the previous register
@@ -24,35 +80,74 @@ class Register:
         # Set record for the modification times of processed input files
         # This allows to know if any of those files have been modified and thus we must reset some register fields
         self.mtimes = {}
+        # Set record for the content fingerprints of processed input files
+        # This allows to know if files with a different modification time have been actually modified
+        self.fingerprints = {}
         # Set a cache for some already calculated values
         self.cache = {}
         # Set the tests tracker
         self.tests = {}
         # Set the warnings list, which will be filled by failing tests
         self.warnings = []
-        # Inherit cache, test results and warning from the register last entry
-        self.entries = []
+        # The database connection is open once the register directory exists
+        self._connection = None
+        # Set the id of the current run entry in the database, once it is written
+        self._entry_id = None
+        # Set previous entries to be written in the database, when they come from a legacy register
+        self._legacy_entries = []
+        # Inherit cache, test results and warning from the register database
         if self.file.exists:
-            # Read the register in disk
-            self.entries = load_json(self.file.path)
-            last_entry = self.entries[-1]
-            # Inherit modification times
-            self.mtimes = last_entry.get('mtimes', {})
-            # Inherit the cache
-            for field_name, field_value in last_entry['cache'].items():
-                self.cache[field_name] = field_value
-            # Inherit test results
-            for test_name, test_result in last_entry['tests'].items():
-                self.tests[test_name] = test_result
-            # Inherit warnings
-            for warning in last_entry['warnings']:
-                # DANI: Para quitarnos de encima warnings con el formato antiguo
-                if not warning.get('tag', None):
-                    continue
-                self.warnings.append(warning)
+            self._connect()
+            self._load()
+        # Otherwise import the legacy register in json format, if any
+        else:
+            legacy_register_filepath = join(self.file.basepath, LEGACY_REGISTER_FILENAME)
+            if exists(legacy_register_filepath):
+                self.import_json(legacy_register_filepath)
         # Save the entry for the first time
         self.save()
 
+    # Open the connection with the register database
+    def _connect (self):
+        self._connection = sqlite3.connect(self.file.path, timeout = 60)
+        with self._connection:
+            for table in REGISTER_TABLES:
+                self._connection.execute(table)
+
+    # Load the current values from the register database
+    def _load (self):
+        for filename, mtime in self._connection.execute('SELECT filename, mtime FROM mtimes'):
+            self.mtimes[filename] = mtime
+        for filename, fingerprint in self._connection.execute('SELECT filename, fingerprint FROM fingerprints'):
+            self.fingerprints[filename] = fingerprint
+        for key, value in self._connection.execute('SELECT key, value FROM cache'):
+            self.cache[key] = json.loads(value)
+        for key, value in self._connection.execute('SELECT key, value FROM tests'):
+            self.tests[key] = json.loads(value)
+        for tag, message in self._connection.execute('SELECT tag, message FROM warnings ORDER BY id'):
+            self.warnings.append({ 'tag': tag, 'message': message })
+
+    # Import a register in the legacy json format
+    # This is a list of entries, one per run, where the last entry has the current values
+    def import_json (self, register_filepath : str):
+        entries = load_json(register_filepath)
+        self._legacy_entries = [ (entry['call'], entry['date']) for entry in entries ]
+        last_entry = entries[-1]
+        # Inherit modification times
+        self.mtimes = last_entry.get('mtimes', {})
+        # Inherit the cache
+        for field_name, field_value in last_entry['cache'].items():
+            self.cache[field_name] = field_value
+        # Inherit test results
+        for test_name, test_result in last_entry['tests'].items():
+            self.tests[test_name] = test_result
+        # Inherit warnings
+        for warning in last_entry['warnings']:
+            # DANI: Para quitarnos de encima warnings con el formato antiguo
+            if not warning.get('tag', None):
+                continue
+            self.warnings.append(warning)
+
     def __repr__ (self):
         return str(self.to_dict())
 
@@ -62,6 +157,7 @@ class Register:
             'call': self.call,
             'date': self.date,
             'mtimes': self.mtimes,
+            'fingerprints': self.fingerprints,
             'cache': self.cache,
             'tests': self.tests,
             'warnings': self.warnings,
@@ -75,16 +171,30 @@ class Register:
         previous_mtime = self.mtimes.get(target_file.filename, None)
         return new_mtime, previous_mtime
 
-    # Update a modification time
+    # Update a modification time and the content fingerprint
     def update_mtime (self, target_file : 'File'):
+        filename = target_file.filename
+        changes = []
         # Get the new and the previous value
         new_mtime, previous_mtime = self.get_mtime(target_file)
-        # If the new value is already the previous value then do nothing
-        if new_mtime == previous_mtime:
-            return
-        # Overwrite previous value and save the register
-        self.mtimes[target_file.filename] = new_mtime
-        self.save()
+        # If the new value is not the previous value then overwrite it
+        if new_mtime != previous_mtime:
+            self.mtimes[filename] = new_mtime
+            changes.append(('INSERT OR REPLACE INTO mtimes (filename, mtime) VALUES (?, ?)', (filename, new_mtime)))
+        # Fingerprint the file as well, unless it was already fingerprinted and it has not changed since then
+        # If fingerprints are disabled then remove the previous fingerprint, since it may be outdated
+        if GLOBALS['fingerprints']:
+            if len(changes) > 0 or filename not in self.fingerprints:
+                fingerprint = get_file_fingerprint(target_file.path)
+                self.fingerprints[filename] = fingerprint
+                changes.append(('INSERT OR REPLACE INTO fingerprints (filename, fingerprint) VALUES (?, ?)',
+                    (filename, fingerprint)))
+        elif len(changes) > 0 and filename in self.fingerprints:
+            del self.fingerprints[filename]
+            changes.append(('DELETE FROM fingerprints WHERE filename = ?', (filename,)))
+        # Save the register
+        if len(changes) > 0:
+            self._write(*changes)
 
     # Check if a file is new
     def is_file_new (self, target_file : 'File') -> bool:
@@ -94,29 +204,44 @@ class Register:
         return previous_mtime == None
 
     # Check if a file does not match the already registered modification time or it is new
+    # If the modification time does not match then check the content fingerprint, if any
+    # Note that copying, touching or restoring a file from a backup changes its modification time but not its content
     def is_file_modified (self, target_file : 'File') -> bool:
         # Get the new and the previous value
         new_mtime, previous_mtime = self.get_mtime(target_file)
         # If the new value is already the previous value then it has not been modified
         if new_mtime == previous_mtime:
             return False
-        return True
+        # If we have no fingerprint then we can not tell so it is considered modified
+        previous_fingerprint = self.fingerprints.get(target_file.filename, None)
+        if not GLOBALS['fingerprints'] or previous_fingerprint == None:
+            return True
+        algorithm = previous_fingerprint.split(':')[0]
+        new_fingerprint = get_file_fingerprint(target_file.path, algorithm)
+        if new_fingerprint != previous_fingerprint:
+            return True
+        # The content is the same so update the modification time
+        # This way the modification time check is enough the next time
+        self.mtimes[target_file.filename] = new_mtime
+        self._write(('INSERT OR REPLACE INTO mtimes (filename, mtime) VALUES (?, ?)',
+            (target_file.filename, new_mtime)))
+        return False
 
     # Update the cache and save the register
     def update_cache (self, key : str, value):
         self.cache[key] = value
-        self.save()
+        self._write(('INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)', (key, json.dumps(value))))
 
     # Reset the cache
     # This is called when some input files are modified
     def reset_cache (self):
         self.cache = {}
-        self.save()
+        self._write(('DELETE FROM cache', ()))
 
     # Update a test result and save the register
     def update_test (self, key : str, value : Optional[bool]):
         self.tests[key] = value
-        self.save()
+        self._write(('INSERT OR REPLACE INTO tests (key, value) VALUES (?, ?)', (key, json.dumps(value))))
 
     # Get current warnings filtered by tag
     def get_warnings (self, tag : str) -> List[dict]:
@@ -132,21 +257,63 @@ class Register:
         # Add a new warning
         warning = { 'tag': tag, 'message': message }
         self.warnings.append(warning)
-        self.save()
+        self._write(('INSERT INTO warnings (tag, message) VALUES (?, ?)', (tag, message)))
 
     # Remove warnings filtered by tag and save the register
     def remove_warnings (self, tag : str):
         self.warnings = [ warning for warning in self.warnings if warning['tag'] != tag ]
-        self.save()
+        self._write(('DELETE FROM warnings WHERE tag = ?', (tag,)))
+
+    # Write some changes in the register database in a single transaction
+    # Every change is a tuple with the SQL statement and its parameters
+    def _write (self, *changes : Tuple[str, tuple]):
+        # If the register was never saved then save it all
+        if self._connection == None:
+            self.save()
+            return
+        with self._connection:
+            for statement, parameters in changes:
+                self._connection.execute(statement, parameters)
 
-    # Save the register to a json file
+    # Save the whole register to the database in a single transaction
     def save (self):
         # If path does not exist then do nothing
         # WARNING: I know this looks a bit silent 
         # WARNING: Otherwise it is a constant spam when something goes wrong close to beginning
         if not exists(self.file.basepath):
             return
-        # Set a new entry for the current run
-        current_entry = self.to_dict()
-        # Write entries to disk
-        save_json(self.entries + [ current_entry ], self.file.path, indent = 4)
\ No newline at end of file
+        if self._connection == None:
+            self._connect()
+        with self._connection:
+            # Write previous entries from the legacy register, if any
+            self._connection.executemany('INSERT INTO entries (call, date) VALUES (?, ?)', self._legacy_entries)
+            self._legacy_entries = []
+            # Set a new entry for the current run
+            if self._entry_id == None:
+                self._entry_id = self._connection.execute('INSERT INTO entries (call, date) VALUES (?, ?)',
+                    (self.call, self.date)).lastrowid
+            # Write current values
+            for table in [ 'mtimes', 'fingerprints', 'cache', 'tests', 'warnings' ]:
+                self._connection.execute(f'DELETE FROM {table}')
+            self._connection.executemany('INSERT INTO mtimes (filename, mtime) VALUES (?, ?)', self.mtimes.items())
+            self._connection.executemany('INSERT INTO fingerprints (filename, fingerprint) VALUES (?, ?)',
+                self.fingerprints.items())
+            self._connection.executemany('INSERT INTO cache (key, value) VALUES (?, ?)',
+                [ (key, json.dumps(value)) for key, value in self.cache.items() ])
+            self._connection.executemany('INSERT INTO tests (key, value) VALUES (?, ?)',
+                [ (key, json.dumps(value)) for key, value in self.tests.items() ])
+            self._connection.executemany('INSERT INTO warnings (tag, message) VALUES (?, ?)',
+                [ (warning['tag'], warning['message']) for warning in self.warnings ])
+
+    # Get the call and date of every run, from oldest to newest
+    def get_entries (self) -> List[dict]:
+        if self._connection == None:
+            return [ { 'call': self.call, 'date': self.date } ]
+        rows = self._connection.execute('SELECT call, date FROM entries ORDER BY id').fetchall()
+        return [ { 'call': call, 'date': date } for call, date in rows ]
+    entries = property(get_entries, None, None, "Call and date of every run (read only)")
+
+    def close (self):
+        if self._connection != None:
+            self._connection.close()
+            self._connection = None
@@ -1,14 +1,41 @@
 import urllib.request
 import json
+import os
+import time
+import base64
+import hashlib
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from model_workflow.utils.auxiliar import load_json, save_json, InputError
+from model_workflow.utils.remote_cache import RemoteCache, get_default_cache
 from model_workflow.utils.type_hints import *
 
+# Number of parallel connections used to download a single file
+DEFAULT_CONNECTIONS = 4
+# Files smaller than this are downloaded with a single connection
+MIN_SEGMENT_SIZE = 1024 * 1024 # 1 MB
+# Number of retries for every segment before giving up and the base waiting time between retries
+MAX_RETRIES = 5
+RETRY_DELAY = 1 # seconds
+# Size of the chunks read from the response and written to disk
+CHUNK_SIZE = 1024 * 1024 # 1 MB
+# Timeout for every request
+REQUEST_TIMEOUT = 60 # seconds
+# HTTP errors which are worth a retry
+RETRIABLE_HTTP_CODES = { 408, 429, 500, 502, 503, 504 }
+
 class Remote:
-    def __init__ (self, database_url : str, accession : str):
+    def __init__ (self, database_url : str, accession : str, connections : int = DEFAULT_CONNECTIONS,
+        # Local cache for downloaded files
+        # By default use the shared cache set in the constants, if enabled
+        # Set it to False to disable the cache
+        cache : Optional[Union[RemoteCache, bool]] = None):
         # Save input arguments
         self.database_url = database_url
         self.accession = accession
+        self.connections = connections
+        self.cache = get_default_cache() if cache == None else cache or None
         # Set the URL
         self.url = f'{database_url}rest/current/projects/{accession}'
         # Set internal variables
@@ -52,12 +79,31 @@ class Remote:
         return self._available_files
     available_files = property(get_available_files, None, None, "Remote available files (read only)")
 
+    # Download a file through the local cache
+    # If the file is in the cache and the remote file has not changed then it is not downloaded again
+    # Files which are to be modified after download must be copied from the cache
+    def cached_download (self, request_url : str, output_file : 'File',
+        progress : Optional['tqdm'] = None, copy : bool = False):
+        # If there is no cache then simply download the file
+        if not self.cache:
+            download(request_url, output_file.path, connections = self.connections, progress = progress)
+            return
+        # Ask the server for the remote modification info
+        headers = get_download_headers(request_url)
+        key = self.cache.get_key(request_url, headers)
+        if key and self.cache.restore(key, output_file.path, copy = copy):
+            print(f' Using cached file ({self.cache.directory})')
+            return
+        download(request_url, output_file.path, connections = self.connections, progress = progress, headers = headers)
+        if key:
+            self.cache.store(key, output_file.path, copy = copy)
+
     # Download a specific file
     def download_file (self, output_file : 'File'):
         request_url = f'{self.url}/files/{output_file.filename}'
         print(f'Downloading file "{output_file.filename}" ({output_file.path})\n')
         try:
-            urllib.request.urlretrieve(request_url, output_file.path)
+            self.cached_download(request_url, output_file)
         except urllib.error.HTTPError as error:
             # Try to provide comprehensive error logs depending on the error
             # If file was not found
@@ -71,7 +117,7 @@ class Remote:
         request_url = self.url + '/topology'
         print(f'Downloading standard topology ({output_file.path})\n')
         try:
-            urllib.request.urlretrieve(request_url, output_file.path)
+            self.cached_download(request_url, output_file)
         except:
             raise Exception('Something went wrong when downloading the standard topology: ' + request_url)
         
@@ -80,7 +126,7 @@ class Remote:
         request_url = self.url + '/structure'
         print(f'Downloading standard structure ({output_file.path})\n')
         try:
-            urllib.request.urlretrieve(request_url, output_file.path)
+            self.cached_download(request_url, output_file)
         except:
             raise Exception('Something went wrong when downloading the standard structure: ' + request_url)
         
@@ -113,7 +159,7 @@ class Remote:
         try:
             with tqdm(unit = 'B', unit_scale = True, unit_divisor = 1024, 
                       miniters = 1, desc = ' Progress', leave=False) as t:
-                urllib.request.urlretrieve(request_url, output_file.path, reporthook = my_hook(t))
+                self.cached_download(request_url, output_file, progress = t)
         except:
             raise Exception('Something went wrong when downloading the main trajectory: ' + request_url)
 
@@ -127,7 +173,8 @@ class Remote:
         # Send the request
         print(f'Downloading input files ({output_file.path})\n')
         try:
-            urllib.request.urlretrieve(request_url, output_file.path)
+            # Note that the file is copied from the cache since it may be rewritten
+            self.cached_download(request_url, output_file, copy = is_json)
         except:
             raise Exception('Something went wrong when downloading the inputs file: ' + request_url)
         # If this is a json file then rewrite the inputs file in a pretty formatted way (with indentation)
@@ -140,38 +187,219 @@ class Remote:
         request_url = f'{self.url}/analyses/{analysis_type}'
         print(f'Downloading {analysis_type} analysis data\n')
         try:
-            urllib.request.urlretrieve(request_url, output_file.path)
+            # Note that the file is copied from the cache since it is rewritten
+            self.cached_download(request_url, output_file, copy = True)
             # Format JSON if needed
             file_content = load_json(output_file.path)
             save_json(file_content, output_file.path, indent=4)
         except:
             raise Exception(f'Something went wrong when retrieving {analysis_type} analysis: {request_url}')
         
-# from https://gist.github.com/leimao/37ff6e990b3226c2c9670a2cd1e4a6f5
-def my_hook(t):
-    """Wraps tqdm instance.
-    Don't forget to close() or __exit__()
-    the tqdm instance once you're done with it (easiest using `with` syntax).
-    Example
-    -------
-    >>> with tqdm(...) as t:
-    ...     reporthook = my_hook(t)
-    ...     urllib.urlretrieve(..., reporthook=reporthook)
-    """
-    last_b = [0]
+# Download a file from a URL
+# If the server supports range requests then the file is downloaded in segments through parallel connections
+# Data is written to a '.part' file which is renamed once the download is complete and verified
+# The progress of every segment is saved in a '.part.json' file so an interrupted download is resumed in the next run
+# Failed segments are retried with an exponential backoff and they continue where they were interrupted
+# The final file is verified by size and also by checksum if the server provides one
+def download (
+    request_url : str,
+    output_filepath : str,
+    connections : int = DEFAULT_CONNECTIONS,
+    # A tqdm instance to track the progress
+    progress : Optional['tqdm'] = None,
+    # Headers already requested to the server, if any
+    headers : Optional[dict] = None,
+):
+    part_filepath = output_filepath + '.part'
+    state_filepath = part_filepath + '.json'
+    # Ask the server for the file size and range support
+    if headers == None:
+        headers = get_download_headers(request_url)
+    size = headers['size']
+    # If the server does not support ranges or it does not tell the size then download the file in one go
+    # Note that it could be resumed neither
+    if not headers['accepts_ranges'] or size == None:
+        download_segment(request_url, part_filepath, progress = progress)
+        verify_download(part_filepath, size, headers['checksum'], state_filepath)
+        os.replace(part_filepath, output_filepath)
+        return
+    if progress != None:
+        progress.total = size
+    # Try to resume a previous download
+    # The previous state is only valid if the remote file has not changed
+    state = None
+    if os.path.exists(part_filepath) and os.path.exists(state_filepath):
+        try:
+            state = load_json(state_filepath)
+        except:
+            state = None
+        if state and (state.get('size') != size or state.get('etag') != headers['etag']):
+            state = None
+    # Otherwise start a new download
+    if not state:
+        # Split the file in segments, one per connection
+        segments_count = max(1, min(connections, size // MIN_SEGMENT_SIZE))
+        limits = [ size * s // segments_count for s in range(segments_count + 1) ]
+        state = {
+            'size': size,
+            'etag': headers['etag'],
+            # Start and end bytes (end not included) and already downloaded bytes of every segment
+            'segments': [ { 'start': limits[s], 'end': limits[s + 1], 'done': 0 } for s in range(segments_count) ]
+        }
+        # Allocate the whole file so every segment can write in its own region
+        with open(part_filepath, 'wb') as file:
+            file.truncate(size)
+        save_json(state, state_filepath)
+    elif progress != None:
+        progress.update(sum([ segment['done'] for segment in state['segments'] ]))
+    # Download pending segments in parallel
+    state_lock = Lock()
+    def save_state ():
+        with state_lock:
+            save_json(state, state_filepath)
+    pending_segments = [ segment for segment in state['segments'] if segment['start'] + segment['done'] < segment['end'] ]
+    if len(pending_segments) > 0:
+        with ThreadPoolExecutor(max_workers = len(pending_segments)) as executor:
+            futures = [ executor.submit(download_segment, request_url, part_filepath,
+                segment = segment, on_chunk = save_state, progress = progress) for segment in pending_segments ]
+            # Raise errors, if any
+            for future in futures:
+                future.result()
+    # Make sure the file is complete and correct
+    verify_download(part_filepath, size, headers['checksum'], state_filepath)
+    os.replace(part_filepath, output_filepath)
+    os.remove(state_filepath)
 
-    def update_to(b=1, bsize=1, tsize=None):
-        """
-        b  : int, optional
-            Number of blocks transferred so far [default: 1].
-        bsize  : int, optional
-            Size of each block (in tqdm units) [default: 1].
-        tsize  : int, optional
-            Total size (in tqdm units). If [default: None] remains unchanged.
-        """
-        if tsize is not None:
-            t.total = tsize
-        t.update((b - last_b[0]) * bsize)
-        last_b[0] = b
+# Get the headers we need to plan a download: size, range support, modification info and checksum
+def get_download_headers (request_url : str) -> dict:
+    request = urllib.request.Request(request_url, method = 'HEAD')
+    try:
+        response = urllib.request.urlopen(request, timeout = REQUEST_TIMEOUT)
+        headers = response.headers
+        response.close()
+    # Some servers do not support HEAD requests
+    # In this case we can not plan anything and the file is downloaded in one go
+    except urllib.error.HTTPError as error:
+        if error.code in [ 404 ]:
+            raise
+        return { 'size': None, 'accepts_ranges': False, 'etag': None, 'last_modified': None, 'checksum': None }
+    content_length = headers.get('Content-Length')
+    # Note that compressed responses have a content length which does not match the file size
+    is_encoded = headers.get('Content-Encoding', 'identity') != 'identity'
+    size = int(content_length) if content_length != None and not is_encoded else None
+    accepts_ranges = headers.get('Accept-Ranges', 'none').lower() == 'bytes'
+    return {
+        'size': size,
+        'accepts_ranges': accepts_ranges,
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'checksum': get_header_checksum(headers),
+    }
+
+# Get the checksum provided by the server, if any
+# Return a tuple with the hash algorithm and the expected digest as bytes
+def get_header_checksum (headers) -> Optional[tuple]:
+    # Content-MD5 header contains the base64 encoded md5
+    content_md5 = headers.get('Content-MD5')
+    if content_md5:
+        return ('md5', base64.b64decode(content_md5))
+    # Digest header may contain several algorithms, e.g. 'sha-256=...,md5=...'
+    digest = headers.get('Digest')
+    if digest:
+        for value in digest.split(','):
+            algorithm, _, encoded = value.strip().partition('=')
+            algorithm = algorithm.lower().replace('-', '')
+            if algorithm in [ 'sha256', 'md5' ]:
+                return (algorithm, base64.b64decode(encoded))
+    return None
+
+# Download a segment of a file (or the whole file) and write it in the part file
+# The segment state is updated after every written chunk so it can be resumed
+# In case of failure the download is retried from the last written byte
+def download_segment (
+    request_url : str,
+    part_filepath : str,
+    # Segment state with start and end bytes and already downloaded bytes
+    # If there is no segment then the whole file is downloaded with no range
+    segment : Optional[dict] = None,
+    # Callback to call after every written chunk
+    on_chunk : Optional[Callable] = None,
+    progress : Optional['tqdm'] = None,
+):
+    attempt = 0
+    while True:
+        request = urllib.request.Request(request_url)
+        if segment:
+            current_byte = segment['start'] + segment['done']
+            request.add_header('Range', f'bytes={current_byte}-{segment["end"] - 1}')
+        written_bytes = 0
+        try:
+            with urllib.request.urlopen(request, timeout = REQUEST_TIMEOUT) as response:
+                # If we asked for a range then the server must return a partial content
+                if segment and response.status != 206:
+                    raise Exception(f'Server did not return a partial content for range request: {request_url}')
+                with open(part_filepath, 'r+b' if segment else 'wb') as file:
+                    if segment:
+                        file.seek(current_byte)
+                    while True:
+                        # Do not read beyond the segment end
+                        chunk_size = CHUNK_SIZE
+                        if segment:
+                            chunk_size = min(CHUNK_SIZE, segment['end'] - segment['start'] - segment['done'])
+                            if chunk_size == 0:
+                                break
+                        chunk = response.read(chunk_size)
+                        if not chunk:
+                            break
+                        file.write(chunk)
+                        written_bytes += len(chunk)
+                        if progress != None:
+                            progress.update(len(chunk))
+                        if segment:
+                            # Make sure data is on disk before we save the progress
+                            file.flush()
+                            segment['done'] += len(chunk)
+                            if on_chunk: on_chunk()
+            # If the response ended before the segment end then the connection was dropped
+            if segment and segment['start'] + segment['done'] < segment['end']:
+                raise ConnectionError(f'Connection closed before the end of the segment: {request_url}')
+            return
+        except urllib.error.HTTPError as error:
+            # Do not retry errors which are not going to be solved by retrying (e.g. 404)
+            if error.code not in RETRIABLE_HTTP_CODES:
+                raise
+            failure = error
+        except Exception as error:
+            failure = error
+        # Without segments we can not resume, so restart the progress
+        if not segment and progress != None:
+            progress.update(-written_bytes)
+        attempt += 1
+        if attempt > MAX_RETRIES:
+            raise failure
+        # Wait before retrying, every time a bit longer
+        time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
 
-    return update_to
\ No newline at end of file
+# Make sure a downloaded file has the expected size and checksum
+# If not, then remove the downloaded file and the download state, if any
+# Otherwise a further run would resume a wrong download with nothing left to download and fail again
+def verify_download (filepath : str, size : Optional[int], checksum : Optional[tuple], state_filepath : Optional[str] = None):
+    error = None
+    if size != None:
+        downloaded_size = os.path.getsize(filepath)
+        if downloaded_size != size:
+            error = f'Downloaded file size ({downloaded_size}) does not match the expected size ({size})'
+    if not error and checksum:
+        algorithm, expected_digest = checksum
+        hasher = hashlib.new(algorithm)
+        with open(filepath, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        if hasher.digest() != expected_digest:
+            error = f'Downloaded file {algorithm} checksum does not match the expected checksum'
+    if not error:
+        return
+    for wrong_filepath in [ filepath, state_filepath ]:
+        if wrong_filepath and os.path.exists(wrong_filepath):
+            os.remove(wrong_filepath)
+    raise Exception(error)
@@ -0,0 +1,184 @@
+import os
+import json
+import stat
+import hashlib
+from shutil import copyfile
+
+from model_workflow.utils.constants import GLOBALS, REMOTE_CACHE_DIRECTORY, REMOTE_CACHE_MAX_SIZE
+from model_workflow.utils.type_hints import *
+
+# Size of the chunks read when hashing files
+HASH_CHUNK_SIZE = 1024 * 1024 # 1 MB
+
+# A local cache for files downloaded from the remote database
+# The cache is shared by all runs so files are downloaded only once
+# File contents are stored by their hash in an 'objects' directory so identical files are stored only once
+# Every remote file is referenced by a key in a 'keys' directory which points to the content hash
+# Keys are made of the request URL (i.e. the database, the project and the file name) and the remote modification info
+# When the cache exceeds the maximum size the least recently used contents are removed
+# Uses are recorded in the keys and never in the contents, since contents may be hardlinked in MD directories
+# Contents are read only so a linked file can not be modified in place, which would corrupt the cache
+class RemoteCache:
+    def __init__ (self, directory : str, max_size : int = REMOTE_CACHE_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.objects_directory = os.path.join(directory, 'objects')
+        self.keys_directory = os.path.join(directory, 'keys')
+        os.makedirs(self.objects_directory, exist_ok = True)
+        os.makedirs(self.keys_directory, exist_ok = True)
+
+    def __repr__ (self):
+        return f'<Remote cache at {self.directory}>'
+
+    # Set the cache key for a remote file
+    # Remote modification info (ETag, Last-Modified) is part of the key so a modified remote file is never taken from the cache
+    # If there is no modification info then we can not know if the remote file changed and there is no key
+    def get_key (self, request_url : str, headers : dict) -> Optional[str]:
+        if not headers.get('etag') and not headers.get('last_modified'):
+            return None
+        key_data = [ request_url, headers.get('etag'), headers.get('last_modified'), headers.get('size') ]
+        return hashlib.sha256(json.dumps(key_data).encode()).hexdigest()
+
+    # Get the path to the cached file content
+    def get_object_path (self, digest : str) -> str:
+        return os.path.join(self.objects_directory, digest[0:2], digest)
+
+    # Get the path to a key
+    def get_key_path (self, key : str) -> str:
+        return os.path.join(self.keys_directory, key)
+
+    # Get the path to the cached file content for a given key, if any
+    def find (self, key : str) -> Optional[str]:
+        key_path = self.get_key_path(key)
+        if not os.path.exists(key_path):
+            return None
+        with open(key_path, 'r') as file:
+            digest = file.read().strip()
+        object_path = self.get_object_path(digest)
+        # The content may have been evicted
+        if not os.path.exists(object_path):
+            return None
+        return object_path
+
+    # Set the cached file for a given key in the output path
+    # Return True if the file was in the cache or False otherwise
+    # Files are hardlinked, or symlinked if hardlinks are not possible (e.g. different file systems)
+    # Files which are to be modified after download must be copied so the cached content is not modified
+    def restore (self, key : str, output_path : str, copy : bool = False) -> bool:
+        object_path = self.find(key)
+        if not object_path:
+            return False
+        # Mark the content as recently used
+        os.utime(self.get_key_path(key))
+        # Remove the output file if it already exists, since it would be outdated
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+        materialize(object_path, output_path, copy)
+        return True
+
+    # Add a downloaded file to the cache
+    def store (self, key : str, filepath : str, copy : bool = False):
+        digest = get_file_hash(filepath)
+        object_path = self.get_object_path(digest)
+        # If the content is not yet in the cache then add it
+        # Use a temporal file and rename it at the end so other runs never see a half written file
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok = True)
+            temporal_path = f'{object_path}.{os.getpid()}.tmp'
+            materialize(filepath, temporal_path, copy = copy, symlink = False)
+            # Note that if the content was hardlinked then the downloaded file becomes read only as well
+            os.chmod(temporal_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(temporal_path, object_path)
+        # Write the key, which also marks the content as recently used
+        key_path = self.get_key_path(key)
+        temporal_path = f'{key_path}.{os.getpid()}.tmp'
+        with open(temporal_path, 'w') as file:
+            file.write(digest)
+        os.replace(temporal_path, key_path)
+        # Remove old contents if we exceeded the size limit
+        self.evict()
+
+    # Remove the least recently used contents until the cache fits in the maximum size
+    # The last use of a content is the last use of any of its keys
+    # Keys pointing to removed contents are removed as well
+    def evict (self):
+        # Get the keys of every content and their last use
+        content_keys = {}
+        last_uses = {}
+        for key in os.listdir(self.keys_directory):
+            # Skip temporal files from other runs
+            if key.endswith('.tmp'):
+                continue
+            key_path = self.get_key_path(key)
+            try:
+                with open(key_path, 'r') as file:
+                    digest = file.read().strip()
+                last_use = os.stat(key_path).st_mtime
+            # The key may have been removed by another run
+            except OSError:
+                continue
+            content_keys.setdefault(digest, []).append(key_path)
+            last_uses[digest] = max(last_uses.get(digest, 0), last_use)
+        objects = []
+        for root, _, filenames in os.walk(self.objects_directory):
+            for filename in filenames:
+                # Skip temporal files from other runs
+                if filename.endswith('.tmp'):
+                    continue
+                object_path = os.path.join(root, filename)
+                stats = os.stat(object_path)
+                last_use = last_uses.get(filename, stats.st_mtime)
+                objects.append((last_use, stats.st_size, filename))
+        total_size = sum([ size for _, size, _ in objects ])
+        if total_size <= self.max_size:
+            return
+        # Sort objects from the least recently used to the most recently used
+        objects.sort()
+        for _, size, digest in objects:
+            if total_size <= self.max_size:
+                break
+            os.remove(self.get_object_path(digest))
+            for key_path in content_keys.get(digest, []):
+                if os.path.exists(key_path):
+                    os.remove(key_path)
+            total_size -= size
+
+# Get the default cache, if enabled
+# The cache is to be enabled explicitly through the common console arguments
+def get_default_cache () -> Optional[RemoteCache]:
+    if not GLOBALS['remote_cache'] or not REMOTE_CACHE_DIRECTORY:
+        return None
+    try:
+        return RemoteCache(REMOTE_CACHE_DIRECTORY)
+    # If we can not create the cache directory then proceed without cache
+    except OSError as error:
+        print(f'WARNING: Cannot use the remote cache at {REMOTE_CACHE_DIRECTORY}: {error}')
+        return None
+
+# Get the sha256 hash of a file content
+def get_file_hash (filepath : str) -> str:
+    hasher = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+# Set a cached file in the output path
+# Try a hardlink first, then a symlink (if allowed) and finally a copy
+# Note that a symlink may become broken if the content is evicted, but then the file is downloaded again
+def materialize (object_path : str, output_path : str, copy : bool = False, symlink : bool = True):
+    if copy:
+        copyfile(object_path, output_path)
+        return
+    try:
+        os.link(object_path, output_path)
+        return
+    except OSError:
+        pass
+    if symlink and not GLOBALS['no_symlinks']:
+        try:
+            os.symlink(os.path.abspath(object_path), output_path)
+            return
+        except OSError:
+            pass
+    copyfile(object_path, output_path)
@@ -0,0 +1,46 @@
+import copy
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    """Base handler for fake services run in a local server
+    Server behaviour and request records are kept in class attributes, which are set from the defaults on reset"""
+    # Default values of the class attributes
+    defaults = {}
+    # Lock to update class attributes from request threads
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    @classmethod
+    def reset(cls):
+        """Set every class attribute to its default value"""
+        for name, value in cls.defaults.items():
+            setattr(cls, name, copy.deepcopy(value))
+
+    def send_body(self, content, status=200, headers={}):
+        """Send a whole response"""
+        if isinstance(content, str):
+            content = content.encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+def fake_server_fixture(handler_class, path=''):
+    """Set a fixture which runs a fake server in a background thread and returns its URL
+    Handler class attributes are reset before running the server"""
+    @pytest.fixture(scope="class")
+    def fake_server():
+        handler_class.reset()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f'http://127.0.0.1:{server.server_address[1]}{path}'
+        server.shutdown()
+        server.server_close()
+    return fake_server
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+# The batched fitting is verified against sklearn
+pytest.importorskip("sklearn")
+from model_workflow.utils.bibitransformer_nassa import BiBiTransformer
+
+def get_datasets():
+    """Get synthetic unimodal and bimodal distributions with different lengths"""
+    generator = np.random.default_rng(seed=1)
+    unimodal = [
+        generator.normal(10, 2, size=500),
+        generator.normal(-3, 0.5, size=800),
+    ]
+    bimodal = [
+        np.concatenate([generator.normal(0, 1, size=400), generator.normal(8, 1.5, size=600)]),
+        np.concatenate([generator.normal(30, 2, size=300), generator.normal(45, 3, size=300)]),
+    ]
+    return unimodal, bimodal
+
+class TestBatchedFitting:
+    """Test the batched EM gives the same results than fitting every distribution with sklearn"""
+
+    def test_same_model_selection(self):
+        """Test both paths select the same model and give close parameters and BIC values"""
+        unimodal, bimodal = get_datasets()
+        datasets = unimodal + bimodal
+        bibi = BiBiTransformer(max_iter=400, tol=1e-5)
+        batched_infos = bibi.fit_transform_batch(datasets)
+        sklearn_infos = bibi.fit_transform_batch(datasets, use_sklearn=True)
+        for i, (batched, expected) in enumerate(zip(batched_infos, sklearn_infos)):
+            # Make sure the synthetic data is classified as expected
+            assert expected['binormal'] == (i >= len(unimodal))
+            for key in ['binormal', 'uninormal', 'insuf_ev', 'unimodal']:
+                assert batched[key] == expected[key]
+            for key in ['mean1', 'mean2', 'var1', 'var2', 'w1', 'w2']:
+                assert batched[key] == pytest.approx(expected[key], rel=1e-2, abs=1e-2, nan_ok=True)
+            assert batched['bics'] == pytest.approx(expected['bics'], rel=1e-4)
+
+    def test_empty_batch(self):
+        """Test no distributions give no results"""
+        assert BiBiTransformer().fit_transform_batch([]) == []
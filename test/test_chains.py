@@ -0,0 +1,148 @@
+import json
+import time
+import pytest
+from urllib.parse import parse_qs
+from fake_server import FakeServiceHandler, fake_server_fixture
+from model_workflow.utils.file import File
+from model_workflow.utils.lookup_cache import LookupCache
+from model_workflow.tools import chains
+from model_workflow.tools.chains import ChainLookups, generate_chain_references
+
+# Number of status checks before a job is finished
+RUNNING_CHECKS = 3
+
+class FakeInterProScanHandler(FakeServiceHandler):
+    """Fake InterProScan service which records every submitted job"""
+    defaults = {
+        'submissions': [],
+        'jobs': {},
+        'status_checks': 0,
+        # Set if jobs are to be finished at some point
+        'finish_jobs': True,
+    }
+
+    def do_POST(self):
+        cls = type(self)
+        length = int(self.headers.get('Content-Length'))
+        data = parse_qs(self.rfile.read(length).decode())
+        sequence = data['sequence'][0].split('\n')[1]
+        with cls.lock:
+            jobid = f'iprscan5-{len(cls.submissions)}'
+            cls.submissions.append(sequence)
+            cls.jobs[jobid] = { 'sequence': sequence, 'checks': 0 }
+        self.send_body(jobid)
+
+    def do_GET(self):
+        cls = type(self)
+        path = self.path.split('/')
+        if self.path.startswith('/status/'):
+            with cls.lock:
+                cls.status_checks += 1
+                job = cls.jobs.get(path[2], None)
+                if job == None:
+                    status = 'NOT_FOUND'
+                else:
+                    job['checks'] += 1
+                    status = 'FINISHED' if cls.finish_jobs and job['checks'] > RUNNING_CHECKS else 'RUNNING'
+            self.send_body(status)
+        elif self.path.startswith('/result/'):
+            sequence = cls.jobs[path[2]]['sequence']
+            signature = { 'accession': f'PF-{sequence}', 'entry': { 'accession': 'IPR', 'pathwayXRefs': [] } }
+            result = { 'interproscan-version': '5.0', 'results': [ { 'sequence': sequence,
+                'matches': [ { 'signature': signature } ] } ] }
+            self.send_body(json.dumps(result))
+        else:
+            self.send_error(404)
+
+fake_interproscan = fake_server_fixture(FakeInterProScanHandler)
+
+@pytest.fixture(autouse=True)
+def use_fake_interproscan(fake_interproscan, monkeypatch):
+    """Send all requests to the fake service and check jobs often"""
+    FakeInterProScanHandler.reset()
+    monkeypatch.setattr(chains, 'INTERPROSCAN_URL', fake_interproscan)
+    monkeypatch.setattr(chains, 'POLL_DELAY', 0.1)
+    monkeypatch.setattr(chains, 'MAX_POLL_DELAY', 0.1)
+
+class FakeResidue:
+    def __init__(self, name):
+        self.name = name
+
+class FakeChain:
+    def __init__(self, name, residue_names):
+        self.name = name
+        self.residues = [ FakeResidue(residue_name) for residue_name in residue_names ]
+
+class FakeStructure:
+    def __init__(self, chains):
+        self.chains = chains
+
+# Four chains with three different sequences
+STRUCTURE = FakeStructure([
+    FakeChain('A', ['MET', 'ALA', 'GLY', 'LYS']),
+    FakeChain('B', ['MET', 'ALA', 'GLY', 'LYS']),
+    FakeChain('C', ['MET', 'TRP', 'TRP', 'LEU', 'SER']),
+    FakeChain('D', ['GLY', 'GLY', 'PRO']),
+])
+SEQUENCES = { 'MAGK', 'MWWLS', 'GGP' }
+
+@pytest.fixture
+def cache_filepath(tmp_path):
+    return str(tmp_path / 'lookups.sqlite')
+
+def run_chains(tmp_path, fake_interproscan, cache_filepath, name='chains.json', offline=False):
+    chains_references_file = File(str(tmp_path / name))
+    lookups = ChainLookups(LookupCache(cache_filepath, offline=offline))
+    return generate_chain_references(STRUCTURE, chains_references_file, f'{fake_interproscan}/', lookups)
+
+class TestInterProScanJobs:
+    """Test InterProScan jobs are run concurrently and their results are shared between projects"""
+
+    def test_concurrent_jobs(self, tmp_path, fake_interproscan, cache_filepath):
+        """Test every unique sequence is submitted once and jobs are checked concurrently"""
+        start = time.time()
+        chains_data = run_chains(tmp_path, fake_interproscan, cache_filepath)
+        elapsed = time.time() - start
+        assert sorted(FakeInterProScanHandler.submissions) == sorted(SEQUENCES)
+        # Jobs need several status checks each, but they are checked at the same time
+        assert elapsed < len(SEQUENCES) * RUNNING_CHECKS * 0.1
+        assert set([ chain_data['sequence'] for chain_data in chains_data ]) == SEQUENCES
+        for chain_data in chains_data:
+            assert chain_data['version'] == chains.CHAINS_VERSION
+            result = chain_data['interproscan']
+            assert 'interproscan-version' not in result
+            assert result['results'][0]['matches'][0]['signature']['accession'] == f'PF-{chain_data["sequence"]}'
+            assert 'pathwayXRefs' not in result['results'][0]['matches'][0]['signature']['entry']
+        # Results are saved in the chains references file
+        assert json.load(open(tmp_path / 'chains.json')) == chains_data
+
+    def test_shared_results(self, tmp_path, fake_interproscan, cache_filepath):
+        """Test a further project with the same sequences takes the results from the cache, even offline"""
+        chains_data = run_chains(tmp_path, fake_interproscan, cache_filepath)
+        assert len(FakeInterProScanHandler.submissions) == 3
+        other_chains_data = run_chains(tmp_path, fake_interproscan, cache_filepath, name='other.json', offline=True)
+        assert len(FakeInterProScanHandler.submissions) == 3
+        assert sorted(other_chains_data, key=lambda data: data['sequence']) == \
+            sorted(chains_data, key=lambda data: data['sequence'])
+
+    def test_resumed_jobs(self, tmp_path, fake_interproscan, cache_filepath, monkeypatch):
+        """Test unfinished jobs are resumed in a further run instead of submitting them again"""
+        FakeInterProScanHandler.finish_jobs = False
+        monkeypatch.setattr(chains, 'JOBS_TIMEOUT', 0.5)
+        chains_data = run_chains(tmp_path, fake_interproscan, cache_filepath)
+        assert all(chain_data['interproscan'] == None for chain_data in chains_data)
+        assert len(FakeInterProScanHandler.submissions) == 3
+        # Run again once jobs may finish
+        FakeInterProScanHandler.finish_jobs = True
+        chains_data = run_chains(tmp_path, fake_interproscan, cache_filepath)
+        assert all(chain_data['interproscan'] != None for chain_data in chains_data)
+        assert len(FakeInterProScanHandler.submissions) == 3
+
+    def test_expired_jobs(self, tmp_path, fake_interproscan, cache_filepath):
+        """Test jobs which are not available anymore are submitted again"""
+        lookups = ChainLookups(LookupCache(cache_filepath, offline=False))
+        lookups.save_interproscan_job('MAGK', 'iprscan5-expired')
+        chains_data = run_chains(tmp_path, fake_interproscan, cache_filepath)
+        assert all(chain_data['interproscan'] != None for chain_data in chains_data)
+        assert sorted(FakeInterProScanHandler.submissions) == sorted(SEQUENCES)
+        assert lookups.find_interproscan_job('MAGK') == None
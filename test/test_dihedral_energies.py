@@ -0,0 +1,74 @@
+import math
+import pytest
+
+# The analysis module loads trajectories with MDtraj
+pytest.importorskip("mdtraj")
+import numpy as np
+from model_workflow.analyses.dihedral_energies import get_torsion_energies, get_non_covalent_energies
+
+# Dihedrals with a different number of terms, so parameters are padded
+DIHEDRALS_DATA = [
+    {
+        'atom_indices': (0, 1, 2, 3),
+        'terms': [
+            { 'force': 1.4, 'period': 1, 'phase': 0 },
+            { 'force': 0.25, 'period': 2, 'phase': math.pi },
+            { 'force': 0.18, 'period': 3, 'phase': 0 },
+        ],
+        'ee_scaling': 1.2, 'vdw_scaling': 2.0,
+        'lj_acoef': 1.0e6, 'lj_bcoef': 6.0e2,
+        'atom1_charge': 0.3, 'atom4_charge': -0.5,
+    },
+    {
+        'atom_indices': (1, 2, 3, 4),
+        'terms': [ { 'force': 2.0, 'period': 2, 'phase': math.pi / 2 } ],
+        'lj_acoef': 2.5e5, 'lj_bcoef': 3.2e2,
+        'atom1_charge': -0.1, 'atom4_charge': -0.2,
+    },
+    {
+        'atom_indices': (2, 3, 4, 5),
+        'terms': [
+            { 'force': 0, 'period': 4, 'phase': 0 },
+            { 'force': 0.9, 'period': 3, 'phase': math.pi },
+        ],
+        'ee_scaling': 1.2, 'vdw_scaling': 2.0,
+        'lj_acoef': 8.0e5, 'lj_bcoef': 5.0e2,
+        'atom1_charge': 0.4, 'atom4_charge': 0.4,
+    },
+]
+
+# Torsions (radians) and 1-4 distances (nm) with shape (frames, dihedrals)
+TORSIONS = np.array([
+    [ 0.1, -2.0, 3.1 ],
+    [ 1.5, 0.7, -0.4 ],
+])
+DISTANCES = np.array([
+    [ 0.31, 0.28, 0.35 ],
+    [ 0.33, 0.29, 0.30 ],
+])
+
+class TestDihedralEnergies:
+    """Test energies of all frames and dihedrals at once match the formulas applied to every value"""
+
+    def test_torsion_energies(self):
+        """Test torsion energies are the sum of the energies of every term"""
+        energies = get_torsion_energies(TORSIONS, DIHEDRALS_DATA)
+        assert energies.shape == TORSIONS.shape
+        for f, frame_torsions in enumerate(TORSIONS):
+            for d, (data, φ) in enumerate(zip(DIHEDRALS_DATA, frame_torsions)):
+                expected = sum([ (term['force'] / 2) * (1 + math.cos(term['period'] * φ - term['phase']))
+                    for term in data['terms'] if term['force'] != 0 ])
+                assert energies[f,d] == pytest.approx(expected, rel=1e-12)
+
+    def test_non_covalent_energies(self):
+        """Test electrostatic and Van Der Waals energies, also when scaling factors are missing"""
+        ee_energies, vdw_energies = get_non_covalent_energies(DISTANCES, DIHEDRALS_DATA)
+        assert ee_energies.shape == vdw_energies.shape == DISTANCES.shape
+        for f, frame_distances in enumerate(DISTANCES):
+            for d, (data, distance) in enumerate(zip(DIHEDRALS_DATA, frame_distances)):
+                r14 = distance * 10
+                expected_ee = (1 / data.get('ee_scaling', 1)) * (data['atom1_charge'] * data['atom4_charge']) / r14
+                expected_vdw = (1 / data.get('vdw_scaling', 1)) * (
+                    (data['lj_acoef'] / (r14 ** 12)) - (data['lj_bcoef'] / (r14 ** 6)))
+                assert ee_energies[f,d] == pytest.approx(expected_ee, rel=1e-12)
+                assert vdw_energies[f,d] == pytest.approx(expected_vdw, rel=1e-12)
@@ -0,0 +1,109 @@
+import os
+import pytest
+from fake_server import FakeServiceHandler, fake_server_fixture
+
+# The FUSE bindings are only needed to mount the file, but they are imported by the module
+pytest.importorskip("fuse")
+from model_workflow.utils.httpsf import FileHandler
+
+BLOCK_SIZE = 1024
+FILE_CONTENT = os.urandom(50 * BLOCK_SIZE + 100)
+
+class RangeHandler(FakeServiceHandler):
+    """Serve a file with range support and record every requested range"""
+    defaults = {
+        'support_ranges': True,
+        'requested_ranges': [],
+        'full_requests': 0,
+    }
+
+    def do_HEAD(self):
+        self.send_headers(len(FILE_CONTENT))
+
+    def do_GET(self):
+        cls = type(self)
+        range_header = self.headers.get('Range')
+        if not cls.support_ranges or range_header == None:
+            with cls.lock:
+                cls.full_requests += 1
+            self.send_headers(len(FILE_CONTENT))
+            self.wfile.write(FILE_CONTENT)
+            return
+        first, last = range_header.replace('bytes=', '').split('-')
+        start, end = int(first), int(last)
+        with cls.lock:
+            cls.requested_ranges.append((start, end))
+        body = FILE_CONTENT[start:end + 1]
+        self.send_headers(len(body), status=206)
+        self.wfile.write(body)
+
+    def send_headers(self, length, status=200):
+        self.send_response(status)
+        if type(self).support_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+file_url = fake_server_fixture(RangeHandler, '/structure.pdb')
+
+@pytest.fixture(autouse=True)
+def reset_server():
+    RangeHandler.reset()
+
+class TestBlockCachedReads:
+    """Test the FUSE file handler reads the remote file in cached blocks"""
+
+    def test_partial_read(self, file_url):
+        """Test reading a region downloads only the blocks containing it"""
+        handler = FileHandler(file_url, block_size=BLOCK_SIZE)
+        handler.open('/', 0)
+        offset = 10 * BLOCK_SIZE + 500
+        assert handler.read('/', 1000, offset, 0) == FILE_CONTENT[offset:offset + 1000]
+        assert sorted(RangeHandler.requested_ranges) == [
+            (10 * BLOCK_SIZE, 11 * BLOCK_SIZE - 1), (11 * BLOCK_SIZE, 12 * BLOCK_SIZE - 1) ]
+        assert RangeHandler.full_requests == 0
+        # Reading the same region again does not request anything
+        assert handler.read('/', 1000, offset, 0) == FILE_CONTENT[offset:offset + 1000]
+        assert len(RangeHandler.requested_ranges) == 2
+        handler.destroy('/')
+
+    def test_sequential_read(self, file_url):
+        """Test a sequential read returns the whole file and requests every block once"""
+        handler = FileHandler(file_url, block_size=BLOCK_SIZE, memory_blocks=4, read_ahead_blocks=3)
+        handler.open('/', 0)
+        data = b''
+        offset = 0
+        while True:
+            chunk = handler.read('/', 4096, offset, 0)
+            if not chunk:
+                break
+            data += chunk
+            offset += len(chunk)
+        assert data == FILE_CONTENT
+        starts = [ start for start, end in RangeHandler.requested_ranges ]
+        assert len(starts) == len(set(starts)) == 51
+        handler.destroy('/')
+
+    def test_disk_spillover(self, file_url, tmp_path):
+        """Test blocks removed from memory are read again from disk"""
+        handler = FileHandler(file_url, block_size=BLOCK_SIZE, memory_blocks=2, read_ahead_blocks=0,
+            spill_directory=str(tmp_path))
+        handler.open('/', 0)
+        for index in range(10):
+            offset = index * BLOCK_SIZE
+            assert handler.read('/', BLOCK_SIZE, offset, 0) == FILE_CONTENT[offset:offset + BLOCK_SIZE]
+        assert len(handler._memory_cache) == 2
+        # Read first blocks again, now from disk
+        assert handler.read('/', 3 * BLOCK_SIZE, 0, 0) == FILE_CONTENT[0:3 * BLOCK_SIZE]
+        assert len(RangeHandler.requested_ranges) == 10
+        handler.destroy('/')
+
+    def test_no_range_support(self, file_url):
+        """Test the whole file is downloaded when the server does not support ranges"""
+        RangeHandler.support_ranges = False
+        handler = FileHandler(file_url, block_size=BLOCK_SIZE)
+        handler.open('/', 0)
+        assert handler.read('/', 100, 2000, 0) == FILE_CONTENT[2000:2100]
+        assert RangeHandler.full_requests == 1
+        assert RangeHandler.requested_ranges == []
+        handler.destroy('/')
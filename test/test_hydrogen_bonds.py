@@ -0,0 +1,34 @@
+import json
+import pytest
+
+# The analysis module runs hydrogen bond calculations with pytraj
+pytest.importorskip("pytraj")
+import numpy
+from model_workflow.analyses.hydrogen_bonds import pack_hbond_values, unpack_hbond_values
+
+class TestPackedValues:
+    """Test hydrogen bond values are recovered after packing them"""
+
+    @pytest.mark.parametrize('frames_count', [1, 8, 13, 64])
+    def test_round_trip(self, frames_count):
+        """Test values are recovered, also when frames do not fill whole bytes"""
+        generator = numpy.random.default_rng(seed=frames_count)
+        values = generator.random((5, frames_count)) > 0.5
+        packed = pack_hbond_values(values)
+        # Packed values are to be written in JSON
+        packed = json.loads(json.dumps(packed))
+        unpacked = unpack_hbond_values(packed, 5, frames_count)
+        assert unpacked.dtype == bool
+        assert numpy.array_equal(unpacked, values)
+
+    def test_independent_rows(self):
+        """Test every row is padded to whole bytes so rows are decoded independently"""
+        values = numpy.array([[1, 0, 1, 1, 0, 0, 0, 0, 1], [0, 0, 0, 0, 0, 0, 0, 0, 0]])
+        unpacked = unpack_hbond_values(pack_hbond_values(values), 2, 9)
+        assert unpacked[0].tolist() == [True, False, True, True, False, False, False, False, True]
+        assert not unpacked[1].any()
+
+    def test_no_hydrogen_bonds(self):
+        """Test an empty matrix is also packed"""
+        values = numpy.zeros((0, 10), dtype=bool)
+        assert unpack_hbond_values(pack_hbond_values(values), 0, 10).shape == (0, 10)
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import MDAnalysis
+from model_workflow.tools.get_inchi_keys import (get_connected_residues, get_residue_groups,
+    get_residue_group_signature, get_inchi_keys)
+
+# Bromochlorofluoromethane, a chiral molecule with explicit hydrogen
+CHIRAL_NAMES = ['C1', 'H1', 'F1', 'CL1', 'BR1']
+CHIRAL_ELEMENTS = ['C', 'H', 'F', 'Cl', 'Br']
+CHIRAL_POSITIONS = np.array([
+    [0, 0, 0], [0.63, 0.63, 0.63], [-0.63, -0.63, 0.63], [-0.63, 0.63, -0.63], [0.63, -0.63, -0.63]
+], dtype=np.float32)
+CHIRAL_BONDS = [(0, 1), (0, 2), (0, 3), (0, 4)]
+
+def build_universe(molecules_positions, chain_length=0):
+    """Build a universe with one residue per chiral molecule plus a chain of bonded carbon residues"""
+    molecules_count = len(molecules_positions)
+    atoms_count = molecules_count * 5 + chain_length
+    residues_count = molecules_count + chain_length
+    atom_resindex = [ m for m in range(molecules_count) for _ in range(5) ]
+    atom_resindex += [ molecules_count + c for c in range(chain_length) ]
+    u = MDAnalysis.Universe.empty(atoms_count, n_residues=residues_count,
+        atom_resindex=atom_resindex, trajectory=True)
+    u.add_TopologyAttr('names', CHIRAL_NAMES * molecules_count + ['C'] * chain_length)
+    u.add_TopologyAttr('elements', CHIRAL_ELEMENTS * molecules_count + ['C'] * chain_length)
+    u.add_TopologyAttr('resnames', ['CBF'] * molecules_count + ['CHN'] * chain_length)
+    bonds = [ (m * 5 + a, m * 5 + b) for m in range(molecules_count) for a, b in CHIRAL_BONDS ]
+    chain_start = molecules_count * 5
+    bonds += [ (chain_start + c, chain_start + c + 1) for c in range(chain_length - 1) ]
+    u.add_TopologyAttr('bonds', bonds)
+    chain_positions = np.array([ [100 + c * 1.5, 0, 0] for c in range(chain_length) ], dtype=np.float32)
+    u.atoms.positions = np.concatenate(list(molecules_positions) + [chain_positions.reshape(-1, 3)])
+    return u
+
+class FakeResidue:
+    def __init__(self, name, classification):
+        self.name = name
+        self.classification = classification
+
+class FakeStructure:
+    def __init__(self, u):
+        self.residues = [ FakeResidue(residue.resname, 'other') for residue in u.residues ]
+
+class TestResidueGroups:
+    """Test residues are grouped by bonds"""
+
+    def test_long_chains(self):
+        """Test long chains of bonded residues are grouped without recursion"""
+        u = build_universe([CHIRAL_POSITIONS] * 2, chain_length=3000)
+        groups = get_residue_groups(u)
+        assert groups[0:2] == [[0], [1]]
+        assert groups[2] == list(range(2, 3002))
+        assert sorted(get_connected_residues(u.residues[2])) == groups[2]
+
+class TestInChIKeys:
+    """Test InChI keys are calculated once for identical residue groups"""
+
+    def test_signatures(self):
+        """Test identical molecules share signature while enantiomers do not"""
+        mirrored_positions = CHIRAL_POSITIONS * np.array([-1, 1, 1], dtype=np.float32)
+        u = build_universe([CHIRAL_POSITIONS, CHIRAL_POSITIONS + 10, mirrored_positions])
+        signatures = [ get_residue_group_signature(residue.atoms) for residue in u.residues ]
+        assert signatures[0] == signatures[1]
+        assert signatures[0] != signatures[2]
+
+    @pytest.mark.parametrize("cores", [1, 2])
+    def test_inchi_keys(self, cores):
+        """Test InChI keys are the same for identical molecules and different for enantiomers"""
+        pytest.importorskip("rdkit")
+        mirrored_positions = CHIRAL_POSITIONS * np.array([-1, 1, 1], dtype=np.float32)
+        u = build_universe([CHIRAL_POSITIONS, CHIRAL_POSITIONS + 10, mirrored_positions])
+        inchi_keys = get_inchi_keys(u, FakeStructure(u), cores=cores)
+        assert len(inchi_keys) == 2
+        resindices = sorted([ data['resindices'] for data in inchi_keys.values() ])
+        assert resindices == [[0, 1], [2]]
@@ -0,0 +1,183 @@
+import json
+import time
+import threading
+import pytest
+from fake_server import FakeServiceHandler, fake_server_fixture
+from model_workflow.utils.lookup_cache import LookupCache
+from model_workflow.tools import generate_ligands_desc
+from model_workflow.tools.generate_ligands_desc import LigandLookups, obtain_ligand_data_from_pubchem, open_url
+from model_workflow.tools.generate_ligands_desc import generate_ligand_mapping
+from model_workflow.utils.constants import PDB_TO_PUBCHEM
+
+# Time the fake server takes to answer every request
+RESPONSE_DELAY = 0.2
+
+def get_information(value):
+    return { 'Information': [ { 'Value': { 'StringWithMarkup': [ { 'String': value } ] } } ] }
+
+def get_pubchem_record(pubchem_id):
+    """Build a minimal PubChem compound record"""
+    descriptors = [
+        { 'TOCHeading': 'IUPAC Name', **get_information(f'compound {pubchem_id}') },
+        { 'TOCHeading': 'SMILES', **get_information('CCO') },
+        { 'TOCHeading': 'InChI', **get_information('InChI=1S/C2H6O/c1-2-3/h3H,2H2,1H3') },
+        { 'TOCHeading': 'InChIKey', **get_information(f'KEY-{pubchem_id}') },
+    ]
+    return { 'Record': { 'Section': [ { 'TOCHeading': 'Names and Identifiers', 'Section': [
+        { 'TOCHeading': 'Computed Descriptors', 'Section': descriptors },
+        { 'TOCHeading': 'Molecular Formula', **get_information('C2H6O') },
+    ] } ] } }
+
+class FakeServicesHandler(FakeServiceHandler):
+    """Fake PubChem and ChEMBL services"""
+    defaults = {
+        'requests': [],
+        # Number of requests to be answered with a 503 error
+        'errors': 0,
+        # Number of requests being answered right now and its maximum
+        'active': 0,
+        'max_active': 0,
+    }
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.requests.append(self.path)
+            fail = cls.errors > 0
+            if fail:
+                cls.errors -= 1
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            if fail:
+                self.send_error(503)
+                return
+            time.sleep(RESPONSE_DELAY)
+            self.send_service_response()
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def send_service_response(self):
+        if self.path.startswith('/rest/pug_view/data/compound/'):
+            pubchem_id = self.path.split('/')[5]
+            if pubchem_id == '404':
+                self.send_error(404)
+                return
+            body = get_pubchem_record(pubchem_id)
+        elif self.path.startswith('/interface_api/es_proxy/es_data/get_es_document/chembl_molecule/'):
+            body = { '_source': { '_metadata': { 'unichem': [
+                { 'src_url': 'http://pubchem.ncbi.nlm.nih.gov', 'id': '702' } ] } } }
+        else:
+            self.send_error(404)
+            return
+        self.send_body(json.dumps(body))
+
+fake_services = fake_server_fixture(FakeServicesHandler)
+
+@pytest.fixture(autouse=True)
+def use_fake_services(fake_services, monkeypatch):
+    """Send all requests to the fake services"""
+    FakeServicesHandler.reset()
+    monkeypatch.setattr(generate_ligands_desc, 'PUBCHEM_URL', fake_services)
+    monkeypatch.setattr(generate_ligands_desc, 'CHEMBL_URL', fake_services)
+    monkeypatch.setattr(generate_ligands_desc, 'RETRY_DELAY', 0)
+
+@pytest.fixture
+def lookups(tmp_path):
+    return LigandLookups(LookupCache(str(tmp_path / 'lookups.sqlite'), offline=False))
+
+class FakePdbService:
+    """Fake PDB API, which gives several ligands per entry, with a PubChem id each"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def request_pdb_data(self, pdb_id, query):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(RESPONSE_DELAY)
+        with self.lock:
+            self.active -= 1
+        # Entries
+        if len(pdb_id) == 4:
+            return { 'nonpolymer_entities': [ { 'nonpolymer_comp': { 'chem_comp': { 'id': f'{pdb_id[0]}{i}' } } }
+                for i in range(4) ] }
+        # Ligands
+        return { 'rcsb_chem_comp_related': [ { 'resource_name': 'PubChem', 'resource_accession_code': f'{pdb_id[0]}0{pdb_id[1]}' } ] }
+
+class FakeRegister:
+    def __init__(self):
+        self.cache = {}
+
+    def update_cache(self, key, value):
+        self.cache[key] = value
+
+class FakeStructure:
+    """Structure with no residues, so PDB ligands never match"""
+    residues = []
+    chains = []
+
+class TestLigandLookups:
+    """Test ligand data is requested concurrently and cached"""
+
+    def test_ligand_data(self, lookups):
+        """Test ligand data is mined from PubChem, also for ChEMBL ids"""
+        ligand_data = obtain_ligand_data_from_pubchem({ 'chembl': 'CHEMBL545' }, lookups)
+        assert ligand_data['pubchem'] == '702'
+        assert ligand_data['chembl'] == 'CHEMBL545'
+        assert ligand_data['smiles'] == 'CCO'
+        assert ligand_data['formula'] == 'C2H6O'
+        assert ligand_data['inchikey'] == 'KEY-702'
+
+    def test_concurrent_requests(self, lookups, tmp_path, monkeypatch):
+        """Test ligands of several PDB ids are requested at the same time, but never above the limit"""
+        pdb_service = FakePdbService()
+        monkeypatch.setattr(generate_ligands_desc, 'request_pdb_data', pdb_service.request_pdb_data)
+        monkeypatch.setattr(generate_ligands_desc, 'requests_semaphore', threading.BoundedSemaphore(3))
+        # Descriptors are not requested to any service
+        monkeypatch.setattr(generate_ligands_desc, 'obtain_mordred_morgan_descriptors', lambda smiles: (None,) * 4)
+        register = FakeRegister()
+        pdb_ids = [ '1AAA', '2BBB', '3CCC', '4DDD' ]
+        start = time.time()
+        ligand_maps, ligand_names = generate_ligand_mapping(FakeStructure(), register, None, pdb_ids,
+            str(tmp_path / 'ligands.json'), lookups=lookups)
+        elapsed = time.time() - start
+        assert (ligand_maps, ligand_names) == ([], {})
+        assert register.cache[PDB_TO_PUBCHEM] == { pdb_id: [ f'{pdb_id[0]}0{i}' for i in range(4) ] for pdb_id in pdb_ids }
+        # Every PubChem id is requested once
+        assert len(FakeServicesHandler.requests) == 16
+        # Requests run at the same time, but the limit is kept even if thread pools are nested
+        assert 1 < pdb_service.max_active <= 3
+        assert 1 < FakeServicesHandler.max_active <= 3
+        # 4 entries, 16 ligands and 16 PubChem records would take 36 sequential requests
+        assert elapsed < 36 * RESPONSE_DELAY / 2
+
+    def test_cached_requests(self, tmp_path):
+        """Test the same ligand is requested only once, even from a different run"""
+        cache_filepath = str(tmp_path / 'lookups.sqlite')
+        first_lookups = LigandLookups(LookupCache(cache_filepath, offline=False))
+        obtain_ligand_data_from_pubchem({ 'pubchem': '702' }, first_lookups)
+        assert len(FakeServicesHandler.requests) == 1
+        # A new run offline still gets the data
+        second_lookups = LigandLookups(LookupCache(cache_filepath, offline=True))
+        ligand_data = obtain_ligand_data_from_pubchem({ 'pubchem': '702' }, second_lookups)
+        assert ligand_data['smiles'] == 'CCO'
+        assert len(FakeServicesHandler.requests) == 1
+        # Missing data is not requested when offline
+        with pytest.raises(RuntimeError):
+            obtain_ligand_data_from_pubchem({ 'pubchem': '703' }, second_lookups)
+        assert len(FakeServicesHandler.requests) == 1
+
+    def test_retries(self, fake_services):
+        """Test temporal errors are retried and other errors are not"""
+        FakeServicesHandler.errors = 2
+        with open_url(f'{fake_services}/rest/pug_view/data/compound/702/JSON/') as response:
+            assert json.loads(response.read())['Record']
+        assert len(FakeServicesHandler.requests) == 3
+        with pytest.raises(generate_ligands_desc.HTTPError):
+            with open_url(f'{fake_services}/rest/pug_view/data/compound/404/JSON/'):
+                pass
+        assert len(FakeServicesHandler.requests) == 4
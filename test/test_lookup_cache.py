@@ -0,0 +1,120 @@
+import time
+import pytest
+from model_workflow.utils.lookup_cache import LookupCache
+from model_workflow.tools import generate_map
+from model_workflow.tools.generate_map import ReferenceLookups
+
+SEQUENCE = 'MFVFLVLLPLVSSQCVNLTTRTQLPPAYTNSFTRGVYYPDKVFRSSVLHSTQDLFLPFFSNVTWFHAIHVSGTNGTKRFDNPVLPFNDGVYF'
+
+class FakeReferenceServices:
+    """Fake external services which count every request"""
+    def __init__(self):
+        self.requests = []
+
+    def get_mdposit_reference(self, uniprot_accession, database_url):
+        self.requests.append(('mdposit', uniprot_accession))
+        return None
+
+    def get_uniprot_reference(self, uniprot_accession):
+        self.requests.append(('uniprot', uniprot_accession))
+        return { 'uniprot': uniprot_accession, 'sequence': SEQUENCE }
+
+    def pdb_to_uniprot(self, pdb_id):
+        self.requests.append(('pdb', pdb_id))
+        return ['P0DTC2']
+
+    def blast(self, sequence):
+        self.requests.append(('blast', sequence))
+        return 'P0DTC2'
+
+# A sequence with nothing to do with the previous one
+UNRELATED_SEQUENCE = 'MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEKAVQVKVKALPDAQFEVVHSLAKWKRQTLGQHDFSAGEGLYTHMKALRPDEDRLSPLHSVYVDQWDWERVMGDGERQFSTLKSTVEAIWAGIKATEAAVSEEFGLAPFLPDQIHFVHSQELLSRYPDLDAKGRERAIAKDLGAVFLVGIGGKLSDGHRHDVRAPDYDDWLAQRV'
+
+@pytest.fixture
+def cache_filepath(tmp_path):
+    return str(tmp_path / 'lookups.sqlite')
+
+class TestReferenceLookups:
+    """Test external service lookups are cached across runs"""
+
+    def test_lookups_are_cached(self, cache_filepath):
+        """Test every lookup is requested only once, even from a different run"""
+        services = FakeReferenceServices()
+        lookups = ReferenceLookups(LookupCache(cache_filepath, offline=False), services)
+        assert lookups.blast(SEQUENCE) == 'P0DTC2'
+        assert lookups.get_uniprot_reference('P0DTC2')['sequence'] == SEQUENCE
+        assert lookups.get_mdposit_reference('P0DTC2', 'https://fake/api/') == None
+        assert lookups.pdb_to_uniprot('6vxx') == ['P0DTC2']
+        assert len(services.requests) == 4
+        # A new run with a new cache instance on the same file must not request anything
+        other_lookups = ReferenceLookups(LookupCache(cache_filepath, offline=False), services)
+        assert other_lookups.blast(SEQUENCE) == 'P0DTC2'
+        assert other_lookups.get_uniprot_reference('P0DTC2')['sequence'] == SEQUENCE
+        assert other_lookups.get_mdposit_reference('P0DTC2', 'https://fake/api/') == None
+        assert other_lookups.pdb_to_uniprot('6VXX') == ['P0DTC2']
+        assert len(services.requests) == 4
+
+    def test_outdated_lookups(self, cache_filepath):
+        """Test outdated lookups are requested again"""
+        cache = LookupCache(cache_filepath, offline=False)
+        cache.set('uniprot', 'P0DTC2', { 'uniprot': 'P0DTC2' })
+        cache.set('mdposit', 'P0DTC2', None)
+        assert cache.get('uniprot', 'P0DTC2', ttl=100) == (True, { 'uniprot': 'P0DTC2' })
+        # Empty results expire sooner
+        assert cache.get('mdposit', 'P0DTC2', ttl=100, negative_ttl=100) == (True, None)
+        time.sleep(0.01)
+        assert cache.get('mdposit', 'P0DTC2', ttl=100, negative_ttl=0) == (False, None)
+        assert cache.get('uniprot', 'P0DTC2', ttl=0) == (False, None)
+
+    def test_offline(self, cache_filepath):
+        """Test services are never requested when offline"""
+        services = FakeReferenceServices()
+        online_lookups = ReferenceLookups(LookupCache(cache_filepath, offline=False), services)
+        online_lookups.get_uniprot_reference('P0DTC2')
+        offline_lookups = ReferenceLookups(LookupCache(cache_filepath, offline=True), services)
+        # Cached results are still available
+        assert offline_lookups.get_uniprot_reference('P0DTC2')['uniprot'] == 'P0DTC2'
+        # Missing results are None, but they can be told from actual empty results
+        assert online_lookups.has_blast(SEQUENCE)
+        assert not offline_lookups.has_blast(SEQUENCE)
+        assert offline_lookups.blast(SEQUENCE) == None
+        assert offline_lookups.pdb_to_uniprot('6VXX') == None
+        assert services.requests == [('uniprot', 'P0DTC2')]
+
+class TestMemoizedAlignments:
+    """Test identical alignments are done only once"""
+
+    @pytest.fixture
+    def counted_align(self, monkeypatch):
+        """Count actual alignments and start with no memoized alignments"""
+        calls = []
+        original_align = generate_map.align
+        def align(ref_sequence, new_sequence):
+            calls.append((ref_sequence, new_sequence))
+            return original_align(ref_sequence, new_sequence)
+        monkeypatch.setattr(generate_map, 'align', align)
+        monkeypatch.setattr(generate_map, 'memoized_alignments', {})
+        return calls
+
+    def test_alignments_are_memoized(self, cache_filepath, counted_align, monkeypatch):
+        """Test repeated alignments are taken from memory and from the cache in further runs"""
+        lookups = ReferenceLookups(LookupCache(cache_filepath, offline=False), FakeReferenceServices())
+        sequence_map, score = lookups.align(SEQUENCE, SEQUENCE[10:])
+        assert sequence_map == list(range(11, len(SEQUENCE) + 1))
+        # Same alignment as in a homo-oligomer
+        assert lookups.align(SEQUENCE, SEQUENCE[10:]) == (sequence_map, score)
+        assert len(counted_align) == 1
+        # A further run with no memoized alignments still gets the alignment from the cache
+        monkeypatch.setattr(generate_map, 'memoized_alignments', {})
+        other_lookups = ReferenceLookups(LookupCache(cache_filepath, offline=True), FakeReferenceServices())
+        assert other_lookups.align(SEQUENCE, SEQUENCE[10:]) == (sequence_map, score)
+        assert len(counted_align) == 1
+
+    def test_unrelated_sequences_are_not_aligned(self, cache_filepath, counted_align):
+        """Test sequences sharing no k-mer are discarded without aligning them"""
+        lookups = ReferenceLookups(LookupCache(cache_filepath, offline=False), FakeReferenceServices())
+        assert lookups.align(UNRELATED_SEQUENCE, SEQUENCE) == None
+        assert len(counted_align) == 0
+        # Unless the prefilter is disabled
+        assert lookups.align(UNRELATED_SEQUENCE, SEQUENCE, prefilter=False) == None
+        assert len(counted_align) == 1
@@ -0,0 +1,36 @@
+import pytest
+
+# The base module loads coordinate files with pandas
+pytest.importorskip("pandas")
+from model_workflow.tools.nassa_base import Base
+
+class FakeAnalysis(Base):
+    """Minimal analysis to run methods in parallel"""
+    def extract(self):
+        pass
+
+    def transform(self):
+        pass
+
+    def make_tables(self, data):
+        pass
+
+    def make_plots(self, data):
+        pass
+
+    def shift(self, value, offset):
+        return value + offset + self.unit_len
+
+class TestParallelMap:
+    """Test parallel calls give the same results than sequential calls"""
+
+    @pytest.mark.parametrize('cores', [1, 2])
+    def test_analysis_method(self, tmp_path, cores):
+        """Test analysis methods are run with the analysis state and keep the order"""
+        analysis = FakeAnalysis([], {}, str(tmp_path), 10, verbose=False, cores=cores)
+        assert analysis.parallel_map(analysis.shift, range(5), [100] * 5) == [110, 111, 112, 113, 114]
+
+    def test_module_function(self, tmp_path):
+        """Test module-level functions are also run in parallel"""
+        analysis = FakeAnalysis([], {}, str(tmp_path), 10, verbose=False, cores=2)
+        assert analysis.parallel_map(abs, [-1, -2, 3]) == [1, 2, 3]
@@ -0,0 +1,29 @@
+import pytest
+
+# Loaders need pandas to build series tables
+pytest.importorskip("pandas")
+from model_workflow.tools.nassa_loaders import load_serfile
+
+class TestSerFiles:
+    """Test .ser files are loaded, also when they are irregular"""
+
+    def test_regular_tail(self, tmp_path):
+        """Test the last rows are selected by the index in the last line"""
+        ser_file = tmp_path / 'shift.ser'
+        ser_file.write_text(''.join([ f'{frame} {frame * 0.5} {frame * 0.25}\n' for frame in range(1, 11) ]))
+        ser_data = load_serfile(str(ser_file), n_lines=3, use_cache=False)
+        assert list(ser_data.index) == [8, 9, 10]
+        # The cached table gives the same rows, once it is written and when it is read
+        assert list(load_serfile(str(ser_file), n_lines=3).index) == [8, 9, 10]
+        assert list(load_serfile(str(ser_file), n_lines=3).index) == [8, 9, 10]
+
+    @pytest.mark.parametrize('use_cache', [False, True])
+    def test_irregular_tail(self, tmp_path, use_cache):
+        """Test files with a non numeric last index are not rejected and they are returned whole"""
+        ser_file = tmp_path / 'shift.ser'
+        ser_file.write_text('1 0.5 0.6\n2 0.7\nend 0.1 0.2\n')
+        ser_data = load_serfile(str(ser_file), n_lines=2, use_cache=use_cache)
+        assert len(ser_data) == 3
+        assert str(ser_data.index[-1]) == 'end'
+        # Irregular files are not cached
+        assert not (tmp_path / 'shift.ser.cache.npz').exists()
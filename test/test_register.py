@@ -0,0 +1,144 @@
+import os
+import json
+import pytest
+from model_workflow.utils.file import File
+from model_workflow.utils.constants import REGISTER_FILENAME, LEGACY_REGISTER_FILENAME, GLOBALS
+from model_workflow.utils import register as register_module
+from model_workflow.utils.register import Register, get_file_fingerprint
+
+class TestRegister:
+    """Test the register is kept in a database and inherited by further runs"""
+
+    def test_updates_are_inherited(self, tmp_path):
+        """Test every update is written immediately and read by a further run"""
+        register_file = File(str(tmp_path / REGISTER_FILENAME))
+        register = Register(register_file)
+        register.update_cache('snapshots', 10)
+        register.update_test('intrmolsi', True)
+        register.update_test('stabonds', 'na')
+        register.add_warning('intrmolsi', 'First warning')
+        register.add_warning('intrmolsi', 'First warning')
+        register.add_warning('cohbonds', 'Second warning')
+        register.remove_warnings('cohbonds')
+        # Do not close the first register, as if the run was interrupted
+        other_register = Register(register_file)
+        assert other_register.cache == { 'snapshots': 10 }
+        assert other_register.tests == { 'intrmolsi': True, 'stabonds': 'na' }
+        assert other_register.warnings == [ { 'tag': 'intrmolsi', 'message': 'First warning' } ]
+        assert len(other_register.entries) == 2
+        other_register.reset_cache()
+        assert Register(register_file).cache == {}
+
+    def test_updates_are_single_writes(self, tmp_path):
+        """Test updates do not rewrite the whole register"""
+        register = Register(File(str(tmp_path / REGISTER_FILENAME)))
+        for index in range(100):
+            register.update_test(f'test{index}', True)
+        statements = []
+        register._connection.set_trace_callback(statements.append)
+        register.update_test('test0', False)
+        assert len([ statement for statement in statements if 'INSERT' in statement ]) == 1
+        assert not any('DELETE' in statement for statement in statements)
+
+    def test_missing_directory(self, tmp_path):
+        """Test nothing is written until the register directory exists"""
+        register_file = File(str(tmp_path / 'replica' / REGISTER_FILENAME))
+        register = Register(register_file)
+        register.update_test('intrmolsi', True)
+        assert not register_file.exists
+        (tmp_path / 'replica').mkdir()
+        register.add_warning('intrmolsi', 'A warning')
+        assert register_file.exists
+        other_register = Register(register_file)
+        assert other_register.tests == { 'intrmolsi': True }
+        assert other_register.warnings == [ { 'tag': 'intrmolsi', 'message': 'A warning' } ]
+
+    def test_legacy_register(self, tmp_path):
+        """Test registers in the legacy json format are imported"""
+        legacy_entries = [
+            { 'call': 'mwf run', 'date': '01-01-2024 00:00:00', 'cache': {}, 'tests': {}, 'warnings': [] },
+            { 'call': 'mwf run -i rmsds', 'date': '02-01-2024 00:00:00', 'mtimes': { 'structure.pdb': '01-01-2024 00:00:00' },
+                'cache': { 'snapshots': 10 }, 'tests': { 'intrmolsi': False },
+                'warnings': [ { 'tag': 'intrmolsi', 'message': 'A warning' }, { 'message': 'Old warning' } ] },
+        ]
+        with open(tmp_path / LEGACY_REGISTER_FILENAME, 'w') as file:
+            json.dump(legacy_entries, file)
+        register_file = File(str(tmp_path / REGISTER_FILENAME))
+        register = Register(register_file)
+        assert register.mtimes == { 'structure.pdb': '01-01-2024 00:00:00' }
+        assert register.cache == { 'snapshots': 10 }
+        assert register.tests == { 'intrmolsi': False }
+        assert register.warnings == [ { 'tag': 'intrmolsi', 'message': 'A warning' } ]
+        assert [ entry['call'] for entry in register.entries ] == [ 'mwf run', 'mwf run -i rmsds', register.call ]
+        # Further runs read the database and do not import the legacy register again
+        other_register = Register(register_file)
+        assert other_register.cache == { 'snapshots': 10 }
+        assert len(other_register.entries) == 4
+
+@pytest.fixture
+def trajectory_file(tmp_path):
+    """Write a file big enough to be sampled"""
+    trajectory_path = tmp_path / 'trajectory.xtc'
+    trajectory_path.write_bytes(os.urandom(64 * 1024))
+    return File(str(trajectory_path))
+
+def touch(target_file, delay=100):
+    """Change the modification time of a file but not its content"""
+    mtime = os.path.getmtime(target_file.path) + delay
+    os.utime(target_file.path, (mtime, mtime))
+
+class TestFingerprints:
+    """Test files are not considered modified when only their modification time changes"""
+
+    @pytest.fixture(autouse=True)
+    def small_blocks(self, monkeypatch):
+        monkeypatch.setattr(register_module, 'FINGERPRINT_BLOCK_SIZE', 1024)
+        monkeypatch.setattr(register_module, 'FINGERPRINT_BLOCKS', 4)
+        monkeypatch.setitem(GLOBALS, 'fingerprints', True)
+
+    def test_sampled_fingerprint(self, trajectory_file):
+        """Test fingerprints change with the sampled content and the size"""
+        fingerprint = get_file_fingerprint(trajectory_file.path)
+        assert fingerprint == get_file_fingerprint(trajectory_file.path)
+        assert fingerprint.split(':')[1] == str(64 * 1024)
+        assert get_file_fingerprint(trajectory_file.path, 'sha256').startswith('sha256:')
+        # Change the last block
+        with open(trajectory_file.path, 'r+b') as file:
+            file.seek(-10, os.SEEK_END)
+            file.write(b'0' * 10)
+        assert get_file_fingerprint(trajectory_file.path) != fingerprint
+        # Change the size
+        with open(trajectory_file.path, 'ab') as file:
+            file.write(b'0')
+        assert get_file_fingerprint(trajectory_file.path).split(':')[1] == str(64 * 1024 + 1)
+
+    def test_touched_file(self, tmp_path, trajectory_file):
+        """Test a touched file is not modified while a file with a new content is"""
+        register_file = File(str(tmp_path / REGISTER_FILENAME))
+        register = Register(register_file)
+        assert register.is_file_new(trajectory_file)
+        register.update_mtime(trajectory_file)
+        assert not register.is_file_modified(trajectory_file)
+        touch(trajectory_file)
+        # Check it from a further run
+        other_register = Register(register_file)
+        assert not other_register.is_file_modified(trajectory_file)
+        # The new modification time is registered so the fingerprint is not needed anymore
+        new_mtime, previous_mtime = other_register.get_mtime(trajectory_file)
+        assert new_mtime == previous_mtime
+        # Now change the content
+        with open(trajectory_file.path, 'r+b') as file:
+            file.write(b'0' * 10)
+        touch(trajectory_file, delay=200)
+        assert Register(register_file).is_file_modified(trajectory_file)
+
+    def test_disabled_fingerprints(self, tmp_path, trajectory_file):
+        """Test touched files are modified when fingerprints are disabled"""
+        register = Register(File(str(tmp_path / REGISTER_FILENAME)))
+        register.update_mtime(trajectory_file)
+        touch(trajectory_file)
+        GLOBALS['fingerprints'] = False
+        assert register.is_file_modified(trajectory_file)
+        # Outdated fingerprints are removed
+        register.update_mtime(trajectory_file)
+        assert trajectory_file.filename not in register.fingerprints
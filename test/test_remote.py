@@ -0,0 +1,247 @@
+import os
+import json
+import stat
+import base64
+import hashlib
+import pytest
+from fake_server import FakeServiceHandler, fake_server_fixture
+from model_workflow.utils.file import File
+from model_workflow.utils import remote as remote_module
+from model_workflow.utils.remote import Remote, download
+from model_workflow.utils import remote_cache as remote_cache_module
+from model_workflow.utils.remote_cache import RemoteCache
+from model_workflow.utils.constants import GLOBALS
+
+TEST_ACCESSION = "TEST0.1"
+# Make it big enough to be split in several segments
+FILE_CONTENT = os.urandom(4 * remote_module.MIN_SEGMENT_SIZE + 12345)
+
+class FakeDatabaseHandler(FakeServiceHandler):
+    """Fake database API serving project data and files with range support"""
+    defaults = {
+        # Server behaviour, modified by the tests
+        'support_ranges': True,
+        # Number of requests to be dropped after sending half of the requested data
+        'failures': 0,
+        # Number of requests to be answered with a 503 error
+        'errors': 0,
+        # Record every requested range
+        'requested_ranges': [],
+        # Count file requests which send data
+        'file_requests': 0,
+        # Content-MD5 header to be sent, if any
+        'content_md5': None,
+    }
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        cls = type(self)
+        if self.path == f'/rest/current/projects/{TEST_ACCESSION}':
+            body = json.dumps({'accession': TEST_ACCESSION}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+            return
+        if self.path != f'/rest/current/projects/{TEST_ACCESSION}/files/trajectory.xtc':
+            self.send_error(404)
+            return
+        if send_body:
+            with cls.lock:
+                cls.file_requests += 1
+                if cls.errors > 0:
+                    cls.errors -= 1
+                    self.send_error(503)
+                    return
+        start, end = 0, len(FILE_CONTENT) - 1
+        range_header = self.headers.get('Range')
+        is_partial = cls.support_ranges and range_header != None
+        if is_partial:
+            first, last = range_header.replace('bytes=', '').split('-')
+            start, end = int(first), int(last)
+            cls.requested_ranges.append((start, end))
+        body = FILE_CONTENT[start:end + 1]
+        self.send_response(206 if is_partial else 200)
+        if cls.support_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if is_partial:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(FILE_CONTENT)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"v1"')
+        if cls.content_md5:
+            self.send_header('Content-MD5', cls.content_md5)
+        self.end_headers()
+        if not send_body:
+            return
+        with cls.lock:
+            fail = cls.failures > 0
+            if fail:
+                cls.failures -= 1
+        # Send only half the data and drop the connection
+        if fail:
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+fake_database = fake_server_fixture(FakeDatabaseHandler, '/')
+
+@pytest.fixture(autouse=True)
+def reset_server(monkeypatch):
+    """Reset the fake server behaviour and avoid waiting between retries"""
+    FakeDatabaseHandler.reset()
+    monkeypatch.setattr(remote_module, 'RETRY_DELAY', 0)
+    # Never use the shared cache in tests
+    monkeypatch.setattr(remote_module, 'get_default_cache', lambda: None)
+
+class TestRemoteDownload:
+    """Test resumable parallel downloads from the remote database"""
+
+    def test_parallel_download(self, fake_database, tmp_path):
+        """Test the file is downloaded in several segments"""
+        remote = Remote(database_url=fake_database, accession=TEST_ACCESSION, connections=4)
+        output_file = File(str(tmp_path / 'trajectory.xtc'))
+        remote.download_file(output_file)
+        with open(output_file.path, 'rb') as file:
+            assert file.read() == FILE_CONTENT
+        assert len(FakeDatabaseHandler.requested_ranges) == 4
+        # Temporal files must be removed
+        assert not os.path.exists(output_file.path + '.part')
+        assert not os.path.exists(output_file.path + '.part.json')
+
+    def test_download_without_ranges(self, fake_database, tmp_path):
+        """Test the file is downloaded in one go when the server does not support ranges"""
+        FakeDatabaseHandler.support_ranges = False
+        output_path = str(tmp_path / 'trajectory.xtc')
+        download(f'{fake_database}rest/current/projects/{TEST_ACCESSION}/files/trajectory.xtc', output_path)
+        with open(output_path, 'rb') as file:
+            assert file.read() == FILE_CONTENT
+
+    def test_retry_dropped_connections(self, fake_database, tmp_path):
+        """Test dropped connections and server errors are retried from the last received byte"""
+        FakeDatabaseHandler.failures = 3
+        FakeDatabaseHandler.errors = 2
+        output_path = str(tmp_path / 'trajectory.xtc')
+        download(f'{fake_database}rest/current/projects/{TEST_ACCESSION}/files/trajectory.xtc', output_path)
+        with open(output_path, 'rb') as file:
+            assert file.read() == FILE_CONTENT
+        # Retried ranges must not start from the segment beginning again
+        starts = [ start for start, end in FakeDatabaseHandler.requested_ranges ]
+        assert len(starts) > 4
+        assert len(set(starts)) == len(starts)
+
+    def test_resume_download(self, fake_database, tmp_path):
+        """Test an interrupted download is resumed from the part file"""
+        url = f'{fake_database}rest/current/projects/{TEST_ACCESSION}/files/trajectory.xtc'
+        output_path = str(tmp_path / 'trajectory.xtc')
+        # Drop connections more times than retries so the first download is interrupted
+        FakeDatabaseHandler.failures = 100
+        with pytest.raises(Exception):
+            download(url, output_path, connections=1)
+        assert os.path.exists(output_path + '.part')
+        # Dropped connections sent part of the file before failing
+        state = json.load(open(output_path + '.part.json'))
+        done = state['segments'][0]['done']
+        assert 0 < done < len(FILE_CONTENT)
+        # Now the download must continue where it was left
+        FakeDatabaseHandler.failures = 0
+        FakeDatabaseHandler.requested_ranges = []
+        download(url, output_path, connections=1)
+        with open(output_path, 'rb') as file:
+            assert file.read() == FILE_CONTENT
+        assert FakeDatabaseHandler.requested_ranges == [(done, len(FILE_CONTENT) - 1)]
+
+    def test_wrong_checksum(self, fake_database, tmp_path):
+        """Test a download not matching the checksum is removed so it is not resumed further"""
+        url = f'{fake_database}rest/current/projects/{TEST_ACCESSION}/files/trajectory.xtc'
+        output_path = str(tmp_path / 'trajectory.xtc')
+        FakeDatabaseHandler.content_md5 = base64.b64encode(hashlib.md5(b'wrong').digest()).decode()
+        with pytest.raises(Exception, match='checksum'):
+            download(url, output_path, connections=2)
+        assert not os.path.exists(output_path)
+        assert not os.path.exists(output_path + '.part')
+        assert not os.path.exists(output_path + '.part.json')
+        # A further download starts again from scratch
+        FakeDatabaseHandler.content_md5 = base64.b64encode(hashlib.md5(FILE_CONTENT).digest()).decode()
+        FakeDatabaseHandler.requested_ranges = []
+        download(url, output_path, connections=2)
+        with open(output_path, 'rb') as file:
+            assert file.read() == FILE_CONTENT
+        assert len(FakeDatabaseHandler.requested_ranges) == 2
+
+    def test_missing_file(self, fake_database, tmp_path):
+        """Test a missing remote file is reported and not retried"""
+        remote = Remote(database_url=fake_database, accession=TEST_ACCESSION)
+        with pytest.raises(Exception, match='Missing remote file'):
+            remote.download_file(File(str(tmp_path / 'missing')))
+
+class TestRemoteCache:
+    """Test remote files are taken from the local cache when possible"""
+
+    def test_cached_download(self, fake_database, tmp_path):
+        """Test a file is downloaded only once and then linked from the cache"""
+        cache = RemoteCache(str(tmp_path / 'cache'))
+        remote = Remote(database_url=fake_database, accession=TEST_ACCESSION, cache=cache)
+        first_file = File(str(tmp_path / 'first' / 'trajectory.xtc'))
+        second_file = File(str(tmp_path / 'second' / 'trajectory.xtc'))
+        os.makedirs(first_file.basepath)
+        os.makedirs(second_file.basepath)
+        remote.download_file(first_file)
+        requests_count = FakeDatabaseHandler.file_requests
+        assert requests_count > 0
+        remote.download_file(second_file)
+        # No data was requested the second time
+        assert FakeDatabaseHandler.file_requests == requests_count
+        with open(second_file.path, 'rb') as file:
+            assert file.read() == FILE_CONTENT
+        # The file content is stored only once
+        assert os.path.samefile(first_file.path, second_file.path)
+
+    def test_cache_eviction(self, fake_database, tmp_path):
+        """Test the least recently used contents are removed when the cache is full"""
+        cache = RemoteCache(str(tmp_path / 'cache'), max_size=2 * 1024)
+        old_file = tmp_path / 'old'
+        old_file.write_bytes(b'0' * 1024)
+        new_file = tmp_path / 'new'
+        new_file.write_bytes(b'1' * 1024)
+        cache.store('old', str(old_file))
+        os.utime(cache.get_key_path('old'), (0, 0))
+        cache.store('new', str(new_file))
+        assert cache.find('old') and cache.find('new')
+        # Adding a third content exceeds the limit and the oldest one is removed
+        newest_file = tmp_path / 'newest'
+        newest_file.write_bytes(b'2' * 1024)
+        cache.store('newest', str(newest_file))
+        assert cache.find('old') == None
+        assert not os.path.exists(cache.get_key_path('old'))
+        assert cache.find('new') and cache.find('newest')
+
+    def test_linked_files_are_preserved(self, fake_database, tmp_path):
+        """Test using a cached content does not change linked files and linked files can not be modified"""
+        cache = RemoteCache(str(tmp_path / 'cache'))
+        remote = Remote(database_url=fake_database, accession=TEST_ACCESSION, cache=cache)
+        first_file = File(str(tmp_path / 'first' / 'trajectory.xtc'))
+        second_file = File(str(tmp_path / 'second' / 'trajectory.xtc'))
+        os.makedirs(first_file.basepath)
+        os.makedirs(second_file.basepath)
+        remote.download_file(first_file)
+        os.utime(first_file.path, (0, 0))
+        remote.download_file(second_file)
+        # The modification time of the first file is not changed when the content is used again
+        assert os.path.getmtime(first_file.path) == 0
+        # Cached contents are read only
+        assert not os.stat(second_file.path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+    def test_cache_is_opt_in(self, monkeypatch):
+        """Test the shared cache is only used when requested"""
+        assert remote_cache_module.get_default_cache() == None
+        monkeypatch.setattr(remote_cache_module, 'REMOTE_CACHE_DIRECTORY', '')
+        monkeypatch.setitem(GLOBALS, 'remote_cache', True)
+        assert remote_cache_module.get_default_cache() == None